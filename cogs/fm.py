@@ -1,20 +1,160 @@
 import asyncio
+import bisect
+import calendar
 import datetime
+import heapq
+import itertools
+import math
+import random
+import re
 import sqlite3
+import threading
 import time
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, namedtuple
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 from typing import Optional, Literal
 import aiohttp
 import json
 import os
 import yaml
+try:
+    import numpy as np
+except ImportError:  # .compatibility / .neighbours are unavailable without it
+    np = None
+from concurrent.futures import ThreadPoolExecutor
 
 LASTFM_API = 'https://ws.audioscrobbler.com/2.0/'
 USERS_FILE = '/home/jca/dev/python/sharebro/cogs/fm_users.json'
 DB_PATH    = '/home/jca/dev/python/sharebro/cogs/fm.db'
 
+# Shared HTTP pool for ws.audioscrobbler.com — one keep-alive session per cog
+HTTP_POOL_LIMIT     = 32    # total open connections
+HTTP_PER_HOST_LIMIT = 16    # connections to the Last.fm host
+HTTP_KEEPALIVE_SECS = 60    # idle keep-alive before a socket is closed
+HTTP_DNS_TTL_SECS   = 300   # resolver cache lifetime
+HTTP_TIMEOUT_SECS   = 30
+
+# fm.db access — one writer thread, a few reader threads, persistent connections
+DB_READERS = 3
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-32000',       # 32 MB page cache per connection
+    'PRAGMA mmap_size=268435456',     # 256 MB
+)
+
+# Last.fm request scheduling — shared token bucket with AIMD backoff
+PRIORITY_INTERACTIVE = 0   # commands someone is waiting on
+PRIORITY_BACKGROUND  = 1   # scrobble sync and other bulk work
+LASTFM_RATE_MAX      = 5.0   # requests/second ceiling (Last.fm asks for <= 5/s)
+LASTFM_RATE_MIN      = 0.5
+LASTFM_BURST         = 5     # tokens an idle bucket can bank
+LASTFM_RATE_STEP     = 0.05  # additive increase per successful request
+LASTFM_RATE_BACKOFF  = 0.5   # multiplicative decrease on 429 / error 29
+LASTFM_RETRIES       = 3     # retries of a throttled request before giving up
+
+# Last.fm response cache — TTL per lower-cased method; methods not listed are
+# never cached. Anything that returns a per-user playcount uses the short TTL.
+API_CACHE_TTLS = {
+    'artist.getinfo': 86400,
+    'album.getinfo':  86400,
+    'track.getinfo':  86400,
+    'artist.search':  7 * 86400,
+    'user.gettopartists': 600,
+    'user.gettopalbums':  600,
+    'user.gettoptracks':  600,
+    'user.getweeklyartistchart': 600,
+    'user.getweeklyalbumchart':  600,
+    'user.getweeklytrackchart':  600,
+}
+API_CACHE_USER_TTL    = 300               # lookups carrying a `username`
+API_CACHE_MAX_ENTRIES = 5000
+API_CACHE_MAX_BYTES   = 64 * 1024 * 1024  # approximate, measured as JSON text
+API_CACHE_PERSIST_TTL = 3600              # only entries living this long hit fm.db
+
+# A user's scrobble cache younger than this answers queries without the API
+CACHE_FRESH_SECS = 3600
+
+# Crowns go to a guild's top listener of an artist with at least this many plays
+CROWN_MIN_PLAYS = 30
+
+# Button-paged lists: rows per page, and how long the buttons stay live
+PAGE_SIZE     = 10
+PAGER_TIMEOUT = 180
+
+# Taste matching over each user's cached artist plays (needs numpy)
+TASTE_MIN_ARTISTS = 20    # users with fewer cached artists are left out
+TASTE_LEVELS      = 12    # weighted Jaccard weight: 1 + log2(plays), capped here
+TASTE_DENSE_MIN   = 48    # artists shared by this many users go through a matmul, rarer ones pair by pair
+TASTE_CHUNK       = 4096  # artist columns per dense block
+
+# Item-item artist recommendations, built from every cached user's artist plays
+REC_NEIGHBOURS    = 30    # neighbours kept per artist
+REC_MIN_LISTENERS = 3     # artists with fewer cached listeners get no neighbour list
+REC_SEEDS         = 50    # a user's most played artists that recommendations start from
+REC_CHUNK         = 256   # artists whose similarities are computed per block
+REC_CHUNK_ENTRIES = 1 << 21  # expanded plays + result cells per block, at most
+
+# Which registered users are in which guild. Stale entries are still served
+# and refreshed in the background; only never-seen users are fetched inline.
+GUILD_MEMBER_TTL        = 24 * 3600   # positive entries
+GUILD_NONMEMBER_TTL     = 6 * 3600    # negative entries
+GUILD_FETCH_CONCURRENCY = 8
+
+# Local artist-name resolution; artist.search is only the fallback.
+# Fuzzy matches need this trigram Jaccard similarity ("Zapp" vs "Zappa" is 0.57)
+ARTIST_FUZZY_THRESHOLD = 0.75
+
+# Slash-command autocomplete over known artists / albums / tracks
+AUTOCOMPLETE_SCAN        = 500    # prefix matches scored per keystroke, at most
+AUTOCOMPLETE_FAVOURITES  = 200    # a user's / guild's top items per kind, always considered
+AUTOCOMPLETE_USER_WEIGHT = 3      # a play by the invoking user counts this much more than a guild play
+AUTOCOMPLETE_WEIGHTS_TTL = 600    # seconds a user's / guild's play counts stay in memory
+AUTOCOMPLETE_WEIGHTS_MAX = 64     # users + guilds kept
+AUTOCOMPLETE_PENDING_MAX = 4096   # keys added since load held in a side list before merging
+
+# Background delta sync — every registered user is refreshed round-robin
+SYNC_INTERVAL_SECS    = 1800   # target gap between two syncs of one user
+SYNC_JITTER           = 0.2    # +/- fraction applied to every interval
+SYNC_MAX_BACKOFF_SECS = 6 * 3600
+SYNC_TICK_SECS        = 15     # how often the scheduler looks for due users
+SYNC_BUDGET_PER_HOUR  = 7200   # background Last.fm requests/hour (~2/s of the 5/s)
+SYNC_BUDGET_BURST     = 600
+
+# Failed sync pages: retried with exponential backoff, then parked as holes
+SYNC_PAGE_RETRIES    = 3
+SYNC_RETRY_BASE_SECS = 2.0     # 2s, 4s, 8s
+
+# Full imports split history into `from`/`to` windows fetched in parallel
+SYNC_FULL_IMPORT_MODE   = 'windows'   # or 'pages' for the sequential importer
+SYNC_WINDOW_TARGET      = 2000        # scrobbles per window (10 pages)
+SYNC_WINDOW_MIN_SECS    = 3600        # never split a window below an hour
+SYNC_WINDOW_MAX_SPLIT   = 16          # sub-windows per split
+SYNC_WINDOW_CONCURRENCY = 4           # windows in flight at once
+
+# Online migration of the pre-normalization text `scrobbles` table
+SCROBBLE_MIGRATE_CHUNK = 5000   # legacy rows moved per write transaction
+SCROBBLE_MIGRATE_PAUSE = 0.05   # seconds between chunks, so other writes interleave
+
+# Streaks: runs of consecutive plays of one artist / album / track over a
+# user's whole cached history. Runs this long or longer are kept for the
+# all-time leaderboards.
+STREAK_KINDS   = ('artist', 'album', 'track')
+STREAK_MIN_RUN = 5
+
+# Time buckets for the *_period_plays rollups (UTC): grain -> strftime format.
+# Buckets are stored as integers, e.g. day 20190301, month 201903, year 2019.
+ROLLUP_GRAINS = {
+    'day':   '%Y%m%d',
+    'month': '%Y%m',
+    'year':  '%Y',
+}
+
 PERIODS = {
     'week':   '7day',
     'month':  '1month',
@@ -25,6 +165,7 @@ PERIODS = {
 }
 
 Period = Literal['week', 'month', '3month', '6month', 'year', 'all']
+StreakKind = Literal['artist', 'album', 'track']
 
 
 def load_config(config_file='/home/jca/dev/python/sharebro/config.yaml'):
@@ -32,9 +173,205 @@ def load_config(config_file='/home/jca/dev/python/sharebro/config.yaml'):
         return yaml.safe_load(f)
 
 
-def _init_db(db_path):
-    """Create users table and migrate from JSON if needed."""
-    con = sqlite3.connect(db_path)
+def _fold(text):
+    """Case-folded lookup key for artist / album / track names."""
+    return (text or '').strip().casefold()
+
+
+def _compact_key(text):
+    """Looser match key than _fold: accents stripped, only letters and
+    digits kept, so 'AC/DC' ~ 'acdc' and 'Björk' ~ 'bjork'."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if c.isalnum())
+
+
+def _trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _duration(secs):
+    """Rough length of `secs`, in the largest whole unit: '12 min', '5 h', '40 d'."""
+    if secs < 3600:
+        return f'{secs // 60} min'
+    if secs < 86400:
+        return f'{secs // 3600} h'
+    return f'{secs // 86400:,} d'
+
+
+def _cache_age(synced_at):
+    """Footer text saying when a user's scrobble cache was last synced."""
+    if not synced_at:
+        return 'Cache never synced'
+    age = max(0, int(time.time()) - synced_at)
+    ago = 'just now' if age < 60 else f'{_duration(age)} ago'
+    stamp = datetime.datetime.utcfromtimestamp(synced_at).strftime('%-d %b %Y %H:%M UTC')
+    return f'Cache last updated {stamp} ({ago})'
+
+
+def _rollup_buckets(ts):
+    """[(grain, bucket), ...] a scrobble at unix time `ts` counts towards."""
+    t = time.gmtime(ts)
+    return [(grain, int(time.strftime(fmt, t))) for grain, fmt in ROLLUP_GRAINS.items()]
+
+
+def _parse_recent_tracks(data):
+    """(artist, track, album, uts) rows from a user.getRecentTracks page,
+    skipping the now-playing entry and undated scrobbles."""
+    tracks = data.get('recenttracks', {}).get('track', [])
+    if isinstance(tracks, dict):
+        tracks = [tracks]
+    rows = []
+    for t in tracks:
+        if t.get('@attr', {}).get('nowplaying') == 'true':
+            continue
+        uts = t.get('date', {}).get('uts')
+        if not uts or int(uts) < 1000000000:
+            continue
+        artist = t.get('artist', {}).get('#text', '') or ''
+        track  = t.get('name', '') or ''
+        album  = t.get('album', {}).get('#text', '') or ''
+        rows.append((artist, track, album, int(uts)))
+    return rows
+
+
+# Custom periods: inclusive UTC dates, answered from the *_period_plays rollups
+DateRange = namedtuple('DateRange', 'first last label')
+
+ONE_DAY = datetime.timedelta(days=1)
+
+# Named spans: first month and length in months. Seasons are meteorological
+# (northern hemisphere); winter 2019 is December 2019 to February 2020.
+NAMED_SPANS = {name.casefold(): (i, 1) for i, name in enumerate(calendar.month_name) if name}
+NAMED_SPANS.update({name.casefold(): (i, 1) for i, name in enumerate(calendar.month_abbr) if name})
+NAMED_SPANS.update({'spring': (3, 3), 'summer': (6, 3), 'autumn': (9, 3), 'fall': (9, 3), 'winter': (12, 3)})
+
+PERIOD_DESCRIPTION = 'week, month, 3month, 6month, year, all, or a date range like 2019-03 or last summer'
+PERIOD_HELP = (
+    'Use week, month, 3month, 6month, year, all, or a date range like '
+    '`2019-03-01..2019-06-30`, `2019-03`, `march 2019`, `last summer` or `last 30 days`.'
+)
+
+
+def _month_end(year, month):
+    return datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def _named_span(year, month, months):
+    """(first, last) dates of `months` months starting at year-month."""
+    end_month = month + months - 1
+    return datetime.date(year, month, 1), _month_end(year + (end_month - 1) // 12, (end_month - 1) % 12 + 1)
+
+
+def _date_span(text, today):
+    """(first, last, label) for one date expression, relative to `today`.
+    Raises ValueError if it isn't one."""
+    m = re.fullmatch(r'(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?', text)
+    if m:
+        year, month, day = (int(g) if g else None for g in m.groups())
+        if day:
+            d = datetime.date(year, month, day)
+            return d, d, d.strftime('%-d %B %Y')
+        if month:
+            first = datetime.date(year, month, 1)
+            return first, _month_end(year, month), first.strftime('%B %Y')
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31), str(year)
+    if text in ('today', 'yesterday'):
+        d = today - ONE_DAY * (text == 'yesterday')
+        return d, d, d.strftime('%-d %B %Y')
+    m = re.fullmatch(r'(?:last|past) (\d+) (day|week)s?', text)
+    if m:
+        days = int(m.group(1)) * (7 if m.group(2) == 'week' else 1)
+        if days < 1:
+            raise ValueError(text)
+        return today - ONE_DAY * (days - 1), today, f'the {text}'
+    m = re.fullmatch(r'(this|last) (week|month|year)', text)
+    if m:
+        back = m.group(1) == 'last'
+        if m.group(2) == 'week':
+            first = today - ONE_DAY * (today.weekday() + 7 * back)
+            return first, first + ONE_DAY * 6, first.strftime('the week of %-d %B %Y')
+        if m.group(2) == 'month':
+            year, month = (today.year, today.month) if not back else \
+                (today.year - (today.month == 1), (today.month - 2) % 12 + 1)
+            first = datetime.date(year, month, 1)
+            return first, _month_end(year, month), first.strftime('%B %Y')
+        year = today.year - back
+        return datetime.date(year, 1, 1), datetime.date(year, 12, 31), str(year)
+    m = re.fullmatch(r'(?:(this|last) )?([a-z]+)(?: (\d{4}))?', text)
+    if m and m.group(2) in NAMED_SPANS and not (m.group(1) and m.group(3)):
+        which, name, year = m.groups()
+        month, months = NAMED_SPANS[name]
+        if year:
+            year = int(year)
+        elif which == 'this':
+            year = today.year
+        else:
+            # The latest one that has started, or with "last", that has ended
+            year = next(y for y in range(today.year, today.year - 3, -1)
+                        if _named_span(y, month, months)[which == 'last'] < today
+                        or (which is None and _named_span(y, month, months)[0] <= today))
+        first, last = _named_span(year, month, months)
+        label = f'{name} {year}' if months > 1 else first.strftime('%B %Y')
+        return first, last, label
+    raise ValueError(text)
+
+
+def _parse_period(text, today=None):
+    """One of the fixed PERIODS keys, or a DateRange for anything else:
+    `2019`, `2019-03`, `2019-03-01`, `a..b` between any two of those (b may
+    be left off for "until today"), month and season names with or without
+    a year, `last summer`, `this month`, `last 30 days`, ... Ranges are
+    clipped to today. Raises ValueError with a usage message otherwise."""
+    text = ' '.join(text.casefold().split())
+    if text in PERIODS:
+        return text
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    try:
+        if '..' in text:
+            a, _, b = (part.strip() for part in text.partition('..'))
+            first = _date_span(a, today)[0]
+            last = _date_span(b, today)[1] if b else today
+            label = f'{first.isoformat()} – {last.isoformat()}'
+        else:
+            first, last, label = _date_span(text, today)
+    except ValueError:
+        raise ValueError(f'Unknown period `{text}`. {PERIOD_HELP}') from None
+    last = min(last, today)
+    if first > last:
+        raise ValueError(f'`{text}` is empty or in the future. {PERIOD_HELP}')
+    return DateRange(first, last, label)
+
+
+def _range_bounds(rng):
+    """[start, end) unix timestamps of a DateRange."""
+    return calendar.timegm(rng.first.timetuple()), calendar.timegm((rng.last + ONE_DAY).timetuple())
+
+
+def _range_slices(first, last):
+    """[(grain, from_bucket, to_bucket)] covering first..last with as few
+    rollup rows as possible: whole years, then whole months, then the
+    ragged days at either end. Bucket spans may step over numbers that are
+    not real months or days (201913); no rollup row has those."""
+    if first > last:
+        return []
+    y0 = first.year + (first != datetime.date(first.year, 1, 1))
+    y1 = last.year - (last != datetime.date(last.year, 12, 31))
+    if y0 <= y1:
+        return (_range_slices(first, datetime.date(y0, 1, 1) - ONE_DAY) + [('year', y0, y1)]
+                + _range_slices(datetime.date(y1 + 1, 1, 1), last))
+    m0 = first.year * 12 + first.month - 1 + (first.day != 1)
+    m1 = last.year * 12 + last.month - 1 - (last != _month_end(last.year, last.month))
+    if m0 <= m1:
+        start, end = datetime.date(m0 // 12, m0 % 12 + 1, 1), _month_end(m1 // 12, m1 % 12 + 1)
+        return (_range_slices(first, start - ONE_DAY)
+                + [('month', int(start.strftime('%Y%m')), int(end.strftime('%Y%m')))]
+                + _range_slices(end + ONE_DAY, last))
+    return [('day', int(first.strftime('%Y%m%d')), int(last.strftime('%Y%m%d')))]
+
+
+def _init_db(con):
+    """Create tables and migrate users from JSON if needed."""
     con.execute(
         'CREATE TABLE IF NOT EXISTS users '
         '(discord_id TEXT PRIMARY KEY, lastfm_username TEXT NOT NULL)'
@@ -45,20 +382,7 @@ def _init_db(db_path):
         'artist_display TEXT NOT NULL, discord_id TEXT NOT NULL, '
         'play_count INTEGER NOT NULL, PRIMARY KEY (guild_id, artist_name))'
     )
-    con.execute(
-        'CREATE TABLE IF NOT EXISTS scrobbles ('
-        '  lfm_username  TEXT    NOT NULL,'
-        '  artist        TEXT    NOT NULL,'
-        '  track         TEXT    NOT NULL,'
-        '  album         TEXT    NOT NULL DEFAULT "",'
-        '  scrobbled_at  INTEGER NOT NULL,'
-        '  PRIMARY KEY (lfm_username, scrobbled_at, artist, track)'
-        ')'
-    )
-    con.execute(
-        'CREATE INDEX IF NOT EXISTS idx_scrobbles_user_artist '
-        'ON scrobbles (lfm_username, LOWER(artist))'
-    )
+    _init_scrobbles(con)
     con.execute(
         'CREATE TABLE IF NOT EXISTS scrobble_sync ('
         '  lfm_username   TEXT    PRIMARY KEY,'
@@ -67,6 +391,86 @@ def _init_db(db_path):
         '  synced_at      INTEGER NOT NULL DEFAULT 0'
         ')'
     )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS api_cache ('
+        '  cache_key   TEXT    PRIMARY KEY,'
+        '  response    TEXT    NOT NULL,'
+        '  expires_at  INTEGER NOT NULL'
+        ')'
+    )
+    con.execute('DELETE FROM api_cache WHERE expires_at < ?', (int(time.time()),))
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS sync_progress ('
+        '  lfm_username  TEXT    PRIMARY KEY,'
+        '  from_ts       INTEGER NOT NULL,'
+        '  to_ts         INTEGER NOT NULL,'
+        '  total_pages   INTEGER NOT NULL,'
+        '  next_page     INTEGER NOT NULL,'
+        '  fetched       INTEGER NOT NULL DEFAULT 0,'
+        '  started_at    INTEGER NOT NULL,'
+        '  updated_at    INTEGER NOT NULL,'
+        "  mode          TEXT    NOT NULL DEFAULT 'pages'"
+        ')'
+    )
+    if 'mode' not in {r[1] for r in con.execute('PRAGMA table_info(sync_progress)')}:
+        con.execute("ALTER TABLE sync_progress ADD COLUMN mode TEXT NOT NULL DEFAULT 'pages'")
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS sync_windows ('
+        '  lfm_username  TEXT    NOT NULL,'
+        '  from_ts       INTEGER NOT NULL,'
+        '  to_ts         INTEGER NOT NULL,'
+        '  expected      INTEGER NOT NULL,'
+        '  done          INTEGER NOT NULL DEFAULT 0,'
+        '  fetched       INTEGER NOT NULL DEFAULT 0,'
+        '  PRIMARY KEY (lfm_username, from_ts)'
+        ') WITHOUT ROWID'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS sync_holes ('
+        '  lfm_username  TEXT    NOT NULL,'
+        '  from_ts       INTEGER NOT NULL,'
+        '  to_ts         INTEGER NOT NULL,'
+        '  page          INTEGER NOT NULL,'
+        '  attempts      INTEGER NOT NULL DEFAULT 1,'
+        '  last_error    TEXT    NOT NULL DEFAULT "",'
+        '  created_at    INTEGER NOT NULL,'
+        '  PRIMARY KEY (lfm_username, from_ts, to_ts, page)'
+        ')'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS sync_schedule ('
+        '  lfm_username  TEXT    PRIMARY KEY,'
+        '  next_run_at   INTEGER NOT NULL,'
+        '  last_run_at   INTEGER NOT NULL DEFAULT 0,'
+        '  failures      INTEGER NOT NULL DEFAULT 0'
+        ')'
+    )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_sync_schedule_due ON sync_schedule (next_run_at)')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS artist_aliases ('
+        '  query_key   TEXT    PRIMARY KEY,'
+        '  artist      TEXT    NOT NULL,'
+        '  updated_at  INTEGER NOT NULL'
+        ') WITHOUT ROWID'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS guild_members ('
+        '  guild_id      TEXT    NOT NULL,'
+        '  discord_id    TEXT    NOT NULL,'
+        '  is_member     INTEGER NOT NULL,'
+        '  display_name  TEXT    NOT NULL DEFAULT "",'
+        '  checked_at    INTEGER NOT NULL,'
+        '  PRIMARY KEY (guild_id, discord_id)'
+        ') WITHOUT ROWID'
+    )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_guild_members_user ON guild_members (discord_id, is_member)')
+    con.execute('CREATE INDEX IF NOT EXISTS idx_users_lfm ON users (lastfm_username)')
+    # Crown keys used to be LOWER()ed; fold() also handles non-ASCII case
+    _refold_crowns(con)
+    _init_crowns(con)
+    _init_rollups(con)
+    _init_streaks(con)
+    _init_recommendations(con)
     con.commit()
     if os.path.exists(USERS_FILE):
         try:
@@ -81,7 +485,1654 @@ def _init_db(db_path):
             os.rename(USERS_FILE, USERS_FILE + '.migrated')
         except Exception:
             pass
-    con.close()
+
+
+def _table_exists(con, name):
+    return con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _init_scrobbles(con):
+    """Scrobble cache as integer facts over interned dimension tables.
+
+    lfm_users / artists / albums / tracks hold each distinct name once, with
+    its fold() key precomputed; albums and tracks are scoped to their artist.
+    `scrobbles` itself is five integers per row. A cache still in the old
+    all-text layout is renamed to `scrobbles_legacy` and moved across in the
+    background by _migrate_scrobble_chunk. `scrobble_names` gives the text
+    view of the facts.
+    """
+    if 'artist' in {r[1] for r in con.execute('PRAGMA table_info(scrobbles)')}:
+        con.execute('ALTER TABLE scrobbles RENAME TO scrobbles_legacy')
+    for table, parent in (('lfm_users', ''), ('artists', ''),
+                          ('albums', 'artist_id INTEGER NOT NULL,'),
+                          ('tracks', 'artist_id INTEGER NOT NULL,')):
+        con.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            f'  id        INTEGER PRIMARY KEY,'
+            f'  {parent}'
+            f'  name      TEXT    NOT NULL,'
+            f'  name_key  TEXT    NOT NULL,'
+            f'  UNIQUE ({"artist_id, " if parent else ""}name)'
+            f')'
+        )
+        con.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_key ON {table} (name_key)')
+        if parent:
+            con.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_artist_key ON {table} (artist_id, name_key)')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS scrobbles ('
+        '  user_id       INTEGER NOT NULL,'
+        '  scrobbled_at  INTEGER NOT NULL,'
+        '  track_id      INTEGER NOT NULL,'
+        '  artist_id     INTEGER NOT NULL,'
+        '  album_id      INTEGER,'
+        '  PRIMARY KEY (user_id, scrobbled_at, track_id)'
+        ') WITHOUT ROWID'
+    )
+    # Covers .dd's first-play lookup outright (track_id rides along as part
+    # of the primary key); date ranges use the primary key itself.
+    con.execute('DROP INDEX IF EXISTS idx_scrobbles_user_artist_ts')
+    con.execute(
+        'CREATE INDEX IF NOT EXISTS idx_scrobbles_user_artist_first '
+        'ON scrobbles (user_id, artist_id, scrobbled_at, album_id)'
+    )
+    con.execute(
+        'CREATE VIEW IF NOT EXISTS scrobble_names AS '
+        'SELECT u.name AS lfm_username, a.name AS artist, t.name AS track, '
+        '       COALESCE(b.name, "") AS album, s.scrobbled_at '
+        'FROM scrobbles s '
+        'JOIN lfm_users u ON u.id = s.user_id '
+        'JOIN artists a ON a.id = s.artist_id '
+        'JOIN tracks t ON t.id = s.track_id '
+        'LEFT JOIN albums b ON b.id = s.album_id'
+    )
+
+
+def _intern(con, memo, table, name, artist_id=None):
+    """Id of `name` in a dimension table, adding it the first time it's seen.
+    `memo` caches ids for the duration of one transaction."""
+    key = (table, artist_id, name)
+    if key not in memo:
+        if artist_id is None:
+            con.execute(f'INSERT OR IGNORE INTO {table} (name, name_key) VALUES (?, ?)', (name, _fold(name)))
+            row = con.execute(f'SELECT id FROM {table} WHERE name = ?', (name,)).fetchone()
+        else:
+            con.execute(
+                f'INSERT OR IGNORE INTO {table} (artist_id, name, name_key) VALUES (?, ?, ?)',
+                (artist_id, name, _fold(name))
+            )
+            row = con.execute(
+                f'SELECT id FROM {table} WHERE artist_id = ? AND name = ?', (artist_id, name)
+            ).fetchone()
+        memo[key] = row[0]
+    return memo[key]
+
+
+def _scrobble_ids(con, memo, lfm, artist, track, album):
+    """(user_id, track_id, artist_id, album_id) for one scrobble row."""
+    artist_id = _intern(con, memo, 'artists', artist)
+    return (
+        _intern(con, memo, 'lfm_users', lfm),
+        _intern(con, memo, 'tracks', track, artist_id),
+        artist_id,
+        _intern(con, memo, 'albums', album, artist_id) if album else None,
+    )
+
+
+# Interned id lookups. The rollups key an artist / album / track fold() key
+# on the lowest id among the names sharing it; ids only grow, so that id
+# never changes once the key has been seen.
+SQL_USER_ID = 'SELECT id FROM lfm_users WHERE name = ?'
+SQL_ARTIST_ID = 'SELECT MIN(id) FROM artists WHERE name_key = ?'
+SQL_ALBUM_ID = (
+    'SELECT MIN(id) FROM albums '
+    'WHERE artist_id IN (SELECT id FROM artists WHERE name_key = ?) AND name_key = ?'
+)
+SQL_TRACK_ID = (
+    'SELECT MIN(id) FROM tracks '
+    'WHERE artist_id IN (SELECT id FROM artists WHERE name_key = ?) AND name_key = ?'
+)
+ROLLUP_KEY_IDS = {'artist': SQL_ARTIST_ID, 'album': SQL_ALBUM_ID, 'track': SQL_TRACK_ID}
+
+
+def _key_id(con, memo, kind, *keys):
+    """Rollup id of an artist key, or an (artist key, name key) album or
+    track, once its names are interned. `memo` caches ids for one transaction."""
+    if (kind,) + keys not in memo:
+        memo[(kind,) + keys] = con.execute(ROLLUP_KEY_IDS[kind], keys).fetchone()[0]
+    return memo[(kind,) + keys]
+
+
+def _migrate_scrobble_chunk(con, limit=SCROBBLE_MIGRATE_CHUNK):
+    """Move the oldest `limit` rows of scrobbles_legacy into the normalized
+    table; drops the legacy table once it's empty. Returns rows moved."""
+    rows = con.execute(
+        'SELECT rowid, lfm_username, artist, track, album, scrobbled_at '
+        'FROM scrobbles_legacy ORDER BY rowid LIMIT ?',
+        (limit,)
+    ).fetchall()
+    if not rows:
+        con.execute('DROP TABLE scrobbles_legacy')
+        return 0
+    memo = {}
+    con.executemany(
+        'INSERT OR IGNORE INTO scrobbles (user_id, track_id, artist_id, album_id, scrobbled_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [_scrobble_ids(con, memo, lfm, artist, track, album) + (ts,)
+         for _, lfm, artist, track, album, ts in rows]
+    )
+    con.execute('DELETE FROM scrobbles_legacy WHERE rowid <= ?', (rows[-1][0],))
+    return len(rows)
+
+
+ROLLUP_TABLES = (
+    'user_artist_plays', 'user_album_plays', 'user_track_plays', 'user_period_plays',
+    'user_artist_period_plays', 'user_album_period_plays', 'user_track_period_plays',
+)
+
+
+def _init_rollups(con):
+    """Per-user play-count rollups over the scrobble cache — all-time and
+    bucketed by day / month / year — kept current by _insert_scrobbles.
+
+    Rows hold nothing but integers: the lfm_users id and the rollup id of
+    the artist / album / track (see SQL_ARTIST_ID), with display names
+    joined from the dimension tables. Rollups from the text-keyed layout
+    are dropped, and each table is backfilled the first time it appears.
+    """
+    if 'lfm_username' in {r[1] for r in con.execute('PRAGMA table_info(user_artist_plays)')}:
+        for table in ROLLUP_TABLES:
+            con.execute(f'DROP TABLE IF EXISTS {table}')
+    existing = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for kind in ('artist', 'album', 'track'):
+        con.execute(
+            f'CREATE TABLE IF NOT EXISTS user_{kind}_plays ('
+            f'  user_id    INTEGER NOT NULL,'
+            f'  {kind}_id  INTEGER NOT NULL,'
+            f'  plays      INTEGER NOT NULL,'
+            f'  PRIMARY KEY (user_id, {kind}_id)'
+            f') WITHOUT ROWID'
+        )
+        con.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_user_{kind}_plays_{kind} '
+            f'ON user_{kind}_plays ({kind}_id, user_id, plays)'
+        )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS user_period_plays ('
+        '  user_id  INTEGER NOT NULL,'
+        '  grain    TEXT    NOT NULL,'
+        '  bucket   INTEGER NOT NULL,'
+        '  plays    INTEGER NOT NULL,'
+        '  PRIMARY KEY (user_id, grain, bucket)'
+        ') WITHOUT ROWID'
+    )
+    for kind in ('artist', 'album', 'track'):
+        con.execute(
+            f'CREATE TABLE IF NOT EXISTS user_{kind}_period_plays ('
+            f'  user_id    INTEGER NOT NULL,'
+            f'  grain      TEXT    NOT NULL,'
+            f'  bucket     INTEGER NOT NULL,'
+            f'  {kind}_id  INTEGER NOT NULL,'
+            f'  plays      INTEGER NOT NULL,'
+            f'  PRIMARY KEY (user_id, grain, bucket, {kind}_id)'
+            f') WITHOUT ROWID'
+        )
+    missing = [table for table in ROLLUP_TABLES if table not in existing]
+    if missing:
+        _backfill_rollups(con, missing)
+
+
+def _backfill_rollups(con, tables):
+    """Rebuild the given rollup tables from every cached scrobble, including
+    any still waiting in scrobbles_legacy (their names are interned first).
+    Facts are staged once with their rollup ids, via window MINs that match
+    SQL_ARTIST_ID / SQL_ALBUM_ID / SQL_TRACK_ID."""
+    facts = 'SELECT user_id, artist_id, album_id, track_id, scrobbled_at FROM scrobbles'
+    if _table_exists(con, 'scrobbles_legacy'):
+        for table, column in (('lfm_users', 'lfm_username'), ('artists', 'artist')):
+            con.execute(
+                f'INSERT OR IGNORE INTO {table} (name, name_key) '
+                f'SELECT DISTINCT {column}, fold({column}) FROM scrobbles_legacy'
+            )
+        for table, column, where in (('tracks', 'track', ''), ('albums', 'album', 'WHERE l.album != ""')):
+            con.execute(
+                f'INSERT OR IGNORE INTO {table} (artist_id, name, name_key) '
+                f'SELECT DISTINCT a.id, l.{column}, fold(l.{column}) FROM scrobbles_legacy l '
+                f'JOIN artists a ON a.name = l.artist {where}'
+            )
+        facts += (
+            ' UNION ALL SELECT u.id, a.id, b.id, t.id, l.scrobbled_at FROM scrobbles_legacy l '
+            'JOIN lfm_users u ON u.name = l.lfm_username '
+            'JOIN artists a ON a.name = l.artist '
+            'JOIN tracks t ON t.artist_id = a.id AND t.name = l.track '
+            'LEFT JOIN albums b ON b.artist_id = a.id AND b.name = l.album'
+        )
+    con.execute('CREATE TEMP TABLE rollup_artist_ids (id INTEGER PRIMARY KEY, key_id INTEGER NOT NULL)')
+    con.execute('INSERT INTO rollup_artist_ids SELECT id, MIN(id) OVER (PARTITION BY name_key) FROM artists')
+    for table in ('albums', 'tracks'):
+        con.execute(f'CREATE TEMP TABLE rollup_{table[:-1]}_ids (id INTEGER PRIMARY KEY, key_id INTEGER NOT NULL)')
+        con.execute(
+            f'INSERT INTO rollup_{table[:-1]}_ids '
+            f'SELECT x.id, MIN(x.id) OVER (PARTITION BY a.name_key, x.name_key) '
+            f'FROM {table} x JOIN artists a ON a.id = x.artist_id'
+        )
+    con.execute(
+        f'CREATE TEMP TABLE rollup_facts AS '
+        f'SELECT f.user_id, ar.key_id AS artist_id, al.key_id AS album_id, tr.key_id AS track_id, f.scrobbled_at '
+        f'FROM ({facts}) f '
+        f'JOIN rollup_artist_ids ar ON ar.id = f.artist_id '
+        f'JOIN rollup_track_ids tr ON tr.id = f.track_id '
+        f'LEFT JOIN rollup_album_ids al ON al.id = f.album_id'
+    )
+    for kind in ('artist', 'album', 'track'):
+        if f'user_{kind}_plays' in tables:
+            con.execute(
+                f'INSERT INTO user_{kind}_plays (user_id, {kind}_id, plays) '
+                f'SELECT user_id, {kind}_id, COUNT(*) FROM rollup_facts '
+                f'WHERE {kind}_id IS NOT NULL GROUP BY user_id, {kind}_id'
+            )
+    for grain, fmt in ROLLUP_GRAINS.items():
+        bucket = f"CAST(strftime('{fmt}', scrobbled_at, 'unixepoch') AS INTEGER)"
+        if 'user_period_plays' in tables:
+            con.execute(
+                f'INSERT INTO user_period_plays (user_id, grain, bucket, plays) '
+                f'SELECT user_id, ?, {bucket}, COUNT(*) FROM rollup_facts GROUP BY user_id, {bucket}',
+                (grain,)
+            )
+        for kind in ('artist', 'album', 'track'):
+            if f'user_{kind}_period_plays' in tables:
+                con.execute(
+                    f'INSERT INTO user_{kind}_period_plays (user_id, grain, bucket, {kind}_id, plays) '
+                    f'SELECT user_id, ?, {bucket}, {kind}_id, COUNT(*) FROM rollup_facts '
+                    f'WHERE {kind}_id IS NOT NULL GROUP BY user_id, {bucket}, {kind}_id',
+                    (grain,)
+                )
+    for table in ('rollup_facts', 'rollup_artist_ids', 'rollup_album_ids', 'rollup_track_ids'):
+        con.execute(f'DROP TABLE temp.{table}')
+
+
+def _init_streaks(con):
+    """Run-length streak state per user and kind, plus every run that
+    reached STREAK_MIN_RUN. Users with cached history are queued in
+    streak_dirty the first time the tables appear, so they are built on
+    their next sync rather than at startup."""
+    existing = _table_exists(con, 'streak_state')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS streak_state ('
+        '  lfm_username  TEXT    NOT NULL,'
+        '  kind          TEXT    NOT NULL,'
+        '  artist_key    TEXT    NOT NULL,'
+        '  item_key      TEXT    NOT NULL,'
+        '  artist        TEXT    NOT NULL,'
+        '  name          TEXT    NOT NULL,'
+        '  length        INTEGER NOT NULL,'
+        '  started_at    INTEGER NOT NULL,'
+        '  last_at       INTEGER NOT NULL,'
+        '  PRIMARY KEY (lfm_username, kind)'
+        ') WITHOUT ROWID'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS streak_runs ('
+        '  lfm_username  TEXT    NOT NULL,'
+        '  kind          TEXT    NOT NULL,'
+        '  started_at    INTEGER NOT NULL,'
+        '  artist_key    TEXT    NOT NULL,'
+        '  item_key      TEXT    NOT NULL,'
+        '  artist        TEXT    NOT NULL,'
+        '  name          TEXT    NOT NULL,'
+        '  length        INTEGER NOT NULL,'
+        '  ended_at      INTEGER NOT NULL,'
+        '  PRIMARY KEY (lfm_username, kind, started_at)'
+        ') WITHOUT ROWID'
+    )
+    con.execute(
+        'CREATE INDEX IF NOT EXISTS idx_streak_runs_length '
+        'ON streak_runs (lfm_username, kind, length)'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS streak_dirty ('
+        '  lfm_username  TEXT    PRIMARY KEY,'
+        '  from_ts       INTEGER NOT NULL'
+        ') WITHOUT ROWID'
+    )
+    if not existing:
+        con.execute('INSERT OR IGNORE INTO streak_dirty (lfm_username, from_ts) SELECT name, 0 FROM lfm_users')
+        if _table_exists(con, 'scrobbles_legacy'):
+            con.execute(
+                'INSERT OR IGNORE INTO streak_dirty (lfm_username, from_ts) '
+                'SELECT DISTINCT lfm_username, 0 FROM scrobbles_legacy'
+            )
+
+
+SQL_STREAK_PLAYS = (
+    'SELECT s.scrobbled_at, a.name, a.name_key, t.name, t.name_key, '
+    '       COALESCE(b.name, ""), COALESCE(b.name_key, "") '
+    'FROM scrobbles s '
+    'JOIN artists a ON a.id = s.artist_id '
+    'JOIN tracks t ON t.id = s.track_id '
+    'LEFT JOIN albums b ON b.id = s.album_id '
+    'WHERE s.user_id = (SELECT id FROM lfm_users WHERE name = ?) AND s.scrobbled_at > ? '
+    'ORDER BY s.scrobbled_at'
+)
+
+
+def _streak_plays(con, lfm, after_ts):
+    """lfm's cached plays later than after_ts (None for all of them), oldest
+    first, as (scrobbled_at, artist, artist_key, track, track_key, album,
+    album_key). Unmigrated legacy rows are merged in by timestamp."""
+    after_ts = -1 if after_ts is None else after_ts
+    plays = con.execute(SQL_STREAK_PLAYS, (lfm, after_ts))
+    if not _table_exists(con, 'scrobbles_legacy'):
+        return plays
+    legacy = con.execute(
+        'SELECT scrobbled_at, artist, fold(artist), track, fold(track), album, fold(album) '
+        'FROM scrobbles_legacy WHERE lfm_username = ? AND scrobbled_at > ? ORDER BY scrobbled_at',
+        (lfm, after_ts)
+    )
+    return heapq.merge(plays, legacy, key=lambda row: row[0])
+
+
+def _update_streaks(con, lfm):
+    """Bring lfm's streak_state and streak_runs up to date with the plays
+    queued in streak_dirty. Plays newer than the current state just extend
+    it; anything older (a full import, a repaired hole) replays the whole
+    history. Returns True if there was anything to do."""
+    dirty = con.execute('SELECT from_ts FROM streak_dirty WHERE lfm_username = ?', (lfm,)).fetchone()
+    if not dirty:
+        return False
+    state = {
+        kind: list(rest) for kind, *rest in con.execute(
+            'SELECT kind, artist_key, item_key, artist, name, length, started_at, last_at '
+            'FROM streak_state WHERE lfm_username = ?',
+            (lfm,)
+        )
+    }
+    last_at = max((s[6] for s in state.values()), default=None)
+    if last_at is None or dirty[0] <= last_at:
+        con.execute('DELETE FROM streak_state WHERE lfm_username = ?', (lfm,))
+        con.execute('DELETE FROM streak_runs WHERE lfm_username = ?', (lfm,))
+        state, last_at = {}, None
+
+    runs = []  # finished runs long enough to keep
+
+    def keep(kind, s):
+        if s[4] >= STREAK_MIN_RUN and s[3]:
+            runs.append((lfm, kind, s[5], s[0], s[1], s[2], s[3], s[4], s[6]))
+
+    for ts, artist, ak, track, tk, album, bk in _streak_plays(con, lfm, last_at):
+        for kind, key, name in (('artist', '', artist), ('album', bk, album), ('track', tk, track)):
+            s = state.get(kind)
+            if s and s[0] == ak and s[1] == key:
+                s[4] += 1
+                s[6] = ts
+                continue
+            if s:
+                keep(kind, s)
+            state[kind] = [ak, key, artist, name, 1, ts, ts]
+
+    for kind, s in state.items():
+        keep(kind, s)  # the runs still going are upserted as they grow
+    con.executemany(
+        'INSERT OR REPLACE INTO streak_runs '
+        '(lfm_username, kind, started_at, artist_key, item_key, artist, name, length, ended_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        runs
+    )
+    con.executemany(
+        'INSERT OR REPLACE INTO streak_state '
+        '(lfm_username, kind, artist_key, item_key, artist, name, length, started_at, last_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [(lfm, kind) + tuple(s) for kind, s in state.items()]
+    )
+    con.execute('DELETE FROM streak_dirty WHERE lfm_username = ?', (lfm,))
+    return True
+
+
+# The unary + keeps the planner from walking the user's whole history in
+# primary-key order; it seeks the artist's plays on the covering index.
+SQL_FIRST_SCROBBLE = (
+    'SELECT a.name, t.name, COALESCE(b.name, ""), s.scrobbled_at FROM scrobbles s '
+    'JOIN artists a ON a.id = s.artist_id '
+    'JOIN tracks t ON t.id = s.track_id '
+    'LEFT JOIN albums b ON b.id = s.album_id '
+    'WHERE s.user_id = (SELECT id FROM lfm_users WHERE name = ?) '
+    'AND s.artist_id IN (SELECT id FROM artists WHERE name_key = ?) '
+    'AND s.scrobbled_at >= 1000000000 ORDER BY +s.scrobbled_at ASC LIMIT 1'
+)
+
+def _year_slice_sql(n_users):
+    """Every yearly rollup row for n_users users in one stream, tagged by
+    kind: 0 totals, 1 artists, 2 albums, 3 tracks, as (kind, lfm, rollup
+    id, artist, name, plays). Parameters are the user names then the year,
+    repeated once per kind."""
+    in_year = (f"p.user_id IN (SELECT id FROM lfm_users WHERE name IN ({','.join('?' * n_users)})) "
+               f"AND p.grain = 'year' AND p.bucket = ?")
+    return (
+        f"SELECT 0, u.name, 0, '', '', p.plays FROM user_period_plays p "
+        f"JOIN lfm_users u ON u.id = p.user_id WHERE {in_year} "
+        f"UNION ALL SELECT 1, u.name, p.artist_id, a.name, '', p.plays FROM user_artist_period_plays p "
+        f"JOIN lfm_users u ON u.id = p.user_id JOIN artists a ON a.id = p.artist_id WHERE {in_year} "
+        f"UNION ALL SELECT 2, u.name, p.album_id, a.name, b.name, p.plays FROM user_album_period_plays p "
+        f"JOIN lfm_users u ON u.id = p.user_id JOIN albums b ON b.id = p.album_id "
+        f"JOIN artists a ON a.id = b.artist_id WHERE {in_year} "
+        f"UNION ALL SELECT 3, u.name, p.track_id, a.name, t.name, p.plays FROM user_track_period_plays p "
+        f"JOIN lfm_users u ON u.id = p.user_id JOIN tracks t ON t.id = p.track_id "
+        f"JOIN artists a ON a.id = t.artist_id WHERE {in_year}"
+    )
+
+
+def _year_report(con, lfms, year, top_n=5):
+    """Every section of a .year report from a single pass over the year's
+    rollup rows: sums are accumulated as rows stream past, then only the
+    top_n of each are picked out with heapq rather than sorting every group.
+
+    Returns (total, top_artists, top_albums, top_tracks, top_listener,
+    per_user) or None if nothing is cached for the year; per_user maps each
+    lfm name to its (top artist, plays).
+    """
+    totals = Counter()
+    sums = (None, Counter(), Counter(), Counter())  # by kind
+    names = {}                                      # (kind, rollup id) -> display names
+    per_user = {}
+    cur = con.execute(_year_slice_sql(len(lfms)), (list(lfms) + [year]) * 4)
+    for kind, lfm, key, artist, name, plays in cur:
+        if kind == 0:
+            totals[lfm] += plays
+            continue
+        sums[kind][key] += plays
+        names[kind, key] = (name, artist) if kind > 1 else (artist,)
+        if kind == 1 and plays > per_user.get(lfm, ('', 0))[1]:
+            per_user[lfm] = (artist, plays)
+
+    total = sum(totals.values())
+    if total == 0:
+        return None
+
+    def top(kind):
+        return [names[kind, key] + (plays,)
+                for key, plays in heapq.nlargest(top_n, sums[kind].items(), key=lambda kv: kv[1])]
+
+    top_listener = max(totals.items(), key=lambda kv: kv[1])
+    return total, top(1), top(2), top(3), top_listener, per_user
+
+
+# Per kind: rollup table, rollup id column, (name, artist) display columns
+# and the joins that supply them for `top.id`
+RANGE_TOP_SOURCES = {
+    'artist': ('user_artist_period_plays', 'artist_id', 'a.name, ""', 'JOIN artists a ON a.id = top.id'),
+    'album':  ('user_album_period_plays', 'album_id', 'b.name, a.name',
+               'JOIN albums b ON b.id = top.id JOIN artists a ON a.id = b.artist_id'),
+    'track':  ('user_track_period_plays', 'track_id', 't.name, a.name',
+               'JOIN tracks t ON t.id = top.id JOIN artists a ON a.id = t.artist_id'),
+}
+
+
+def _range_where(n_slices):
+    """SQL condition selecting one user's rollup buckets in n_slices
+    (grain, from, to) slices; parameters come from _range_params. The user
+    is repeated inside every OR term so each one is a primary-key range
+    search, not a walk over all of the user's rows."""
+    sql = ' OR '.join(f'(user_id = ({SQL_USER_ID}) AND grain = ? AND bucket BETWEEN ? AND ?)'
+                      for _ in range(n_slices))
+    return f'({sql})'
+
+
+def _range_params(lfm, slices):
+    return [p for s in slices for p in (lfm,) + s]
+
+
+def _range_total_sql(n_slices):
+    return f'SELECT COALESCE(SUM(plays), 0) FROM user_period_plays WHERE {_range_where(n_slices)}'
+
+
+def _range_top_sql(kind, n_slices, paged):
+    """Top `kind`s over n_slices slices, ordered by plays then rollup id,
+    both descending. Parameters: the slices, then (when paged) the previous
+    page's last cursor, then the limit."""
+    table, key, shown, joins = RANGE_TOP_SOURCES[kind]
+    having = 'HAVING (n, id) < (?, ?) ' if paged else ''
+    return (
+        f'SELECT {shown}, top.n, top.id FROM ('
+        f'  SELECT {key} AS id, SUM(plays) AS n FROM {table} WHERE {_range_where(n_slices)} '
+        f'  GROUP BY {key} {having}ORDER BY n DESC, id DESC LIMIT ?'
+        f') top {joins} ORDER BY top.n DESC, top.id DESC'
+    )
+
+
+def _range_total(con, lfm, rng):
+    """lfm's cached scrobbles within a DateRange."""
+    slices = _range_slices(rng.first, rng.last)
+    return con.execute(_range_total_sql(len(slices)), _range_params(lfm, slices)).fetchone()[0]
+
+
+def _range_top(con, lfm, kind, rng, limit, after=None):
+    """[(name, artist, plays, cursor)] of lfm's top `kind`s within a
+    DateRange, summed over its year / month / day buckets; artist is '' for
+    artists. Ordered by plays then rollup id, both descending, so a row's
+    cursor passed back as `after` starts the next page right after it."""
+    slices = _range_slices(rng.first, rng.last)
+    params = _range_params(lfm, slices) + list(after or ()) + [limit]
+    rows = con.execute(_range_top_sql(kind, len(slices), after is not None), params).fetchall()
+    return [(name, artist, n, (n, item)) for name, artist, n, item in rows]
+
+
+def _refold_crowns(con):
+    """Re-key crowns still under an old artist key to fold(artist). Keys that
+    fold together in a guild are merged first, keeping the crown with the
+    most plays, and crown_counts is recounted if any were dropped."""
+    stale = con.execute(
+        'SELECT rowid, guild_id, fold(artist_name), play_count FROM crowns WHERE artist_name != fold(artist_name)'
+    ).fetchall()
+    if not stale:
+        return
+    best = {}
+    for rowid, guild_id, ak, plays in stale + [
+        row for key in {(g, ak) for _, g, ak, _ in stale} for row in con.execute(
+            'SELECT rowid, guild_id, artist_name, play_count FROM crowns WHERE guild_id = ? AND artist_name = ?', key
+        )
+    ]:
+        best.setdefault((guild_id, ak), []).append((plays, -rowid))
+    dropped = [(-rowid,) for rows in best.values() for _, rowid in sorted(rows)[:-1]]
+    con.executemany('DELETE FROM crowns WHERE rowid = ?', dropped)
+    con.execute('UPDATE crowns SET artist_name = fold(artist_name) WHERE artist_name != fold(artist_name)')
+    if _table_exists(con, 'crown_events'):
+        con.execute('UPDATE crown_events SET artist_name = fold(artist_name) WHERE artist_name != fold(artist_name)')
+    if dropped and _table_exists(con, 'crown_counts'):
+        con.execute('DELETE FROM crown_counts')
+        con.execute(
+            'INSERT INTO crown_counts (guild_id, discord_id, crowns) '
+            'SELECT guild_id, discord_id, COUNT(*) FROM crowns GROUP BY guild_id, discord_id'
+        )
+
+
+def _init_crowns(con):
+    """Crown history and counters alongside `crowns`: held_since / steals
+    columns, the append-only crown_events log, and per-member crown_counts,
+    all kept current by _record_crowns. Crowns that predate the history
+    are dated to the migration."""
+    columns = {r[1] for r in con.execute('PRAGMA table_info(crowns)')}
+    if 'held_since' not in columns:
+        con.execute('ALTER TABLE crowns ADD COLUMN held_since INTEGER NOT NULL DEFAULT 0')
+        con.execute('UPDATE crowns SET held_since = ?', (int(time.time()),))
+    if 'steals' not in columns:
+        con.execute('ALTER TABLE crowns ADD COLUMN steals INTEGER NOT NULL DEFAULT 0')
+    # Ranked crown lists are paged by (play_count, artist_name) keyset
+    con.execute('DROP INDEX IF EXISTS idx_crowns_holder')
+    con.execute('DROP INDEX IF EXISTS idx_crowns_plays')
+    con.execute(
+        'CREATE INDEX IF NOT EXISTS idx_crowns_holder_rank ON crowns (guild_id, discord_id, play_count, artist_name)'
+    )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crowns_rank ON crowns (guild_id, play_count, artist_name)')
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crowns_held ON crowns (guild_id, held_since)')
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crowns_steals ON crowns (guild_id, steals)')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS crown_events ('
+        '  id               INTEGER PRIMARY KEY,'
+        '  guild_id         TEXT    NOT NULL,'
+        '  artist_name      TEXT    NOT NULL,'
+        '  artist_display   TEXT    NOT NULL,'
+        "  kind             TEXT    NOT NULL,"   # 'award' or 'steal'
+        '  discord_id       TEXT    NOT NULL,'
+        '  prev_discord_id  TEXT,'
+        '  play_count       INTEGER NOT NULL,'
+        '  held_for         INTEGER,'           # steals: how long the previous holder had it
+        '  at               INTEGER NOT NULL'
+        ')'
+    )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crown_events_artist ON crown_events (guild_id, artist_name, id)')
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crown_events_reign ON crown_events (guild_id, held_for)')
+    if not _table_exists(con, 'crown_counts'):
+        con.execute(
+            'CREATE TABLE crown_counts ('
+            '  guild_id    TEXT    NOT NULL,'
+            '  discord_id  TEXT    NOT NULL,'
+            '  crowns      INTEGER NOT NULL,'
+            '  PRIMARY KEY (guild_id, discord_id)'
+            ') WITHOUT ROWID'
+        )
+        con.execute(
+            'INSERT INTO crown_counts (guild_id, discord_id, crowns) '
+            'SELECT guild_id, discord_id, COUNT(*) FROM crowns GROUP BY guild_id, discord_id'
+        )
+    con.execute('CREATE INDEX IF NOT EXISTS idx_crown_counts_rank ON crown_counts (guild_id, crowns)')
+
+
+def _record_crowns(con, guild_id, changes, now=None):
+    """Write crown changes [(artist_key, artist_display, discord_id, plays)]
+    for a guild: a new crown is an 'award', a different holder a 'steal'
+    (both logged to crown_events and counted in crown_counts), and the same
+    holder just has the play count refreshed."""
+    now = now or int(time.time())
+    counts = Counter()
+    events = []
+    for ak, display, discord_id, plays in changes:
+        prev = con.execute(
+            'SELECT discord_id, held_since FROM crowns WHERE guild_id = ? AND artist_name = ?',
+            (guild_id, ak)
+        ).fetchone()
+        if prev is None:
+            con.execute(
+                'INSERT INTO crowns (guild_id, artist_name, artist_display, discord_id, play_count, held_since) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (guild_id, ak, display, discord_id, plays, now)
+            )
+            events.append((guild_id, ak, display, 'award', discord_id, None, plays, None, now))
+            counts[discord_id] += 1
+        elif prev[0] == discord_id:
+            con.execute(
+                'UPDATE crowns SET artist_display = ?, play_count = ? WHERE guild_id = ? AND artist_name = ?',
+                (display, plays, guild_id, ak)
+            )
+        else:
+            con.execute(
+                'UPDATE crowns SET artist_display = ?, discord_id = ?, play_count = ?, held_since = ?, '
+                'steals = steals + 1 WHERE guild_id = ? AND artist_name = ?',
+                (display, discord_id, plays, now, guild_id, ak)
+            )
+            events.append((guild_id, ak, display, 'steal', discord_id, prev[0], plays, now - prev[1], now))
+            counts[discord_id] += 1
+            counts[prev[0]] -= 1
+    con.executemany(
+        'INSERT INTO crown_events '
+        '(guild_id, artist_name, artist_display, kind, discord_id, prev_discord_id, play_count, held_for, at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        events
+    )
+    con.executemany(
+        'INSERT INTO crown_counts (guild_id, discord_id, crowns) VALUES (?, ?, ?) '
+        'ON CONFLICT (guild_id, discord_id) DO UPDATE SET crowns = crowns + excluded.crowns',
+        [(guild_id, discord_id, n) for discord_id, n in counts.items() if n]
+    )
+
+
+CrownDiff = namedtuple('CrownDiff', 'awarded stolen updated')
+
+
+def _crown_sql(n_members):
+    """Every crown-eligible artist among n_members guild members, with its
+    top listener, the current crown and the holder's rollup plays.
+    Parameters: (discord_id, lfm) per member, the play threshold, then the
+    guild id. Only members whose scrobble cache has been imported compete."""
+    members = ', '.join(['(?, ?)'] * n_members)
+    return (
+        f'WITH members (discord_id, lfm_username) AS (VALUES {members}), '
+        f'ranked AS ('
+        f'  SELECT p.artist_id, m.discord_id, p.plays, ROW_NUMBER() OVER ('
+        f'    PARTITION BY p.artist_id ORDER BY p.plays DESC, m.discord_id'
+        f'  ) AS rn '
+        f'  FROM members m '
+        f'  JOIN scrobble_sync s ON s.lfm_username = m.lfm_username '
+        f'  JOIN lfm_users mu ON mu.name = m.lfm_username '
+        f'  JOIN user_artist_plays p ON p.user_id = mu.id '
+        f'  WHERE p.plays >= ?'
+        f') '
+        f'SELECT a.name_key, a.name, r.discord_id, r.plays, '
+        f'       c.artist_display, c.discord_id, c.play_count, h.plays '
+        f'FROM ranked r '
+        f'JOIN artists a ON a.id = r.artist_id '
+        f'LEFT JOIN crowns c ON c.guild_id = ? AND c.artist_name = a.name_key '
+        f'LEFT JOIN users u ON u.discord_id = c.discord_id '
+        f'LEFT JOIN lfm_users hu ON hu.name = u.lastfm_username '
+        f'LEFT JOIN user_artist_plays h ON h.user_id = hu.id AND h.artist_id = r.artist_id '
+        f'WHERE r.rn = 1'
+    )
+
+
+def _recompute_crowns(con, guild_id, members, min_plays=CROWN_MIN_PLAYS):
+    """Recompute every crown in a guild from the artist rollups and write
+    the changes. `members` is [(discord_id, lfm)] for its registered members.
+
+    A challenger must beat the holder's plays outright, and the holder is
+    credited with the larger of their rollup count and the count recorded
+    with the crown, so a holder whose cache is behind (or who has none) is
+    not robbed by it. Crowns nobody now qualifies for are left alone.
+    Returns a CrownDiff: awarded [(artist, discord_id, plays)], stolen
+    [(artist, from_id, to_id, from_plays, to_plays)], updated count.
+    """
+    if not members:
+        return CrownDiff([], [], 0)
+    params = [p for member in members for p in member] + [min_plays, guild_id]
+    awarded, stolen, writes = [], [], []
+    updated = 0
+    for ak, artist, top_id, top_plays, display, holder_id, held_plays, holder_plays in \
+            con.execute(_crown_sql(len(members)), params):
+        if holder_id is None:
+            writes.append((ak, artist, top_id, top_plays))
+            awarded.append((artist, top_id, top_plays))
+        elif holder_id == top_id:
+            if top_plays != held_plays:
+                writes.append((ak, display, top_id, top_plays))
+                updated += 1
+        elif top_plays > max(holder_plays or 0, held_plays):
+            writes.append((ak, display, top_id, top_plays))
+            stolen.append((display, holder_id, top_id, max(holder_plays or 0, held_plays), top_plays))
+        elif holder_plays is not None and holder_plays > held_plays:
+            writes.append((ak, display, holder_id, holder_plays))
+            updated += 1
+    _record_crowns(con, guild_id, writes)
+    return CrownDiff(awarded, stolen, updated)
+
+
+
+TasteVector = namedtuple('TasteVector', 'ids plays')  # MusicIndex artist ids, sorted; play counts
+TasteMatrix = namedtuple('TasteMatrix', 'vectors lfms cosine jaccard')
+
+
+def _taste_similarity(vectors):
+    """(cosine, weighted Jaccard) N×N float arrays over N TasteVectors, with
+    a zero diagonal.
+
+    Cosine compares log1p(plays); weighted Jaccard (sum of mins over sum of
+    maxes) compares plays quantised to 1 + log2(plays) levels, so a few
+    huge counts can't drown everything else. Only artists two or more users
+    share add to either numerator, so the per-user norms and level sums are
+    taken first and the rest works over shared artists alone: those few
+    users share are enumerated pair by pair into the flat N×N accumulators,
+    those many share are packed into dense blocks of TASTE_CHUNK columns and
+    multiplied out, one matmul for cosine and one per level for the Jaccard
+    overlap (min(a, b) is the number of levels both reach).
+    """
+    n = len(vectors)
+    if n < 2:
+        return np.zeros((n, n)), np.zeros((n, n))
+    rows = np.repeat(np.arange(n), [len(v.ids) for v in vectors])
+    ids = np.concatenate([v.ids for v in vectors])
+    plays = np.concatenate([v.plays for v in vectors])
+    weight = np.log1p(plays).astype(np.float32)
+    level = np.minimum(TASTE_LEVELS, np.log2(plays).astype(np.int32) + 1).astype(np.float32)
+    norms = np.sqrt(np.bincount(rows, weight * weight, n))
+    sizes = np.bincount(rows, level, n)
+
+    # Group entries by artist; a stable sort keeps each group in user order
+    order = np.argsort(ids, kind='stable')
+    rows, ids, weight, level = rows[order], ids[order], weight[order], level[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ids)])
+
+    dot = np.zeros(n * n)
+    overlap = np.zeros(n * n)
+    for k in range(2, TASTE_DENSE_MIN):
+        first = starts[counts == k]
+        if not len(first):
+            continue
+        a, b = np.triu_indices(k, 1)
+        group = first[:, None] + np.arange(k)
+        ia, ib = group[:, a].ravel(), group[:, b].ravel()
+        pair = rows[ia] * n + rows[ib]
+        dot += np.bincount(pair, weight[ia] * weight[ib], n * n)
+        overlap += np.bincount(pair, np.minimum(level[ia], level[ib]), n * n)
+    dot = dot.reshape(n, n)
+    overlap = overlap.reshape(n, n)
+    dot += dot.T
+    overlap += overlap.T
+
+    heavy = counts >= TASTE_DENSE_MIN
+    columns = np.repeat(np.arange(np.count_nonzero(heavy)), counts[heavy])
+    entries = np.repeat(heavy, counts)
+    rows, weight, level = rows[entries], weight[entries], level[entries]
+    bounds = np.searchsorted(columns, np.arange(0, len(columns) and columns[-1] + 1, TASTE_CHUNK))
+    for lo, hi in zip(bounds, np.r_[bounds[1:], len(columns)]):
+        cols = columns[lo:hi] % TASTE_CHUNK
+        block = np.zeros((n, TASTE_CHUNK), np.float32)
+        block[rows[lo:hi], cols] = weight[lo:hi]
+        dot += block @ block.T
+        block[rows[lo:hi], cols] = level[lo:hi]
+        for t in range(1, TASTE_LEVELS + 1):
+            reached = block >= t
+            shared = np.count_nonzero(reached, axis=0) > 1
+            if not shared.any():
+                break
+            reached = reached[:, shared]
+            users = np.flatnonzero(reached.any(axis=1))
+            reached = reached[users].astype(np.float32)
+            overlap[np.ix_(users, users)] += reached @ reached.T
+
+    cosine = dot / np.maximum(np.outer(norms, norms), 1e-12)
+    jaccard = overlap / np.maximum(sizes[:, None] + sizes[None, :] - overlap, 1)
+    np.fill_diagonal(cosine, 0)
+    np.fill_diagonal(jaccard, 0)
+    return cosine, jaccard
+
+
+def _init_recommendations(con):
+    """Item-item neighbour lists: each artist's REC_NEIGHBOURS most similar
+    artists by cosine over every cached user's plays. Artists whose plays
+    changed wait in artist_neighbours_dirty, stamped with when they were
+    marked so a rebuild only clears the marks it saw. Every cached artist
+    is queued the first time the tables appear."""
+    existing = _table_exists(con, 'artist_neighbours')
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS artist_neighbours ('
+        '  artist_key     TEXT NOT NULL,'
+        '  neighbour_key  TEXT NOT NULL,'
+        '  score          REAL NOT NULL,'
+        '  PRIMARY KEY (artist_key, neighbour_key)'
+        ') WITHOUT ROWID'
+    )
+    con.execute(
+        'CREATE INDEX IF NOT EXISTS idx_artist_neighbours_reverse '
+        'ON artist_neighbours (neighbour_key, artist_key)'
+    )
+    con.execute(
+        'CREATE TABLE IF NOT EXISTS artist_neighbours_dirty ('
+        '  artist_key  TEXT    PRIMARY KEY,'
+        '  marked      INTEGER NOT NULL'
+        ') WITHOUT ROWID'
+    )
+    if not existing:
+        con.execute(
+            'INSERT OR IGNORE INTO artist_neighbours_dirty (artist_key, marked) '
+            'SELECT DISTINCT a.name_key, 0 FROM user_artist_plays p JOIN artists a ON a.id = p.artist_id'
+        )
+
+
+def _ranges(starts, lengths):
+    """Concatenated np.arange(start, start + length) for each pair."""
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+
+def _item_neighbours(vectors, targets, listed_by=None, floors=None):
+    """Rebuild the neighbour lists of `targets` (MusicIndex artist ids, or
+    None for every artist) from N users' TasteVectors.
+
+    Artists with at least REC_MIN_LISTENERS listeners form the columns of a
+    sparse N × artists matrix of log1p(plays), normalised per column and
+    held both by user (CSR) and by artist (CSC). A target's cosine to every
+    artist is the sum of its listeners' rows scaled by their weight for it,
+    so a block of targets expands those rows and adds them up in one
+    bincount. Blocks stop at REC_CHUNK targets or once expanded plays plus
+    result cells reach REC_CHUNK_ENTRIES, whichever comes first.
+
+    The other artists' lists are left to the caller, given what changes
+    them: `listed_by` maps a target to the artists whose lists hold it now,
+    `floors` an artist to the score a newcomer must beat to get on its list
+    (0 while it has room). Returns ({target: [(neighbour, score)] best
+    first}, [(artist, target, score)] for each of those pairs). Targets
+    below REC_MIN_LISTENERS come back with an empty list, and lists that
+    had to be rebuilt for a target's sake come back too.
+    """
+    lists = {} if targets is None else {int(t): [] for t in targets}
+    rescored = []
+    if not vectors:
+        return lists, rescored
+    rows = np.repeat(np.arange(len(vectors)), [len(v.ids) for v in vectors])
+    ids = np.concatenate([v.ids for v in vectors])
+    weight = np.log1p(np.concatenate([v.plays for v in vectors])).astype(np.float32)
+    artists, inverse, counts = np.unique(ids, return_inverse=True, return_counts=True)
+    eligible = counts >= REC_MIN_LISTENERS
+    entries = eligible[inverse]
+    rows, column, weight = rows[entries], (np.cumsum(eligible) - 1)[inverse][entries], weight[entries]
+    artists = artists[eligible]
+    weight /= np.maximum(np.sqrt(np.bincount(column, weight * weight, len(artists))), 1e-12)[column]
+    # Entries arrive grouped by user (CSR); a stable sort by column gives CSC
+    row_ptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=len(vectors)))]
+    by_col = np.argsort(column, kind='stable')
+    col_ptr = np.r_[0, np.cumsum(np.bincount(column, minlength=len(artists)))]
+    col_users, col_weight = rows[by_col], weight[by_col]
+    row_len = np.diff(row_ptr)
+    # Per target: the plays its block expands, plus its row of the result
+    work = np.bincount(column, row_len[rows], len(artists)) + len(artists)
+
+    targets = artists if targets is None else np.intersect1d(np.asarray(targets, dtype=artists.dtype), artists)
+    k = min(REC_NEIGHBOURS, len(artists) - 1)
+    if k < 1:
+        return lists, rescored
+    cols = np.searchsorted(artists, targets)
+    floor = np.zeros(len(artists), np.float32)
+    if floors:
+        known = np.fromiter(floors, artists.dtype, len(floors))
+        at = np.searchsorted(artists, known).clip(max=len(artists) - 1)
+        match = artists[at] == known
+        floor[at[match]] = np.fromiter(floors.values(), np.float32, len(floors))[match]
+    floor[cols] = np.inf  # rebuilt in full anyway
+
+    def similarities(chunk):
+        """len(chunk) × artists cosines: each listener's row, scaled."""
+        listeners = col_ptr[chunk + 1] - col_ptr[chunk]
+        at = _ranges(col_ptr[chunk], listeners)
+        users, scale = col_users[at], col_weight[at]
+        target = np.repeat(np.arange(len(chunk)), listeners)
+        at = _ranges(row_ptr[users], row_len[users])
+        spread = row_len[users]
+        return np.bincount(
+            np.repeat(target, spread) * len(artists) + column[at],
+            np.repeat(scale, spread) * weight[at],
+            len(chunk) * len(artists)
+        ).reshape(len(chunk), len(artists))
+
+    def rebuild(cols):
+        """Fill lists for the artists in `cols`, yielding (col, its
+        similarity row) as each is done."""
+        done = np.cumsum(work[cols])
+        lo = 0
+        while lo < len(cols):
+            budget = np.searchsorted(done, done[lo] - work[cols[lo]] + REC_CHUNK_ENTRIES, 'right')
+            chunk = cols[lo:max(lo + 1, min(lo + REC_CHUNK, budget))]
+            lo += len(chunk)
+            sims = similarities(chunk)
+            sims[np.arange(len(chunk)), chunk] = 0
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            for row, col in enumerate(chunk):
+                best = top[row][np.argsort(-sims[row, top[row]])]
+                lists[int(artists[col])] = [(int(artists[j]), float(sims[row, j])) for j in best if sims[row, j] > 0]
+                yield col, sims[row]
+
+    # A full list that holds a target but now scores it below its old floor
+    # may be missing an artist that outranks it: rebuild those too
+    redo = set()
+    for col, sims in rebuild(cols):
+        target = int(artists[col])
+        holders = np.asarray((listed_by or {}).get(target, ()), dtype=artists.dtype)
+        held = np.searchsorted(artists, holders).clip(max=len(artists) - 1)
+        held = held[(artists[held] == holders) & np.isfinite(floor[held])]
+        redo.update(held[sims[held] < floor[held]].tolist())
+        for j in np.union1d(held, np.flatnonzero(sims > floor)).tolist():
+            rescored.append((int(artists[j]), target, float(sims[j])))
+    for _ in rebuild(np.array(sorted(redo), dtype=cols.dtype)):
+        pass
+    return lists, rescored
+
+
+def _store_neighbours(con, lists, rescored, marks):
+    """Write rebuilt neighbour lists ({artist_key: [(neighbour_key, score)]})
+    and clear the dirty marks they answer ([(artist_key, marked)]).
+
+    Similarity is symmetric, so a rebuilt artist's new scores also change
+    other artists' lists: `rescored` ((artist_key, neighbour_key, score))
+    holds the fresh score of every entry that points at a rebuilt artist
+    and of every pair that beats the bottom of the other artist's list.
+    They are upserted and each list touched is cut back to its best
+    REC_NEIGHBOURS.
+    """
+    cur = con.cursor()
+    cur.executemany('DELETE FROM artist_neighbours WHERE artist_key = ?', [(ak,) for ak in lists])
+    cur.executemany(
+        'INSERT INTO artist_neighbours (artist_key, neighbour_key, score) VALUES (?, ?, ?)',
+        [(ak, nk, score) for ak, neighbours in lists.items() for nk, score in neighbours]
+    )
+    offered = [(ak, nk, score) for ak, nk, score in rescored if ak not in lists]
+    cur.executemany(
+        'INSERT INTO artist_neighbours (artist_key, neighbour_key, score) VALUES (?, ?, ?) '
+        'ON CONFLICT (artist_key, neighbour_key) DO UPDATE SET score = excluded.score',
+        offered
+    )
+    cur.executemany(
+        SQL_NEIGHBOUR_TRIM,
+        [(ak, ak, REC_NEIGHBOURS) for ak in {ak for ak, _, _ in offered}]
+    )
+    cur.executemany('DELETE FROM artist_neighbours_dirty WHERE artist_key = ? AND marked = ?', marks)
+
+
+# Read queries issued from the cog, kept here so the plan checks below run
+# exactly the SQL it executes
+SQL_SYNC_STATE = 'SELECT last_synced_ts, total_cached, synced_at FROM scrobble_sync WHERE lfm_username = ?'
+SQL_ARTIST_PLAYS = (
+    f'SELECT plays FROM user_artist_plays WHERE user_id = ({SQL_USER_ID}) AND artist_id = ({SQL_ARTIST_ID})'
+)
+SQL_CACHED_TOTAL = (
+    f"SELECT COALESCE(SUM(plays), 0) FROM user_period_plays WHERE user_id = ({SQL_USER_ID}) AND grain = 'year'"
+)
+SQL_FIRST_DAY = f"SELECT MIN(bucket) FROM user_period_plays WHERE user_id = ({SQL_USER_ID}) AND grain = 'day'"
+SQL_VERIFY_COUNTS = (
+    f"SELECT grain || ':' || bucket, plays FROM user_period_plays "
+    f"WHERE user_id = ({SQL_USER_ID}) AND grain IN ('year', 'month')"
+)
+SQL_TASTE_VECTOR = (
+    f'SELECT a.name_key, a.name, p.plays FROM user_artist_plays p JOIN artists a ON a.id = p.artist_id '
+    f'WHERE p.user_id = ({SQL_USER_ID})'
+)
+SQL_ARTIST_NEIGHBOURS = 'SELECT neighbour_key, score FROM artist_neighbours WHERE artist_key = ?'
+SQL_NEIGHBOUR_OF = 'SELECT artist_key FROM artist_neighbours WHERE neighbour_key = ?'
+SQL_NEIGHBOUR_TRIM = (
+    'DELETE FROM artist_neighbours WHERE artist_key = ? AND neighbour_key NOT IN ('
+    '  SELECT neighbour_key FROM artist_neighbours WHERE artist_key = ? ORDER BY score DESC LIMIT ?)'
+)
+SQL_STREAK = 'SELECT kind, artist, name, length, started_at FROM streak_state WHERE lfm_username = ?'
+SQL_USER_STREAKS = (
+    'SELECT artist, name, length, started_at FROM streak_runs '
+    'WHERE lfm_username = ? AND kind = ? ORDER BY length DESC LIMIT 10'
+)
+SQL_MEMBER_GUILDS = (
+    'SELECT DISTINCT gm.guild_id FROM users u '
+    'JOIN guild_members gm ON gm.discord_id = u.discord_id AND gm.is_member = 1 '
+    'WHERE u.lastfm_username = ?'
+)
+SQL_CROWN = (
+    'SELECT artist_display, discord_id, play_count, held_since FROM crowns '
+    'WHERE guild_id = ? AND artist_name = ?'
+)
+SQL_MEMBER_CROWN_COUNT = 'SELECT crowns FROM crown_counts WHERE guild_id = ? AND discord_id = ?'
+SQL_SERVER_CROWN_TOTAL = 'SELECT SUM(crowns) FROM crown_counts WHERE guild_id = ?'
+SQL_CROWN_COUNTS = (
+    'SELECT discord_id, crowns FROM crown_counts WHERE guild_id = ? AND crowns > 0 '
+    'ORDER BY crowns DESC LIMIT 15'
+)
+SQL_CURRENT_REIGNS = (
+    'SELECT artist_display, discord_id, held_since FROM crowns WHERE guild_id = ? '
+    'ORDER BY held_since LIMIT 10'
+)
+SQL_PAST_REIGNS = (
+    'SELECT artist_display, prev_discord_id, held_for, at FROM crown_events '
+    'WHERE guild_id = ? AND held_for IS NOT NULL ORDER BY held_for DESC LIMIT 10'
+)
+SQL_MOST_STOLEN = (
+    'SELECT artist_display, discord_id, steals FROM crowns WHERE guild_id = ? AND steals > 0 '
+    'ORDER BY steals DESC LIMIT 10'
+)
+SQL_CROWN_HISTORY = (
+    'SELECT artist_display, kind, discord_id, prev_discord_id, play_count, at FROM crown_events '
+    'WHERE guild_id = ? AND artist_name = ? ORDER BY id DESC LIMIT 15'
+)
+
+
+def _in_list(n):
+    return f'({",".join("?" * n)})'
+
+
+def _freshness_sql(n_users):
+    return f'SELECT lfm_username, synced_at FROM scrobble_sync WHERE lfm_username IN {_in_list(n_users)}'
+
+
+def _cached_plays_sql(kind, n_users):
+    """One artist's / album's / track's plays from its user_*_plays rollup
+    for n_users users. Parameters: the fold() keys (see ROLLUP_KEY_IDS),
+    then the user names."""
+    return (
+        f'SELECT u.name, p.plays FROM user_{kind}_plays p JOIN lfm_users u ON u.id = p.user_id '
+        f'WHERE p.{kind}_id = ({ROLLUP_KEY_IDS[kind]}) AND u.name IN {_in_list(n_users)}'
+    )
+
+
+def _server_streaks_sql(n_users):
+    return (
+        f'SELECT lfm_username, artist, name, length, started_at FROM streak_runs '
+        f'WHERE lfm_username IN {_in_list(n_users)} AND kind = ? ORDER BY length DESC LIMIT 10'
+    )
+
+
+def _crowns_page_sql(member, paged):
+    """A page of a guild's crowns, or one member's (`member`), by play
+    count then artist key, both descending. Parameters: guild id, [discord
+    id], [the previous page's last (play_count, artist_name)], limit."""
+    holder = 'AND discord_id = ? ' if member else ''
+    after = 'AND (play_count, artist_name) < (?, ?) ' if paged else ''
+    shown = 'artist_display' if member else 'artist_display, discord_id'
+    return (
+        f'SELECT {shown}, play_count, artist_name FROM crowns '
+        f'WHERE guild_id = ? {holder}{after}ORDER BY play_count DESC, artist_name DESC LIMIT ?'
+    )
+
+
+# Query-plan regression checks: every FM read path, in the shape the cog
+# issues it. _check_query_plans fails any that would scan a whole table or
+# index rather than search one, and FM_QUERY_INDEXES pins the index a query
+# must use where the primary key alone isn't enough. FM_QUERY_SCANS lists
+# the scans a query may do over its own CTEs and subqueries, never a table.
+# Entries are built from the same SQL constants and builders the cog runs;
+# tests/test_query_plans.py fails on any offender, cog_load logs them.
+FM_QUERY_INDEXES = {
+    'first scrobble': 'idx_scrobbles_user_artist_first',
+    'member crowns': 'idx_crowns_holder_rank',
+    'member crowns page': 'idx_crowns_holder_rank',
+    'server crowns': 'idx_crowns_rank',
+    'server crowns page': 'idx_crowns_rank',
+    'neighbour of': 'idx_artist_neighbours_reverse',
+}
+FM_QUERY_SCANS = {  # scanned alias; '(subquery-N)' -> '(subquery'
+    'crown recompute': ('m', 'r', '(subquery'),
+    'range top': ('top',),
+    'range top page': ('top',),
+}
+FM_QUERY_PLANS = {
+    'first scrobble': (SQL_FIRST_SCROBBLE, ('u', 'a')),
+    'sync state': (SQL_SYNC_STATE, ('u',)),
+    'artist plays': (SQL_ARTIST_PLAYS, ('u', 'a')),
+    'taste vector': (SQL_TASTE_VECTOR, ('u',)),
+    'artist neighbours': (SQL_ARTIST_NEIGHBOURS, ('a',)),
+    'neighbour of': (SQL_NEIGHBOUR_OF, ('a',)),
+    'neighbour trim': (SQL_NEIGHBOUR_TRIM, ('a', 'a', REC_NEIGHBOURS)),
+    'artist id': (SQL_ARTIST_ID, ('a',)),
+    'album id': (SQL_ALBUM_ID, ('a', 'b')),
+    'track id': (SQL_TRACK_ID, ('a', 't')),
+    'whoknows artist': (_cached_plays_sql('artist', 2), ('a', 'u', 'v')),
+    'whoknows album': (_cached_plays_sql('album', 2), ('a', 'b', 'u', 'v')),
+    'whoknows track': (_cached_plays_sql('track', 2), ('a', 't', 'u', 'v')),
+    'cached total': (SQL_CACHED_TOTAL, ('u',)),
+    'first day': (SQL_FIRST_DAY, ('u',)),
+    'verify counts': (SQL_VERIFY_COUNTS, ('u',)),
+    'freshness': (_freshness_sql(2), ('u', 'v')),
+    'year report': (_year_slice_sql(2), ('u', 'v', 2020) * 4),
+    'streak': (SQL_STREAK, ('u',)),
+    'user streaks': (SQL_USER_STREAKS, ('u', 'artist')),
+    'server streaks': (_server_streaks_sql(2), ('u', 'v', 'artist')),
+    'streak plays': (SQL_STREAK_PLAYS, ('u', 0)),
+    'range total': (_range_total_sql(2), ('u', 'year', 2019, 2019, 'u', 'day', 20200101, 20200115)),
+    'range top': (_range_top_sql('album', 2, False),
+                  ('u', 'month', 201903, 201906, 'u', 'day', 20190701, 20190715, 11)),
+    'range top page': (_range_top_sql('track', 2, True),
+                       ('u', 'month', 201903, 201906, 'u', 'day', 20190701, 20190715, 50, 7, 11)),
+    'member guilds': (SQL_MEMBER_GUILDS, ('u',)),
+    'crown recompute': (_crown_sql(2), ('1', 'u', '2', 'v', CROWN_MIN_PLAYS, 'g')),
+    'crown': (SQL_CROWN, ('g', 'a')),
+    'member crown count': (SQL_MEMBER_CROWN_COUNT, ('g', 'd')),
+    'member crowns': (_crowns_page_sql(True, False), ('g', 'd', PAGE_SIZE + 1)),
+    'member crowns page': (_crowns_page_sql(True, True), ('g', 'd', 50, 'a', PAGE_SIZE + 1)),
+    'server crowns': (_crowns_page_sql(False, False), ('g', PAGE_SIZE + 1)),
+    'server crowns page': (_crowns_page_sql(False, True), ('g', 50, 'a', PAGE_SIZE + 1)),
+    'server crown total': (SQL_SERVER_CROWN_TOTAL, ('g',)),
+    'crown counts': (SQL_CROWN_COUNTS, ('g',)),
+    'current reigns': (SQL_CURRENT_REIGNS, ('g',)),
+    'past reigns': (SQL_PAST_REIGNS, ('g',)),
+    'most stolen': (SQL_MOST_STOLEN, ('g',)),
+    'crown history': (SQL_CROWN_HISTORY, ('g', 'a')),
+}
+
+
+def _check_query_plans(con):
+    """[(query name, plan step)] for every FM_QUERY_PLANS entry that does a
+    full scan or misses its pinned index. Empty means every query is
+    index-driven."""
+    offenders = []
+    for name, (sql, params) in FM_QUERY_PLANS.items():
+        plan = [detail for _, _, _, detail in con.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        allowed = FM_QUERY_SCANS.get(name, ())
+        offenders += [(name, d) for d in plan
+                      if d.startswith('SCAN ') and 'CONSTANT ROW' not in d
+                      and d.split()[1].split('-')[0] not in allowed]
+        index = FM_QUERY_INDEXES.get(name)
+        if index and not any(index in d for d in plan):
+            offenders.append((name, f'does not use {index}'))
+    return offenders
+
+
+def _api_cache_ttl(params):
+    """Seconds a response to these params may be cached (0 = never)."""
+    method = str(params.get('method', '')).lower()
+    ttl = API_CACHE_TTLS.get(method, 0)
+    if ttl and 'username' in params:
+        return min(ttl, API_CACHE_USER_TTL)
+    return ttl
+
+
+def _api_cache_key(params):
+    """Normalized method + params: case-insensitive names, stable ordering."""
+    items = []
+    for k, v in params.items():
+        if k in ('api_key', 'format'):
+            continue
+        v = str(v).strip()
+        if k in ('method', 'artist', 'album', 'track', 'user', 'username'):
+            v = v.casefold()
+        items.append((k, v))
+    return json.dumps(sorted(items), ensure_ascii=False, separators=(',', ':'))
+
+
+# Stand-in for a discord.Member known only from the guild_members table
+CachedMember = namedtuple('CachedMember', 'id display_name')
+
+
+class ResponseCache:
+    """In-memory TTL + LRU cache of decoded Last.fm responses.
+
+    Bounded both by entry count and by the approximate size of the cached
+    JSON; least recently used entries are evicted first.
+    """
+
+    def __init__(self, max_entries=API_CACHE_MAX_ENTRIES, max_bytes=API_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = Counter()    # method -> count
+        self.misses = Counter()
+        self._entries = OrderedDict()  # key -> (expires_at, size, data)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, data, expires_at, size):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (expires_at, size, data)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+
+class FMDatabase:
+    """Awaitable access to fm.db without touching SQLite on the event loop.
+
+    Writes run on a single writer thread, so transactions never contend with
+    each other; reads fan out over a small pool of reader threads, which WAL
+    lets run alongside the writer. Each thread keeps its own persistent
+    connection with the pragmas in DB_PRAGMAS applied once.
+    """
+
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fm-db-write')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='fm-db-read')
+
+    def _connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            for pragma in DB_PRAGMAS:
+                con.execute(pragma)
+            con.create_function('fold', 1, _fold, deterministic=True)
+            self._local.con = con
+            with self._conns_lock:
+                self._conns.append(con)
+        return con
+
+    def _call(self, fn, args):
+        return fn(self._connection(), *args)
+
+    def _transaction(self, fn, args):
+        con = self._connection()
+        with con:  # commit on success, roll back on error
+            return fn(con, *args)
+
+    async def write(self, fn, *args):
+        """Run fn(con, *args) as one transaction on the writer thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._transaction, fn, args)
+
+    async def read(self, fn, *args):
+        """Run fn(con, *args) on a reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._call, fn, args)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda con: con.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda con: con.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        return await self.write(lambda con: con.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq):
+        return await self.write(lambda con: con.executemany(sql, seq).rowcount)
+
+    def close(self):
+        """Drain both pools and close every connection (blocking)."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._conns_lock:
+            for con in self._conns:
+                con.close()
+            self._conns.clear()
+
+
+class SingleFlight:
+    """Coalesces concurrent identical work.
+
+    The first run() for a key starts fn(*args) as a task; callers arriving
+    with the same key while it is in flight await that same task and get
+    its result (or exception). Callers are shielded from each other, so
+    one giving up doesn't cancel the work for the rest.
+    """
+
+    def __init__(self):
+        self.started = Counter()  # key kind -> runs started
+        self.joined = Counter()   # key kind -> callers that shared a run
+        self._inflight = {}
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    async def run(self, key, fn, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self.started[key[0]] += 1
+        else:
+            self.joined[key[0]] += 1
+        return await asyncio.shield(task)
+
+
+class ArtistIndex:
+    """In-memory index of every artist name the bot knows about: the cached
+    scrobbles plus previously resolved aliases.
+
+    lookup() tries, in order, a learned alias, the exact fold() key, the
+    compact key (punctuation / accents ignored), then a trigram fuzzy match
+    over compact keys, preferring the most-played artist on ties. The fuzzy
+    pass only scores keys whose trigram count could reach the threshold, and
+    only gathers them from the rarest of the query's trigrams.
+    """
+
+    def __init__(self):
+        self.aliases = {}    # fold(query) -> canonical name
+        self.names = {}      # fold(name) -> [display name, plays]
+        self.hits = Counter()  # how lookups were answered
+        self._compact = {}   # compact key -> fold key
+        self._grams = defaultdict(set)  # trigram -> compact keys
+        self._sizes = {}     # compact key -> number of trigrams
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, plays=0):
+        key = _fold(name)
+        if not key:
+            return
+        entry = self.names.get(key)
+        if entry is None:
+            self.names[key] = entry = [name, 0]
+        entry[1] += plays
+        compact = _compact_key(name)
+        if not compact:
+            return
+        other = self._compact.get(compact)
+        if other is None:
+            grams = _trigrams(compact)
+            self._sizes[compact] = len(grams)
+            for gram in grams:
+                self._grams[gram].add(compact)
+        if other is None or self.names[other][1] < entry[1]:
+            self._compact[compact] = key
+
+    def learn(self, query, name):
+        self.aliases[_fold(query)] = name
+        self.add(name)
+
+    def lookup(self, query):
+        key = _fold(query)
+        if key in self.aliases:
+            self.hits['alias'] += 1
+            return self.aliases[key]
+        if key in self.names:
+            self.hits['exact'] += 1
+            return self.names[key][0]
+        compact = _compact_key(query)
+        if not compact:
+            return None
+        if compact in self._compact:
+            self.hits['compact'] += 1
+            return self.names[self._compact[compact]][0]
+        grams = _trigrams(compact)
+        # Jaccard >= t needs the candidate's size within [t*a, a/t] and at
+        # least t*(a+b)/(1+t) shared trigrams, so anything that can match
+        # appears in one of the a - need + 1 shortest posting lists
+        t, a = ARTIST_FUZZY_THRESHOLD, len(grams)
+        lo, hi = math.ceil(t * a), math.floor(a / t)
+        need = math.ceil(t * (a + lo) / (1 + t))
+        postings = sorted((self._grams.get(gram, ()) for gram in grams), key=len)
+        probe, rest = postings[:a - need + 1], postings[a - need + 1:]
+        sizes = self._sizes
+        shared = Counter(c for posting in probe for c in posting if lo <= sizes[c] <= hi)
+        best, best_rank = None, None
+        for candidate, n in shared.items():
+            n += sum(candidate in posting for posting in rest)
+            score = n / (a + sizes[candidate] - n)
+            rank = (score, self.names[self._compact[candidate]][1])
+            if score >= ARTIST_FUZZY_THRESHOLD and (best_rank is None or rank > best_rank):
+                best, best_rank = candidate, rank
+        if best is None:
+            return None
+        self.hits['fuzzy'] += 1
+        return self.names[self._compact[best]][0]
+
+
+# One user's or guild's cached play counts for autocomplete ranking
+PlayWeights = namedtuple('PlayWeights', 'expires_at lfms weights favourites')
+
+
+class MusicIndex:
+    """Sorted prefix index over every artist, album and track in the
+    play-count rollups, for slash-command autocomplete.
+
+    Items are interned to integer ids; each kind keeps a sorted list of
+    (fold(search text), id) so a prefix is one bisect away. Albums and
+    tracks are searchable both as "Artist - Name" and by name alone.
+    add() keeps everything current as syncs insert rows: new keys go into a
+    small sorted side list per kind, which complete() also searches, and
+    are merged into the main list once AUTOCOMPLETE_PENDING_MAX pile up.
+    """
+
+    KINDS = ('artist', 'album', 'track')
+
+    def __init__(self):
+        self.labels = []   # id -> "Artist" / "Artist - Name"
+        self.kinds = []    # id -> kind
+        self.keys = []     # id -> (artist_key, name_key)
+        self.search = []   # id -> search texts
+        self.plays = []    # id -> plays across all cached users
+        self._ids = {}     # (kind, artist_key, name_key) -> id
+        self._keys = {kind: [] for kind in self.KINDS}
+        self._pending = {kind: [] for kind in self.KINDS}
+        self._bulk = False
+
+    def __len__(self):
+        return len(self.labels)
+
+    def load(self, rows):
+        """add() many (kind, artist_key, name_key, artist, name, plays) rows,
+        sorting the key lists once at the end instead of per insert."""
+        self._bulk = True
+        try:
+            for row in rows:
+                self.add(*row)
+        finally:
+            self._bulk = False
+            for keys in self._keys.values():
+                keys.sort()
+
+    def item_id(self, kind, artist_key, name_key=''):
+        return self._ids.get((kind, artist_key, name_key))
+
+    def add(self, kind, artist_key, name_key, artist, name, plays):
+        """Count `plays` towards an item, adding it first if it's new.
+        Returns its id."""
+        ident = (kind, artist_key, name_key)
+        item = self._ids.get(ident)
+        if item is None:
+            item = self._ids[ident] = len(self.labels)
+            self.labels.append(f'{artist} - {name}' if name_key else artist)
+            self.kinds.append(kind)
+            self.keys.append((artist_key, name_key))
+            self.plays.append(0)
+            self.search.append(tuple(t for t in {_fold(self.labels[item]), name_key} if t))
+            for text in self.search[item]:
+                if self._bulk:
+                    self._keys[kind].append((text, item))
+                else:
+                    bisect.insort(self._pending[kind], (text, item))
+            if len(self._pending[kind]) > AUTOCOMPLETE_PENDING_MAX:
+                self._merge(kind)
+        self.plays[item] += plays
+        return item
+
+    def _merge(self, kind):
+        """Splice the side list into the main key list: one bisect per
+        pending key, then slice copies, with no comparisons across the rest."""
+        keys, pending = self._keys[kind], self._pending[kind]
+        merged, prev = [], 0
+        for key in pending:
+            pos = bisect.bisect_left(keys, key, prev)
+            merged += keys[prev:pos]
+            merged.append(key)
+            prev = pos
+        merged += keys[prev:]
+        self._keys[kind] = merged
+        pending.clear()
+
+    def complete(self, kind, prefix, user_weights, guild_weights, favourites=(), limit=25):
+        """Labels of the best `limit` items of `kind` whose search text
+        starts with `prefix`, ranked by the invoking user's plays, then the
+        guild's, then everyone's. Only the first AUTOCOMPLETE_SCAN matches
+        in key order are scored, plus any matching `favourites` (the user's
+        and guild's most played ids), so short prefixes still surface them."""
+        def score(item):
+            return (user_weights.get(item, 0) * AUTOCOMPLETE_USER_WEIGHT + guild_weights.get(item, 0),
+                    self.plays[item])
+
+        prefix = _fold(prefix)
+        candidates = {item for item in favourites
+                      if self.kinds[item] == kind and any(t.startswith(prefix) for t in self.search[item])}
+        if prefix:
+            for keys in (self._keys[kind], self._pending[kind]):
+                start = bisect.bisect_left(keys, (prefix,))
+                for text, item in keys[start:start + AUTOCOMPLETE_SCAN]:
+                    if not text.startswith(prefix):
+                        break
+                    candidates.add(item)
+        return [self.labels[item] for item in heapq.nlargest(limit, candidates, key=score)]
+
+
+class LastfmLimiter:
+    """Process-wide token bucket shared by every Last.fm request.
+
+    Waiters are granted tokens in priority order (lowest first, FIFO within a
+    priority), so interactive commands jump ahead of background sync. The fill
+    rate follows AIMD: it creeps back up by LASTFM_RATE_STEP on each success
+    and halves — with a short pause — whenever Last.fm throttles us.
+    """
+
+    def __init__(self, rate=LASTFM_RATE_MAX, burst=LASTFM_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.granted = 0
+        self.granted_by_priority = Counter()
+        self.throttles = 0
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._pump_task = None
+
+    def pending(self, priority=None):
+        """Number of callers waiting for a token (optionally for one priority)."""
+        return sum(1 for p, _, fut in self._waiters
+                   if not fut.done() and (priority is None or p == priority))
+
+    async def acquire(self, priority=PRIORITY_INTERACTIVE):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = loop.create_task(self._pump())
+        await fut
+
+    async def _pump(self):
+        while self._waiters:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            wait = self._paused_until - now
+            if wait <= 0 and self._tokens >= 1:
+                priority, _, fut = heapq.heappop(self._waiters)
+                if fut.done():  # caller was cancelled while queued
+                    continue
+                self._tokens -= 1
+                self.granted += 1
+                self.granted_by_priority[priority] += 1
+                fut.set_result(None)
+                continue
+            if wait <= 0:
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + LASTFM_RATE_STEP)
+
+    def throttled(self, retry_after=None):
+        self.throttles += 1
+        self.rate = max(LASTFM_RATE_MIN, self.rate * LASTFM_RATE_BACKOFF)
+        self._tokens = 0.0
+        pause = retry_after if retry_after else 1.0 / self.rate
+        self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+
+class FMPager(discord.ui.View):
+    """Previous / next buttons over a long list, loaded one page at a time.
+
+    `fetch(cursor, page)` returns (embed, next_cursor) for the page that
+    starts at `cursor` (None for the first), with next_cursor None on the
+    last page. Only the visible page is ever loaded; the start cursors of
+    the pages behind it are kept so the previous button can go back. Only
+    whoever ran the command can turn pages.
+    """
+
+    def __init__(self, author_id, fetch):
+        super().__init__(timeout=PAGER_TIMEOUT)
+        self.author_id = author_id
+        self.fetch = fetch
+        self.cursors = [None]
+        self.next_cursor = None
+        self.message = None
+
+    async def start(self, ctx):
+        """Send the first page; returns False (sending nothing) if it's empty."""
+        embed, self.next_cursor = await self.fetch(None, 1)
+        if embed is None:
+            return False
+        if self.next_cursor is None:
+            await ctx.send(embed=embed)  # a single page needs no buttons
+            return True
+        self._update_buttons()
+        self.message = await ctx.send(embed=embed, view=self)
+        return True
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message(
+                'Only the person who ran the command can turn its pages.', ephemeral=True
+            )
+            return False
+        return True
+
+    @discord.ui.button(label='◀', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.cursors.pop()
+        await self._show(interaction)
+
+    @discord.ui.button(label='▶', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        self.cursors.append(self.next_cursor)
+        await self._show(interaction)
+
+    async def _show(self, interaction):
+        embed, self.next_cursor = await self.fetch(self.cursors[-1], len(self.cursors))
+        self._update_buttons()
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None
+
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
 
 
 class FM(commands.Cog):
@@ -89,143 +2140,850 @@ class FM(commands.Cog):
         self.bot = bot
         config = load_config()
         self.api_key = config['lastfm']['api_key']
-        _init_db(DB_PATH)
+        self.persist_api_cache = config['lastfm'].get('persist_cache', True)
+        self.db = FMDatabase(DB_PATH)
+        self.limiter = LastfmLimiter()
+        self.flights = SingleFlight()
+        self.artists = ArtistIndex()
+        self.music = MusicIndex()
+        self._lfm_names = {}  # discord id -> Last.fm username, for autocomplete
+        self._play_weights_cache = OrderedDict()  # ('user', lfm) / ('guild', id) -> PlayWeights
+        self._music_backlog = None  # new_plays rows seen while the music index loads
+        self._sync_watchers = defaultdict(list)  # lfm key -> progress callbacks of waiting callers
+        self.cache = ResponseCache()
+        self.session = None
+        self.plan_offenders = []
+        self._membership_refreshing = set()  # guild ids with a refresh in flight
+        self._year_reports = {}  # (guild_id, year) -> (frozenset of lfm names, report)
+        self._crowns_dirty = set()  # guild ids whose crowns need recomputing
+        self._taste_vectors = {}    # lfm -> TasteVector, dropped when a sync adds plays
+        self._taste_matrices = {}   # guild id -> TasteMatrix
+        self._recs_dirty = False    # artist_neighbours_dirty may have rows
+        self.revalidations = Counter()  # stale cached answers: 'run', 'edited', 'failed'
+        self._bg_tasks = set()
+        self._sync_budget = float(SYNC_BUDGET_BURST)
+        self._sync_budget_stamp = time.monotonic()
+
+    async def cog_load(self):
+        await self.db.write(_init_db)
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_PER_HOST_LIMIT,
+            keepalive_timeout=HTTP_KEEPALIVE_SECS,
+            ttl_dns_cache=HTTP_DNS_TTL_SECS,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECS),
+        )
+        self._sync_scheduler.start()
+        if await self.db.read(_table_exists, 'scrobbles_legacy'):
+            self._spawn(self._migrate_scrobbles())
+        self.plan_offenders = await self.db.read(_check_query_plans)
+        for name, detail in self.plan_offenders:
+            print(f'[FM] query plan regression in {name!r}: {detail}')
+        self._lfm_names = dict(await self._all_users())
+        await self._load_artist_index()
+        self._spawn(self._load_music_index())
+
+    async def cog_unload(self):
+        self._sync_scheduler.cancel()
+        for task in list(self._bg_tasks):
+            task.cancel()
+        if self.session:
+            await self.session.close()
+            self.session = None
+        await asyncio.to_thread(self.db.close)
+
+    def _spawn(self, coro):
+        """Run a fire-and-forget task, holding a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
 
     # ------------------------------------------------------------------ #
     #  DB helpers                                                          #
     # ------------------------------------------------------------------ #
-    def _get_lfm(self, user):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
+    async def _get_lfm(self, user):
+        row = await self.db.fetchone(
             'SELECT lastfm_username FROM users WHERE discord_id = ?',
             (str(user.id),)
-        ).fetchone()
-        con.close()
+        )
         return row[0] if row else None
 
-    def _set_lfm(self, user_id, username):
-        con = sqlite3.connect(DB_PATH)
-        con.execute(
+    async def _set_lfm(self, user_id, username):
+        await self.db.execute(
             'INSERT OR REPLACE INTO users (discord_id, lastfm_username) VALUES (?, ?)',
             (str(user_id), username)
         )
-        con.commit()
-        con.close()
+        self._lfm_names[str(user_id)] = username
 
-    def _all_users(self):
-        con = sqlite3.connect(DB_PATH)
-        rows = con.execute('SELECT discord_id, lastfm_username FROM users').fetchall()
-        con.close()
-        return rows
+    async def _all_users(self):
+        return await self.db.fetchall('SELECT discord_id, lastfm_username FROM users')
 
     async def _guild_registered(self, guild):
-        result = []
-        for uid, lfm in self._all_users():
+        """[(member, lfm)] for every registered user in `guild`.
+
+        Membership comes from the guild_members table, kept current by the
+        member join/leave/update listeners. The gateway member cache wins when
+        it has the user; users never seen before are fetched concurrently and
+        recorded either way, and expired entries are served as they are while
+        a background task re-checks them. Members known only from the table
+        come back as CachedMember.
+        """
+        rows = await self.db.fetchall(
+            'SELECT u.discord_id, u.lastfm_username, m.is_member, m.display_name, m.checked_at '
+            'FROM users u LEFT JOIN guild_members m ON m.guild_id = ? AND m.discord_id = u.discord_id',
+            (str(guild.id),)
+        )
+        now = int(time.time())
+        result = {}
+        seen, unknown, expired = [], [], []
+        for uid, lfm, is_member, name, checked_at in rows:
             member = guild.get_member(int(uid))
-            if not member:
+            if member:
+                result[uid] = (member, lfm)
+                if is_member != 1 or name != member.display_name:
+                    seen.append(member)
+                continue
+            if is_member is None:
+                unknown.append(uid)
+                continue
+            if is_member:
+                result[uid] = (CachedMember(int(uid), name), lfm)
+            if now - checked_at > (GUILD_MEMBER_TTL if is_member else GUILD_NONMEMBER_TTL):
+                expired.append(uid)
+
+        if seen:
+            await self._record_membership(guild.id, [(m.id, m) for m in seen])
+        if unknown:
+            lfms = dict((uid, lfm) for uid, lfm, *_ in rows)
+            for uid, member in await self._refresh_membership(guild, unknown):
+                if member:
+                    result[uid] = (member, lfms[uid])
+        if expired and guild.id not in self._membership_refreshing:
+            self._membership_refreshing.add(guild.id)
+            task = self._spawn(self._refresh_membership(guild, expired))
+            task.add_done_callback(lambda _: self._membership_refreshing.discard(guild.id))
+        return [result[uid] for uid, *_ in rows if uid in result]
+
+    async def _refresh_membership(self, guild, user_ids):
+        """fetch_member each user, GUILD_FETCH_CONCURRENCY at a time, and
+        record the outcome. Returns [(discord_id, member or None)]; users
+        that couldn't be checked (e.g. HTTP errors) are left out."""
+        sem = asyncio.Semaphore(GUILD_FETCH_CONCURRENCY)
+
+        async def fetch(uid):
+            async with sem:
                 try:
-                    member = await guild.fetch_member(int(uid))
+                    return uid, await guild.fetch_member(int(uid))
+                except discord.NotFound:
+                    return uid, None
                 except Exception:
-                    continue
-            result.append((member, lfm))
-        return result
+                    return None
 
-    def _get_crown(self, guild_id, artist_name):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
-            'SELECT artist_display, discord_id, play_count FROM crowns WHERE guild_id = ? AND artist_name = ?',
-            (guild_id, artist_name.strip().lower())
-        ).fetchone()
-        con.close()
-        return row  # (artist_display, discord_id, play_count) or None
+        checked = [r for r in await asyncio.gather(*[fetch(uid) for uid in user_ids]) if r]
+        await self._record_membership(guild.id, checked)
+        return checked
 
-    def _set_crown(self, guild_id, artist_name, artist_display, discord_id, play_count):
-        con = sqlite3.connect(DB_PATH)
-        con.execute(
-            'INSERT OR REPLACE INTO crowns (guild_id, artist_name, artist_display, discord_id, play_count) '
+    async def _record_membership(self, guild_id, entries):
+        """Upsert [(discord_id, member or None)] into guild_members."""
+        now = int(time.time())
+        await self.db.executemany(
+            'INSERT OR REPLACE INTO guild_members (guild_id, discord_id, is_member, display_name, checked_at) '
             'VALUES (?, ?, ?, ?, ?)',
-            (guild_id, artist_name.strip().lower(), artist_display, str(discord_id), play_count)
-        )
-        con.commit()
-        con.close()
-
-    def _guild_crowns(self, guild_id):
-        con = sqlite3.connect(DB_PATH)
-        rows = con.execute(
-            'SELECT artist_display, discord_id, play_count FROM crowns WHERE guild_id = ? ORDER BY play_count DESC',
-            (guild_id,)
-        ).fetchall()
-        con.close()
-        return rows
-
-    def _get_sync_state(self, lfm):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
-            'SELECT last_synced_ts, total_cached, synced_at FROM scrobble_sync WHERE lfm_username = ?',
-            (lfm,)
-        ).fetchone()
-        con.close()
-        return row  # (last_synced_ts, total_cached, synced_at) or None
+            [(str(guild_id), str(uid), int(m is not None), m.display_name if m else '', now)
+             for uid, m in entries]
+        )
 
-    def _update_sync_state(self, lfm, last_synced_ts, total_cached):
-        con = sqlite3.connect(DB_PATH)
-        con.execute(
-            'INSERT OR REPLACE INTO scrobble_sync (lfm_username, last_synced_ts, total_cached, synced_at) '
-            'VALUES (?, ?, ?, ?)',
-            (lfm, last_synced_ts, total_cached, int(time.time()))
+    # Member events need the members intent; without it the TTLs above
+    # keep guild_members current instead.
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        if await self._get_lfm(member):
+            await self._record_membership(member.guild.id, [(member.id, member)])
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        if await self._get_lfm(member):
+            await self._record_membership(member.guild.id, [(member.id, None)])
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name and await self._get_lfm(after):
+            await self._record_membership(after.guild.id, [(after.id, after)])
+
+    async def _get_crown(self, guild_id, artist_name):
+        return await self.db.fetchone(SQL_CROWN, (guild_id, _fold(artist_name)))  # (artist_display, discord_id, play_count, held_since) or None
+
+    async def _set_crown(self, guild_id, artist_name, artist_display, discord_id, play_count):
+        await self.db.write(
+            _record_crowns, guild_id, [(_fold(artist_name), artist_display, str(discord_id), play_count)]
         )
-        con.commit()
-        con.close()
 
-    def _insert_scrobbles(self, lfm, rows):
-        con = sqlite3.connect(DB_PATH)
-        con.executemany(
-            'INSERT OR IGNORE INTO scrobbles (lfm_username, artist, track, album, scrobbled_at) '
-            'VALUES (?, ?, ?, ?, ?)',
-            [(lfm, r[0], r[1], r[2], r[3]) for r in rows]
+    async def _recompute_guild_crowns(self, guild):
+        """Recompute every crown in `guild` from the artist rollups in one
+        transaction; concurrent calls for a guild share a run. Returns the
+        CrownDiff; steals are logged to crown_events by _record_crowns."""
+        registered = await self._guild_registered(guild)
+        members = [(str(m.id), lfm) for m, lfm in registered]
+        diff = await self.flights.run(
+            ('crowns', guild.id), self.db.write, _recompute_crowns, str(guild.id), members
+        )
+        if diff.awarded or diff.stolen:
+            print(f'[FM] Crowns for {guild.name}: {len(diff.awarded)} awarded, '
+                  f'{len(diff.stolen)} stolen, {diff.updated} updated')
+        return diff
+
+    async def _member_guilds(self, lfm):
+        """Ids of the guilds lfm's Discord user(s) are known to be in."""
+        rows = await self.db.fetchall(SQL_MEMBER_GUILDS, (lfm,))
+        return {int(gid) for gid, in rows}
+
+    async def _get_sync_state(self, lfm):
+        return await self.db.fetchone(SQL_SYNC_STATE, (lfm,))  # (last_synced_ts, total_cached, synced_at) or None
+
+    async def _get_sync_progress(self, lfm):
+        return await self.db.fetchone(
+            'SELECT from_ts, to_ts, total_pages, next_page, fetched, started_at, updated_at, mode '
+            'FROM sync_progress WHERE lfm_username = ?',
+            (lfm,)
+        )  # or None when no import is in flight
+
+    async def _save_sync_progress(self, lfm, from_ts, to_ts, total_pages, next_page, new_rows,
+                                  mode='pages'):
+        """Checkpoint an import. In 'windows' mode total_pages / next_page
+        count time windows instead of pages."""
+        now = int(time.time())
+        await self.db.execute(
+            'INSERT INTO sync_progress '
+            '(lfm_username, from_ts, to_ts, total_pages, next_page, fetched, started_at, updated_at, mode) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (lfm_username) DO UPDATE SET total_pages = excluded.total_pages, '
+            'next_page = excluded.next_page, fetched = fetched + excluded.fetched, '
+            'updated_at = excluded.updated_at',
+            (lfm, from_ts, to_ts, total_pages, next_page, new_rows, now, now, mode)
         )
-        con.commit()
-        con.close()
 
-    def _query_first_scrobble(self, lfm, artist_lower):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
-            'SELECT artist, track, album, scrobbled_at FROM scrobbles '
-            'WHERE lfm_username = ? AND LOWER(artist) = ? AND scrobbled_at >= 1000000000 ORDER BY scrobbled_at ASC LIMIT 1',
-            (lfm, artist_lower)
-        ).fetchone()
-        con.close()
-        return row  # (artist, track, album, scrobbled_at) or None
-
-    def _count_scrobbles_for_artist(self, lfm, artist_lower):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
-            'SELECT COUNT(*) FROM scrobbles WHERE lfm_username = ? AND LOWER(artist) = ?',
-            (lfm, artist_lower)
-        ).fetchone()
-        con.close()
+    async def _finish_sync(self, lfm, last_synced_ts):
+        """Record a completed sync and clear its checkpoint. Returns total cached."""
+        def finish(con):
+            total_cached = con.execute(SQL_CACHED_TOTAL, (lfm,)).fetchone()[0]
+            con.execute(
+                'INSERT OR REPLACE INTO scrobble_sync (lfm_username, last_synced_ts, total_cached, synced_at) '
+                'VALUES (?, ?, ?, ?)',
+                (lfm, last_synced_ts, total_cached, int(time.time()))
+            )
+            con.execute('DELETE FROM sync_progress WHERE lfm_username = ?', (lfm,))
+            con.execute('DELETE FROM sync_windows WHERE lfm_username = ?', (lfm,))
+            return total_cached
+
+        return await self.db.write(finish)
+
+    async def _insert_scrobbles(self, lfm, rows):
+        """Insert (artist, track, album, ts) rows and fold the ones that were
+        actually new into the play-count rollups, in one transaction.
+        Returns the number of new rows."""
+        def insert(con):
+            cur = con.cursor()
+            legacy = _table_exists(con, 'scrobbles_legacy')
+            memo, key_ids = {}, {}
+            artists, albums, tracks = Counter(), Counter(), Counter()  # by rollup id
+            periods, period_artists, period_albums, period_tracks = Counter(), Counter(), Counter(), Counter()
+            items = {}  # (kind, rollup id) -> (artist key, name key, artist, name) first seen
+            user_id = first_ts = None
+            for artist, track, album, ts in rows:
+                if legacy and cur.execute(
+                    'SELECT 1 FROM scrobbles_legacy '
+                    'WHERE lfm_username = ? AND scrobbled_at = ? AND artist = ? AND track = ?',
+                    (lfm, ts, artist, track)
+                ).fetchone():
+                    continue  # cached before the migration; already in the rollups
+                ids = _scrobble_ids(con, memo, lfm, artist, track, album)
+                cur.execute(
+                    'INSERT OR IGNORE INTO scrobbles (user_id, track_id, artist_id, album_id, scrobbled_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    ids + (ts,)
+                )
+                if cur.rowcount != 1:
+                    continue
+                user_id = ids[0]
+                first_ts = ts if first_ts is None else min(first_ts, ts)
+                ak, tk = _fold(artist), _fold(track)
+                artist_id = _key_id(con, key_ids, 'artist', ak)
+                track_id = _key_id(con, key_ids, 'track', ak, tk)
+                items.setdefault(('artist', artist_id), (ak, '', artist, ''))
+                items.setdefault(('track', track_id), (ak, tk, artist, track))
+                artists[artist_id] += 1
+                tracks[track_id] += 1
+                if album:
+                    bk = _fold(album)
+                    album_id = _key_id(con, key_ids, 'album', ak, bk)
+                    items.setdefault(('album', album_id), (ak, bk, artist, album))
+                    albums[album_id] += 1
+                for gb in _rollup_buckets(ts):
+                    periods[gb] += 1
+                    period_artists[gb + (artist_id,)] += 1
+                    period_tracks[gb + (track_id,)] += 1
+                    if album:
+                        period_albums[gb + (album_id,)] += 1
+            for kind, counts in (('artist', artists), ('album', albums), ('track', tracks)):
+                cur.executemany(
+                    f'INSERT INTO user_{kind}_plays (user_id, {kind}_id, plays) VALUES (?, ?, ?) '
+                    f'ON CONFLICT (user_id, {kind}_id) DO UPDATE SET plays = plays + excluded.plays',
+                    [(user_id, item, n) for item, n in counts.items()]
+                )
+            cur.executemany(
+                'INSERT INTO user_period_plays (user_id, grain, bucket, plays) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (user_id, grain, bucket) DO UPDATE SET plays = plays + excluded.plays',
+                [(user_id, g, b, n) for (g, b), n in periods.items()]
+            )
+            for kind, counts in (('artist', period_artists), ('album', period_albums), ('track', period_tracks)):
+                cur.executemany(
+                    f'INSERT INTO user_{kind}_period_plays (user_id, grain, bucket, {kind}_id, plays) '
+                    f'VALUES (?, ?, ?, ?, ?) '
+                    f'ON CONFLICT (user_id, grain, bucket, {kind}_id) DO UPDATE SET plays = plays + excluded.plays',
+                    [(user_id, g, b, item, n) for (g, b, item), n in counts.items()]
+                )
+            marked = time.time_ns()  # differs from any mark a running rebuild read
+            cur.executemany(
+                'INSERT INTO artist_neighbours_dirty (artist_key, marked) VALUES (?, ?) '
+                'ON CONFLICT (artist_key) DO UPDATE SET marked = excluded.marked',
+                [(items['artist', item][0], marked) for item in artists]
+            )
+            if first_ts is not None:
+                cur.execute(
+                    'INSERT INTO streak_dirty (lfm_username, from_ts) VALUES (?, ?) '
+                    'ON CONFLICT (lfm_username) DO UPDATE SET from_ts = MIN(from_ts, excluded.from_ts)',
+                    (lfm, first_ts)
+                )
+            new_plays = [(kind,) + items[kind, item] + (n,)
+                         for kind, counts in (('artist', artists), ('album', albums), ('track', tracks))
+                         for item, n in counts.items()]
+            return sum(artists.values()), {b for g, b in periods if g == 'year'}, new_plays
+
+        new_rows, years, new_plays = await self.db.write(insert)
+        self._taste_vectors.pop(lfm, None)
+        self._recs_dirty = True
+        weights = [entry.weights for entry in self._play_weights_cache.values() if lfm in entry.lfms]
+        if self._music_backlog is not None:
+            self._music_backlog += new_plays
+        for kind, ak, k, artist, name, plays in new_plays:
+            if kind == 'artist':
+                self.artists.add(artist, plays)
+            item = self.music.add(kind, ak, k, artist, name, plays)
+            for w in weights:
+                w[item] = w.get(item, 0) + plays
+        if years:
+            # Cached .year reports for those years may now be short
+            for key in [k for k in self._year_reports if k[1] in years]:
+                del self._year_reports[key]
+        return new_rows
+
+    async def _query_first_scrobble(self, lfm, artist):
+        """(artist, track, album, scrobbled_at) of lfm's earliest cached play
+        of `artist`, or None."""
+        def query(con):
+            rows = [con.execute(SQL_FIRST_SCROBBLE, (lfm, _fold(artist))).fetchone()]
+            if _table_exists(con, 'scrobbles_legacy'):
+                rows.append(con.execute(
+                    'SELECT artist, track, album, scrobbled_at FROM scrobbles_legacy '
+                    'WHERE lfm_username = ? AND fold(artist) = ? AND scrobbled_at >= 1000000000 '
+                    'ORDER BY scrobbled_at ASC LIMIT 1',
+                    (lfm, _fold(artist))
+                ).fetchone())
+            rows = [r for r in rows if r]
+            return min(rows, key=lambda r: r[3]) if rows else None
+
+        return await self.db.read(query)
+
+    async def _count_scrobbles_for_artist(self, lfm, artist):
+        row = await self.db.fetchone(SQL_ARTIST_PLAYS, (lfm, _fold(artist)))
         return row[0] if row else 0
 
-    def _count_cached_scrobbles(self, lfm):
-        con = sqlite3.connect(DB_PATH)
-        row = con.execute(
-            'SELECT COUNT(*) FROM scrobbles WHERE lfm_username = ?',
-            (lfm,)
-        ).fetchone()
-        con.close()
-        return row[0] if row else 0
+    async def _count_cached_scrobbles(self, lfm):
+        return (await self.db.fetchone(SQL_CACHED_TOTAL, (lfm,)))[0]
+
+    async def _load_artist_index(self):
+        """Fill self.artists from the play-count rollups and learned aliases."""
+        def load(con):
+            return (
+                con.execute(
+                    'SELECT a.name, p.plays FROM ('
+                    '  SELECT artist_id, SUM(plays) AS plays FROM user_artist_plays GROUP BY artist_id'
+                    ') p JOIN artists a ON a.id = p.artist_id'
+                ).fetchall(),
+                con.execute('SELECT query_key, artist FROM artist_aliases').fetchall(),
+            )
+
+        artists, aliases = await self.db.read(load)
+        index = ArtistIndex()
+
+        def build():
+            for name, plays in artists:
+                index.add(name, plays)
+            for query_key, name in aliases:
+                index.learn(query_key, name)
+
+        await asyncio.to_thread(build)
+        self.artists = index
+
+    async def _load_music_index(self):
+        """Fill self.music from the all-time rollups, in the background:
+        autocomplete offers nothing until it's in. Plays inserted meanwhile
+        are replayed onto the new index, and cached play weights (which
+        hold ids of the old one) are dropped."""
+        self._music_backlog = []
+
+        def load(con):
+            return [
+                ('artist',) + r for r in con.execute(
+                    "SELECT a.name_key, '', a.name, '', p.plays FROM ("
+                    "  SELECT artist_id, SUM(plays) AS plays FROM user_artist_plays GROUP BY artist_id"
+                    ") p JOIN artists a ON a.id = p.artist_id"
+                )
+            ] + [
+                (kind,) + r for kind in ('album', 'track')
+                for r in con.execute(
+                    f'SELECT a.name_key, x.name_key, a.name, x.name, p.plays FROM ('
+                    f'  SELECT {kind}_id, SUM(plays) AS plays FROM user_{kind}_plays GROUP BY {kind}_id'
+                    f') p JOIN {kind}s x ON x.id = p.{kind}_id JOIN artists a ON a.id = x.artist_id'
+                )
+            ]
+
+        try:
+            t0 = time.perf_counter()
+            rows = await self.db.read(load)
+            index = MusicIndex()
+            await asyncio.to_thread(index.load, rows)
+            for row in self._music_backlog:
+                index.add(*row)
+            self.music = index
+            self._play_weights_cache.clear()
+            print(f'[FM] Music index: {len(index):,} items in {time.perf_counter() - t0:.1f}s')
+        except Exception as e:
+            print(f'[FM] music index load failed: {e}')
+        finally:
+            self._music_backlog = None
+
+    def _play_weights(self, scope, ident):
+        """PlayWeights of one user (scope 'user', ident = lfm name) or of a
+        guild's registered members (scope 'guild', ident = guild id), as
+        {MusicIndex id: plays}, or None if they aren't loaded yet.
+
+        Never waits on the database: a miss or an entry past its
+        AUTOCOMPLETE_WEIGHTS_TTL starts a background load and the caller
+        makes do with what's cached (autocomplete then ranks by everyone's
+        plays). _insert_scrobbles keeps cached entries current meanwhile."""
+        key = (scope, ident)
+        entry = self._play_weights_cache.get(key)
+        if entry:
+            self._play_weights_cache.move_to_end(key)
+        if (not entry or entry.expires_at <= time.time()) and ('weights',) + key not in self.flights:
+            self._spawn(self.flights.run(('weights',) + key, self._load_play_weights, scope, ident))
+        return entry
+
+    async def _load_play_weights(self, scope, ident):
+        """Load one PlayWeights entry into the cache (see _play_weights)."""
+        music = self.music
+
+        def load(con):
+            if scope == 'user':
+                lfms = [ident]
+            else:
+                lfms = [r[0] for r in con.execute(
+                    'SELECT DISTINCT u.lastfm_username FROM guild_members m '
+                    'JOIN users u ON u.discord_id = m.discord_id '
+                    'WHERE m.guild_id = ? AND m.is_member = 1',
+                    (str(ident),)
+                )]
+            users = f'SELECT id FROM lfm_users WHERE name IN ({",".join("?" * len(lfms))})'
+            rows = [('artist', ak, '', n) for ak, n in con.execute(
+                f'SELECT a.name_key, p.plays FROM ('
+                f'  SELECT artist_id, SUM(plays) AS plays FROM user_artist_plays '
+                f'  WHERE user_id IN ({users}) GROUP BY artist_id'
+                f') p JOIN artists a ON a.id = p.artist_id', lfms
+            )]
+            for kind in ('album', 'track'):
+                rows += [(kind, ak, k, n) for ak, k, n in con.execute(
+                    f'SELECT a.name_key, x.name_key, p.plays FROM ('
+                    f'  SELECT {kind}_id, SUM(plays) AS plays FROM user_{kind}_plays '
+                    f'  WHERE user_id IN ({users}) GROUP BY {kind}_id'
+                    f') p JOIN {kind}s x ON x.id = p.{kind}_id JOIN artists a ON a.id = x.artist_id', lfms
+                )]
+            return lfms, rows
+
+        def build(rows):
+            weights = {}
+            for kind, ak, k, n in rows:
+                item = music.item_id(kind, ak, k)
+                if item is not None:
+                    weights[item] = n
+            favourites = {
+                kind: heapq.nlargest(AUTOCOMPLETE_FAVOURITES, (i for i in weights if music.kinds[i] == kind),
+                                     key=weights.get)
+                for kind in MusicIndex.KINDS
+            }
+            return weights, favourites
+
+        try:
+            lfms, rows = await self.db.read(load)
+            weights, favourites = await asyncio.to_thread(build, rows)
+        except Exception as e:
+            print(f'[FM] play weights load failed for {scope} {ident}: {e}')
+            return
+        if self.music is not music:
+            return  # the index was reloaded underneath us; ids no longer match
+        self._play_weights_cache[scope, ident] = PlayWeights(
+            time.time() + AUTOCOMPLETE_WEIGHTS_TTL, frozenset(lfms), weights, favourites
+        )
+        while len(self._play_weights_cache) > AUTOCOMPLETE_WEIGHTS_MAX:
+            self._play_weights_cache.popitem(last=False)
+
+    async def _autocomplete(self, interaction, current, kind):
+        lfm = self._lfm_names.get(str(interaction.user.id))
+        empty = PlayWeights(0, frozenset(), {}, {})
+        user = (self._play_weights('user', lfm) if lfm else None) or empty
+        guild = (self._play_weights('guild', interaction.guild.id) if interaction.guild else None) or empty
+        labels = self.music.complete(
+            kind, current, user.weights, guild.weights,
+            favourites=user.favourites.get(kind, []) + guild.favourites.get(kind, [])
+        )
+        return [app_commands.Choice(name=label[:100], value=label[:100]) for label in labels]
+
+    async def _migrate_scrobbles(self):
+        """Move a pre-normalization scrobble cache into the integer fact table
+        a chunk at a time. Reads and inserts consult scrobbles_legacy until
+        it's gone, so the bot keeps working throughout."""
+        print('[FM] Migrating scrobble cache to the normalized layout')
+        moved = 0
+        while True:
+            n = await self.db.write(_migrate_scrobble_chunk)
+            if not n:
+                break
+            moved += n
+            await asyncio.sleep(SCROBBLE_MIGRATE_PAUSE)
+        print(f'[FM] Scrobble cache migration done ({moved:,} rows)')
+
+    async def _split_by_freshness(self, registered):
+        """Split (member, lfm) pairs into those whose scrobble cache is recent
+        enough to answer play counts locally, and those that need the API."""
+        if not registered:
+            return [], []
+        lfms = list({lfm for _, lfm in registered})
+        rows = await self.db.fetchall(_freshness_sql(len(lfms)), lfms)
+        cutoff = time.time() - CACHE_FRESH_SECS
+        fresh_names = {lfm for lfm, synced_at in rows if synced_at >= cutoff}
+        fresh = [(m, lfm) for m, lfm in registered if lfm in fresh_names]
+        stale = [(m, lfm) for m, lfm in registered if lfm not in fresh_names]
+        return fresh, stale
+
+    async def _cached_plays(self, kind, keys, lfms):
+        """{lfm: plays} of one artist / album / track (`kind`) from its
+        user_*_plays rollup in a single query. `keys` are its fold() keys:
+        (artist,) or (artist, name)."""
+        if not lfms:
+            return {}
+        rows = await self.db.fetchall(_cached_plays_sql(kind, len(lfms)), list(keys) + list(lfms))
+        return dict(rows)
+
+    async def _cache_covers(self, lfm, rng):
+        """Whether lfm's scrobble cache can answer for a DateRange: it has
+        been fully imported, and either the range ended before the newest
+        cached scrobble or the cache is fresh."""
+        sync_state = await self._get_sync_state(lfm)
+        if sync_state is None:
+            return False
+        last_synced_ts, _, synced_at = sync_state
+        return _range_bounds(rng)[1] <= last_synced_ts or time.time() - synced_at <= CACHE_FRESH_SECS
+
+    async def _scrobble_total(self, lfm, period):
+        """lfm's scrobble count for a PERIODS key or a DateRange, or None if
+        Last.fm didn't say."""
+        params = {'method': 'user.getrecenttracks', 'user': lfm, 'limit': 1}
+        if isinstance(period, DateRange):
+            if await self._cache_covers(lfm, period):
+                return await self.db.read(_range_total, lfm, period)
+            params['from'], params['to'] = _range_bounds(period)
+            params['to'] -= 1
+        else:
+            params['period'] = PERIODS.get(period, '7day')
+        total = (await self._api(params)).get('recenttracks', {}).get('@attr', {}).get('total')
+        return int(total) if str(total).isdigit() else None
+
+    async def _top_items(self, lfm, kind, period, limit):
+        """[(name, artist, plays)] of lfm's top artists / albums / tracks
+        (`kind`) for a PERIODS key or a DateRange; artist is '' for artists."""
+        return (await self._top_page(lfm, kind, period, None, limit))[0]
+
+    async def _top_page(self, lfm, kind, period, cursor, limit=PAGE_SIZE, cached=None):
+        """One page of lfm's top `kind`s: ([(name, artist, plays)], next
+        cursor or None on the last page). `cursor` is None for the first page.
+
+        Fixed periods page through user.gettop* with `page=`, so each page is
+        its own cached response. Ranges come from the rollups when the cache
+        covers them, keyset-paged by (plays, key); otherwise from the
+        weekly-chart API, which takes arbitrary from/to but returns the whole
+        chart in one (cached) response. The two take different cursors, so a
+        caller paging a range decides `cached` once (see _cache_covers) and
+        passes it with every page; None checks the cache now.
+        """
+        page = cursor or 1
+        if isinstance(period, DateRange):
+            if cached is None:
+                cached = await self._cache_covers(lfm, period)
+            if cached:
+                rows = await self.db.read(_range_top, lfm, kind, period, limit + 1, cursor)
+                more = len(rows) > limit
+                return [row[:3] for row in rows[:limit]], rows[limit - 1][3] if more else None
+            start, end = _range_bounds(period)
+            data = await self._api({
+                'method': f'user.getweekly{kind}chart',
+                'user': lfm,
+                'from': start,
+                'to': end - 1
+            })
+            items = data.get(f'weekly{kind}chart', {}).get(kind, [])
+            if isinstance(items, dict):
+                items = [items]
+            more = len(items) > page * limit
+            items = items[(page - 1) * limit:page * limit]
+            artist_of = lambda item: item.get('artist', {}).get('#text', '')
+        else:
+            data = await self._api({
+                'method': f'user.gettop{kind}s',
+                'user': lfm,
+                'period': PERIODS.get(period, '7day'),
+                'limit': limit,
+                'page': page
+            })
+            items = data.get(f'top{kind}s', {}).get(kind, [])
+            if isinstance(items, dict):
+                items = [items]
+            more = page < int(data.get(f'top{kind}s', {}).get('@attr', {}).get('totalPages', 1))
+            artist_of = lambda item: item.get('artist', {}).get('name', '')
+        items = [(item['name'], '' if kind == 'artist' else artist_of(item), int(item['playcount']))
+                 for item in items[:limit]]
+        return items, page + 1 if more and items else None
+
+    async def _taste_vector(self, lfm):
+        """lfm's artist plays as a TasteVector over MusicIndex artist ids."""
+        vector = self._taste_vectors.get(lfm)
+        if vector is None:
+            rows = await self.db.fetchall(SQL_TASTE_VECTOR, (lfm,))
+            ids = [self.music.item_id('artist', ak) for ak, _, _ in rows]
+            ids = [self.music.add('artist', ak, '', artist, '', 0) if item is None else item
+                   for item, (ak, artist, _) in zip(ids, rows)]
+            order = sorted(range(len(rows)), key=ids.__getitem__)
+            vector = self._taste_vectors[lfm] = TasteVector(
+                np.array([ids[i] for i in order], np.int32),
+                np.array([rows[i][2] for i in order], np.int32)
+            )
+        return vector
+
+    async def _taste_matrix(self, guild):
+        """TasteMatrix over the guild's registered users with at least
+        TASTE_MIN_ARTISTS cached artists. Kept until a member joins or
+        leaves or a sync changes someone's plays; concurrent builds for a
+        guild share a run."""
+        lfms = sorted({lfm for _, lfm in await self._guild_registered(guild)})
+        cached = self._taste_matrices.get(guild.id)
+        if cached and list(cached.vectors) == lfms and all(
+                self._taste_vectors.get(lfm) is vector for lfm, vector in cached.vectors.items()):
+            return cached
+
+        async def build():
+            vectors = dict(zip(lfms, await asyncio.gather(*map(self._taste_vector, lfms))))
+            included = [lfm for lfm in lfms if len(vectors[lfm].ids) >= TASTE_MIN_ARTISTS]
+            started = time.perf_counter()
+            cosine, jaccard = await asyncio.to_thread(_taste_similarity, [vectors[lfm] for lfm in included])
+            print(f'[FM] Taste matrix for {guild.name}: {len(included)} users in '
+                  f'{time.perf_counter() - started:.2f}s')
+            matrix = self._taste_matrices[guild.id] = TasteMatrix(vectors, included, cosine, jaccard)
+            return matrix
+
+        return await self.flights.run(('taste', guild.id), build)
+
+    async def _update_recommendations(self):
+        """Rebuild the neighbour lists of every artist marked dirty since the
+        last run, from all cached users' taste vectors, and patch the lists
+        that point at them. Concurrent calls share a run."""
+        async def update():
+            marks = await self.db.fetchall('SELECT artist_key, marked FROM artist_neighbours_dirty')
+            if not marks:
+                return
+            started = time.perf_counter()
+            keys = [ak for ak, _ in marks]
+
+            def listed_by(con):
+                return {ak: [a for a, in con.execute(SQL_NEIGHBOUR_OF, (ak,))] for ak in keys}
+
+            lfms = [lfm for lfm, in await self.db.fetchall('SELECT lfm_username FROM scrobble_sync')]
+            vectors = await asyncio.gather(*map(self._taste_vector, lfms))
+            listed = await self.db.read(listed_by)
+            full = await self.db.fetchall(
+                'SELECT artist_key, MIN(score) FROM artist_neighbours GROUP BY artist_key HAVING COUNT(*) >= ?',
+                (REC_NEIGHBOURS,)
+            )
+            item_id = lambda ak: self.music.item_id('artist', ak)
+            targets = {item_id(ak): ak for ak in keys}
+            targets.pop(None, None)
+            held = {item: [i for i in map(item_id, listed[ak]) if i is not None] for item, ak in targets.items()}
+            floors = {item_id(ak): score for ak, score in full if item_id(ak) is not None}
+            lists, rescored = await asyncio.to_thread(_item_neighbours, vectors, list(targets), held, floors)
+
+            key = lambda item: self.music.keys[item][0]
+            lists = {key(item): [(key(n), score) for n, score in neighbours] for item, neighbours in lists.items()}
+            lists.update((ak, []) for ak in keys if item_id(ak) is None)
+            rescored = [(key(a), key(b), score) for a, b, score in rescored]
+            await self.db.write(_store_neighbours, lists, rescored, marks)
+            print(f'[FM] Rebuilt {sum(map(bool, lists.values()))} artist neighbour lists from '
+                  f'{len(vectors)} users in {time.perf_counter() - started:.2f}s')
+
+        await self.flights.run(('recommendations',), update)
+
+    async def _refresh_streaks(self, lfm):
+        """Fold any newly cached plays into lfm's streaks."""
+        if await self.db.fetchone('SELECT 1 FROM streak_dirty WHERE lfm_username = ?', (lfm,)):
+            await self.db.write(_update_streaks, lfm)
+
+    async def _ensure_synced(self, ctx, lfm):
+        """Delta-sync (or fully import) lfm's scrobble cache if it is older
+        than CACHE_FRESH_SECS, reporting progress in the channel."""
+        sync_state = await self._get_sync_state(lfm)
+        now_ts = int(time.time())
+        if sync_state is not None and (now_ts - sync_state[2]) <= CACHE_FRESH_SECS:
+            return
+
+        sync_type = 'full' if sync_state is None else 'delta'
+        status_msg = await ctx.send(
+            f'Syncing scrobble history for **{lfm}** ({sync_type})… this may take a while.'
+        )
+        last_edit = [0.0]
+
+        async def progress_callback(parts_done, total_parts, fetched):
+            if time.time() - last_edit[0] >= 3.0:
+                last_edit[0] = time.time()
+                pct = int(parts_done / total_parts * 100)
+                try:
+                    await status_msg.edit(
+                        content=f'Syncing **{lfm}**… {pct}% ({fetched:,} tracks)'
+                    )
+                except Exception:
+                    pass
+
+        fetched, total_cached = await self._sync_scrobbles(lfm, progress_callback)
+        try:
+            await status_msg.edit(
+                content=f'Sync complete — {fetched:,} new scrobbles fetched ({total_cached:,} total cached).'
+            )
+        except Exception:
+            pass
+
+    async def _send_cached(self, ctx, lfm, render):
+        """Answer from lfm's scrobble cache without waiting for a sync.
+
+        `render` is an async callable returning ctx.send kwargs (`content`
+        and `embed`) built from the cache as it stands. A stale cache is
+        answered from anyway and refreshed in the background; the message is
+        edited only if the refreshed answer differs. Only a first import,
+        with nothing to answer from yet, is waited for.
+        """
+        sync_state = await self._get_sync_state(lfm)
+        if sync_state is None:
+            await self._ensure_synced(ctx, lfm)
+            await ctx.send(**await render())
+            return
+        answer = await render()
+        msg = await ctx.send(**answer)
+        if time.time() - sync_state[2] > CACHE_FRESH_SECS:
+            self._spawn(self._revalidate(msg, lfm, answer, render))
+
+    async def _revalidate(self, msg, lfm, answer, render):
+        """Delta-sync lfm, re-render, and edit `msg` if the answer changed.
+        Embed footers (cache age and size) don't count as a change."""
+        def comparable(kwargs):
+            embed = kwargs.get('embed')
+            embed = {k: v for k, v in embed.to_dict().items() if k != 'footer'} if embed else None
+            return kwargs.get('content'), embed
+
+        self.revalidations['run'] += 1
+        try:
+            await self._sync_scrobbles(lfm)
+            fresh = await render()
+            if comparable(fresh) != comparable(answer):
+                await msg.edit(**fresh)
+                self.revalidations['edited'] += 1
+        except Exception as e:
+            self.revalidations['failed'] += 1
+            print(f'[FM] background refresh for {lfm} failed: {e}')
 
     # ------------------------------------------------------------------ #
     #  API helpers                                                         #
     # ------------------------------------------------------------------ #
-    async def _api(self, session, params):
-        params['api_key'] = self.api_key
-        params['format']  = 'json'
-        async with session.get(LASTFM_API, params=params) as resp:
-            return await resp.json()
-
-    async def _current_track(self, session, lfm):
-        data = await self._api(session, {
+    async def _api(self, params, priority=PRIORITY_INTERACTIVE):
+        """GET a Last.fm method through the response cache and shared limiter.
+        Throttled responses (HTTP 429 / error 29) back the limiter off and are
+        retried up to LASTFM_RETRIES times."""
+        method = str(params.get('method', '')).lower()
+        ttl = _api_cache_ttl(params)
+        key = _api_cache_key(params) if ttl else None
+        if key:
+            data = self.cache.get(key)
+            if data is None and self.persist_api_cache and ttl >= API_CACHE_PERSIST_TTL:
+                data = await self._load_cached_response(key)
+            if data is not None:
+                self.cache.hits[method] += 1
+                return data
+            self.cache.misses[method] += 1
+
+        # Identical requests already on the wire are awaited, not repeated
+        return await self.flights.run(
+            ('api', key or _api_cache_key(params)), self._fetch_api, params, priority, key, ttl
+        )
+
+    async def _fetch_api(self, params, priority, key, ttl):
+        params = dict(params, api_key=self.api_key, format='json')
+        data = {}
+        for _ in range(LASTFM_RETRIES + 1):
+            await self.limiter.acquire(priority)
+            async with self.session.get(LASTFM_API, params=params) as resp:
+                if resp.status == 429:
+                    retry_after = resp.headers.get('Retry-After', '')
+                    self.limiter.throttled(float(retry_after) if retry_after.isdigit() else None)
+                    data = {'error': 29, 'message': 'Rate limit exceeded'}
+                    continue
+                text = await resp.text()
+            data = json.loads(text)
+            if isinstance(data, dict) and data.get('error') == 29:
+                self.limiter.throttled()
+                continue
+            self.limiter.success()
+            if key and resp.status == 200 and isinstance(data, dict) and 'error' not in data:
+                expires_at = time.time() + ttl
+                self.cache.put(key, data, expires_at, len(text))
+                if self.persist_api_cache and ttl >= API_CACHE_PERSIST_TTL:
+                    self._spawn(self.db.execute(
+                        'INSERT OR REPLACE INTO api_cache (cache_key, response, expires_at) VALUES (?, ?, ?)',
+                        (key, text, int(expires_at))
+                    ))
+            return data
+        return data
+
+    async def _load_cached_response(self, key):
+        row = await self.db.fetchone(
+            'SELECT response, expires_at FROM api_cache WHERE cache_key = ? AND expires_at > ?',
+            (key, int(time.time()))
+        )
+        if not row:
+            return None
+        data = json.loads(row[0])
+        self.cache.put(key, data, row[1], len(row[0]))
+        return data
+
+    async def _current_track(self, lfm):
+        data = await self._api({
             'method': 'user.getrecenttracks',
             'user': lfm,
             'limit': 1
@@ -235,127 +2993,500 @@ class FM(commands.Cog):
             return None
         return tracks[0] if isinstance(tracks, list) else tracks
 
-    async def _resolve_artist(self, session, query):
+    async def _resolve_artist(self, query):
         """Return the canonical Last.fm artist name.
-        Prefers an exact (case-insensitive) name match; falls back to the
-        result with the most listeners for partial/variant queries."""
-        data = await self._api(session, {
+        Answered from the local ArtistIndex when it knows the name (or a
+        close enough one); otherwise artist.search decides, preferring an
+        exact (case-insensitive) match over the most-listened result, and
+        the answer is remembered in artist_aliases."""
+        name = self.artists.lookup(query)
+        if name is not None:
+            return name
+        self.artists.hits['api'] += 1
+        name = await self._search_artist(query)
+        if name is None:
+            return query
+        self.artists.learn(query, name)
+        await self.db.execute(
+            'INSERT OR REPLACE INTO artist_aliases (query_key, artist, updated_at) VALUES (?, ?, ?)',
+            (_fold(query), name, int(time.time()))
+        )
+        return name
+
+    async def _search_artist(self, query):
+        data = await self._api({
             'method': 'artist.search',
             'artist': query,
             'limit': 5
         })
         matches = data.get('results', {}).get('artistmatches', {}).get('artist', [])
         if not matches:
-            return query
-        query_lower = query.strip().lower()
-        exact = next((m for m in matches if m['name'].strip().lower() == query_lower), None)
+            return None
+        query_key = _fold(query)
+        exact = next((m for m in matches if _fold(m['name']) == query_key), None)
         if exact:
             return exact['name']
         best = max(matches, key=lambda m: int(m.get('listeners', 0) or 0))
         return best['name']
 
-    async def _sync_scrobbles(self, session, lfm, status_callback=None):
-        """Bulk-sync a user's scrobble history into the local DB.
-        Returns (fetched_this_run, total_cached).
-        """
-        sync_state = self._get_sync_state(lfm)
-        is_first_sync = sync_state is None
-        from_ts = 0 if is_first_sync else sync_state[0] + 1
-
+    async def _canonical_names(self, kind, artist_name, name):
+        """Autocorrected (artist, track|album) names via a user-less getInfo,
+        which the response cache keeps for a day. Falls back to the input."""
+        try:
+            data = await self._api({
+                'method': f'{kind}.getInfo',
+                'artist': artist_name,
+                kind: name,
+                'autocorrect': 1
+            })
+        except Exception:
+            return artist_name, name
+        info = data.get(kind) or {}
+        artist = info.get('artist', artist_name)
+        if isinstance(artist, dict):
+            artist = artist.get('name', artist_name)
+        return artist or artist_name, info.get('name') or name
+
+    async def _fetch_recent_page(self, lfm, from_ts, to_ts, page, record_hole=True, limit=200):
+        """One user.getRecentTracks page of a frozen `from`..`to` window.
+        Retried with exponential backoff; a page that still fails is recorded
+        in `sync_holes` for a later repair pass. Returns the page or None."""
         params = {
             'method': 'user.getRecentTracks',
             'user': lfm,
-            'limit': 200,
-            'page': 1,
+            'limit': limit,
             'extended': 0,
+            'page': page,
+            'to': to_ts,
         }
         if from_ts:
             params['from'] = from_ts
 
-        # Probe page 1
+        error = ''
+        for attempt in range(SYNC_PAGE_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(SYNC_RETRY_BASE_SECS * 2 ** (attempt - 1))
+            try:
+                data = await self._api(dict(params), PRIORITY_BACKGROUND)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                continue
+            if 'recenttracks' in data:
+                return data
+            error = f'error {data.get("error")}: {data.get("message", "")}'
+
+        if record_hole:
+            await self.db.execute(
+                'INSERT INTO sync_holes (lfm_username, from_ts, to_ts, page, last_error, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (lfm_username, from_ts, to_ts, page) '
+                'DO UPDATE SET attempts = attempts + 1, last_error = excluded.last_error',
+                (lfm, from_ts, to_ts, page, error, int(time.time()))
+            )
+        return None
+
+    async def _repair_holes(self, lfm):
+        """Refetch every page parked in `sync_holes` for a user.
+        Returns (repaired_pages, new_rows)."""
+        holes = await self.db.fetchall(
+            'SELECT from_ts, to_ts, page FROM sync_holes WHERE lfm_username = ? ORDER BY to_ts, page',
+            (lfm,)
+        )
+        repaired = new_rows = 0
+        for from_ts, to_ts, page in holes:
+            data = await self._fetch_recent_page(lfm, from_ts, to_ts, page)
+            if data is None:
+                continue  # attempts/last_error already bumped
+            rows = _parse_recent_tracks(data)
+            if rows:
+                new_rows += await self._insert_scrobbles(lfm, rows)
+            await self.db.execute(
+                'DELETE FROM sync_holes WHERE lfm_username = ? AND from_ts = ? AND to_ts = ? AND page = ?',
+                (lfm, from_ts, to_ts, page)
+            )
+            repaired += 1
+        return repaired, new_rows
+
+    async def _sync_scrobbles(self, lfm, status_callback=None):
+        """Sync a user's scrobble history into the local DB, or join the sync
+        already running for them. Every caller's status_callback receives the
+        shared run's progress. Returns (fetched_this_run, total_cached)."""
+        key = _fold(lfm)
+        if status_callback:
+            self._sync_watchers[key].append(status_callback)
         try:
-            p1 = await self._api(session, params)
+            return await self.flights.run(('sync', key), self._run_sync, lfm, key)
+        finally:
+            if status_callback:
+                self._sync_watchers[key].remove(status_callback)
+                if not self._sync_watchers[key]:
+                    del self._sync_watchers[key]
+
+    async def _run_sync(self, lfm, key):
+        async def notify(*progress):
+            for callback in list(self._sync_watchers.get(key, ())):
+                try:
+                    await callback(*progress)
+                except Exception as e:
+                    print(f'[FM] sync progress callback failed for {lfm}: {e}')
+
+        result = await self._do_sync(lfm, notify)
+        await self._refresh_streaks(lfm)
+        return result
+
+    async def _do_sync(self, lfm, status_callback=None):
+        """Sync a user's scrobble history into the local DB.
+
+        The `from`..`to` window is frozen when a run starts, so scrobbles that
+        arrive mid-import cannot shift page numbers, and the next unfetched
+        page is checkpointed to `sync_progress` after every batch. An import
+        interrupted by a crash or restart resumes where it stopped. Pages
+        that keep failing become holes, repaired at the end of every run.
+        Returns (fetched_this_run, total_cached).
+        """
+        fetched = 0
+        progress = await self._get_sync_progress(lfm)
+        if progress and progress[7] == 'windows':
+            return await self._sync_windows(lfm, progress, status_callback)
+        if progress:
+            from_ts, to_ts, total_pages, next_page = progress[:4]
+        else:
+            sync_state = await self._get_sync_state(lfm)
+            if sync_state is None and SYNC_FULL_IMPORT_MODE == 'windows':
+                return await self._sync_windows(lfm, None, status_callback)
+            from_ts = 0 if sync_state is None else sync_state[0] + 1
+            to_ts = int(time.time())
+            next_page = 2
+
+            # Probe page 1
+            p1 = await self._fetch_recent_page(lfm, from_ts, to_ts, 1, record_hole=False)
+            if p1 is None:
+                return (0, await self._count_cached_scrobbles(lfm))
+
+            attr = p1['recenttracks'].get('@attr', {})
+            total_pages = int(attr.get('totalPages', 1))
+            if int(attr.get('total', 0)) == 0:
+                await self._repair_holes(lfm)
+                return (0, await self._finish_sync(lfm, to_ts))
+
+            rows1 = _parse_recent_tracks(p1)
+            if rows1:
+                fetched += await self._insert_scrobbles(lfm, rows1)
+            await self._save_sync_progress(lfm, from_ts, to_ts, total_pages, next_page, fetched)
+
+        # Pacing comes from the shared limiter; batches only bound how many
+        # pages are held in memory between inserts and checkpoints.
+        batch_size = 10
+        for start in range(next_page, total_pages + 1, batch_size):
+            batch = range(start, min(start + batch_size, total_pages + 1))
+            results = await asyncio.gather(*[
+                self._fetch_recent_page(lfm, from_ts, to_ts, pg) for pg in batch
+            ])
+            rows = [r for data in results if data for r in _parse_recent_tracks(data)]
+            new_rows = await self._insert_scrobbles(lfm, rows) if rows else 0
+            fetched += new_rows
+            await self._save_sync_progress(lfm, from_ts, to_ts, total_pages, batch.stop, new_rows)
+            if status_callback:
+                await status_callback(batch.stop - 1, total_pages, fetched)
+
+        _, repaired_rows = await self._repair_holes(lfm)
+        fetched += repaired_rows
+
+        # Everything up to the frozen `to` is cached, bar any holes still open
+        total_cached = await self._finish_sync(lfm, to_ts)
+        if from_ts == 0:
+            # Fresh full import: cross-check it against Last.fm's own counts
+            for _, _, _, new_rows in await self._verify_sync(lfm):
+                fetched += new_rows
+            total_cached = await self._count_cached_scrobbles(lfm)
+        return (fetched, total_cached)
+
+    async def _fetch_window(self, lfm, from_ts, to_ts):
+        """Fetch every page of one time window and insert it. Returns new rows,
+        or None if page 1 failed: without it the page count is unknown, so
+        the whole window is left for the next run rather than a hole."""
+        first = await self._fetch_recent_page(lfm, from_ts, to_ts, 1, record_hole=False)
+        if first is None:
+            return None
+        total_pages = int(first['recenttracks'].get('@attr', {}).get('totalPages', 1))
+        pages = [first] + list(await asyncio.gather(*[
+            self._fetch_recent_page(lfm, from_ts, to_ts, pg) for pg in range(2, total_pages + 1)
+        ]))
+        rows = [r for data in pages if data for r in _parse_recent_tracks(data)]
+        return await self._insert_scrobbles(lfm, rows) if rows else 0
+
+    async def _plan_windows(self, lfm, from_ts, to_ts):
+        """Partition from..to into windows of roughly SYNC_WINDOW_TARGET
+        scrobbles. Each pass probes the pending windows' totals in parallel
+        and splits the oversized ones evenly by time, sized from the probe.
+        Returns [(from_ts, to_ts, expected)] in time order, or None if a
+        probe failed: an unsized window can't be bounded, so the caller
+        plans again on its next run."""
+        pending = [(from_ts, to_ts)]
+        windows = []
+        while pending:
+            totals = await asyncio.gather(*[
+                self._remote_window_total(lfm, f, t) for f, t in pending
+            ])
+            if None in totals:
+                return None
+            split = []
+            for (f, t), total in zip(pending, totals):
+                if total <= SYNC_WINDOW_TARGET or t - f < SYNC_WINDOW_MIN_SECS:
+                    windows.append((f, t, total))
+                    continue
+                parts = min(-(-total // SYNC_WINDOW_TARGET), SYNC_WINDOW_MAX_SPLIT)
+                step = max((t - f + 1) // parts, SYNC_WINDOW_MIN_SECS // 2)
+                edges = list(range(f, t + 1, step))[:parts] + [t + 1]
+                split += [(a, b - 1) for a, b in zip(edges, edges[1:])]
+            pending = split
+        return sorted(windows)
+
+    async def _sync_windows(self, lfm, progress, status_callback=None):
+        """Full import by time partition instead of page number.
+
+        The account's history (registration .. now, frozen) is split into
+        windows by _plan_windows and the plan is stored in `sync_windows`.
+        Windows are fetched SYNC_WINDOW_CONCURRENCY at a time and each one is
+        marked done as soon as its rows commit, so results don't depend on
+        live listening and an interrupted import redoes only unfinished
+        windows. Returns (fetched_this_run, total_cached).
+        """
+        if progress and progress[2]:
+            from_ts, to_ts = progress[:2]
+        else:
+            # No plan yet, or planning was interrupted: (re)plan from scratch
+            to_ts = progress[1] if progress else int(time.time())
+            from_ts = await self._registered_ts(lfm) or 1000000000
+            await self._save_sync_progress(lfm, from_ts, to_ts, 0, 1, 0, mode='windows')
+            windows = await self._plan_windows(lfm, from_ts, to_ts)
+            if windows is None:
+                # Progress stays at total_pages = 0, so the next run replans
+                print(f'[FM] Sync for {lfm}: window planning failed, retrying next run')
+                return (0, await self._count_cached_scrobbles(lfm))
+
+            def store_plan(con):
+                con.execute('DELETE FROM sync_windows WHERE lfm_username = ?', (lfm,))
+                con.executemany(
+                    'INSERT INTO sync_windows (lfm_username, from_ts, to_ts, expected, done) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(lfm, f, t, n, int(n == 0)) for f, t, n in windows]
+                )
+                con.execute(
+                    'UPDATE sync_progress SET total_pages = ?, next_page = 1 WHERE lfm_username = ?',
+                    (len(windows), lfm)
+                )
+
+            await self.db.write(store_plan)
+
+        pending = await self.db.fetchall(
+            'SELECT from_ts, to_ts FROM sync_windows WHERE lfm_username = ? AND done = 0 ORDER BY from_ts DESC',
+            (lfm,)
+        )
+        total_windows, done_windows = await self.db.fetchone(
+            'SELECT COUNT(*), SUM(done) FROM sync_windows WHERE lfm_username = ?', (lfm,)
+        )
+        done = [done_windows or 0]
+        fetched = [0]
+        failed = []
+        sem = asyncio.Semaphore(SYNC_WINDOW_CONCURRENCY)
+
+        async def run(f, t):
+            async with sem:
+                new_rows = await self._fetch_window(lfm, f, t)
+            if new_rows is None:
+                failed.append((f, t))
+                return
+            fetched[0] += new_rows
+            done[0] += 1
+
+            def checkpoint(con, next_window=done[0] + 1):
+                con.execute(
+                    'UPDATE sync_windows SET done = 1, fetched = ? WHERE lfm_username = ? AND from_ts = ?',
+                    (new_rows, lfm, f)
+                )
+                con.execute(
+                    'UPDATE sync_progress SET next_page = ?, fetched = fetched + ?, updated_at = ? '
+                    'WHERE lfm_username = ?',
+                    (next_window, new_rows, int(time.time()), lfm)
+                )
+
+            await self.db.write(checkpoint)
+            if status_callback:
+                await status_callback(done[0], total_windows, fetched[0])
+
+        await asyncio.gather(*[run(f, t) for f, t in pending])
+
+        _, repaired_rows = await self._repair_holes(lfm)
+        if failed:
+            # Keep the plan and checkpoint so the next run redoes just these
+            print(f'[FM] Sync for {lfm}: {len(failed)} window(s) failed on page 1, left pending')
+            return (fetched[0] + repaired_rows, await self._count_cached_scrobbles(lfm))
+        await self._finish_sync(lfm, to_ts)
+        for _, _, _, new_rows in await self._verify_sync(lfm):
+            repaired_rows += new_rows
+        return (fetched[0] + repaired_rows, await self._count_cached_scrobbles(lfm))
+
+    async def _remote_window_total(self, lfm, from_ts, to_ts):
+        data = await self._fetch_recent_page(lfm, from_ts, to_ts, 1, record_hole=False, limit=1)
+        if data is None:
+            return None
+        return int(data['recenttracks'].get('@attr', {}).get('total', 0))
+
+    async def _registered_ts(self, lfm):
+        """Unix time the Last.fm account was created, or None."""
+        try:
+            data = await self._api({'method': 'user.getInfo', 'user': lfm}, PRIORITY_BACKGROUND)
+            return int(data['user']['registered']['unixtime'])
         except Exception:
-            return (0, self._count_cached_scrobbles(lfm))
-
-        attr = p1.get('recenttracks', {}).get('@attr', {})
-        total_pages = int(attr.get('totalPages', 1))
-        total = int(attr.get('total', 0))
-        if total == 0:
-            now_ts = int(time.time())
-            cached = self._count_cached_scrobbles(lfm)
-            self._update_sync_state(lfm, now_ts, cached)
-            return (0, cached)
-
-        def parse_page(data):
-            tracks = data.get('recenttracks', {}).get('track', [])
-            if isinstance(tracks, dict):
-                tracks = [tracks]
-            rows = []
-            for t in tracks:
-                if t.get('@attr', {}).get('nowplaying') == 'true':
+            return None
+
+    async def _verify_sync(self, lfm):
+        """Compare cached counts per calendar window with Last.fm's `total`
+        and refetch only the windows that come up short.
+
+        Whole years are checked first; a short year (or the current, partial
+        one) is narrowed to its months, and only short months are refetched.
+        Returns [(label, cached, remote, new_rows)] for every refetched window.
+        """
+        sync_state = await self._get_sync_state(lfm)
+        if sync_state is None:
+            return []
+        synced_until = sync_state[0]
+        start = await self._registered_ts(lfm)
+        if start is None:
+            row = await self.db.fetchone(SQL_FIRST_DAY, (lfm,))
+            start = synced_until
+            if row and row[0]:
+                first_day = datetime.datetime.strptime(str(row[0]), ROLLUP_GRAINS['day'])
+                start = int(first_day.replace(tzinfo=datetime.timezone.utc).timestamp())
+        counts = dict(await self.db.fetchall(SQL_VERIFY_COUNTS, (lfm,)))
+
+        def utc(y, m=1):
+            return int(datetime.datetime(y, m, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+        async def is_short(key, from_ts, to_ts):
+            remote = await self._remote_window_total(lfm, from_ts, to_ts)
+            cached = counts.get(key, 0)
+            return remote is not None and cached < remote, cached, remote
+
+        refetched = []
+        first_year = time.gmtime(start).tm_year
+        last_year = time.gmtime(synced_until).tm_year
+        for y in range(first_year, last_year + 1):
+            if utc(y + 1) - 1 <= synced_until:
+                short, _, _ = await is_short(f'year:{y}', utc(y), utc(y + 1) - 1)
+                if not short:
                     continue
-                uts = t.get('date', {}).get('uts')
-                if not uts or int(uts) < 1000000000:
+            for m in range(1, 13):
+                m_from = utc(y, m)
+                m_to = (utc(y + 1) if m == 12 else utc(y, m + 1)) - 1
+                if m_to < start or m_to > synced_until:
                     continue
-                artist = t.get('artist', {}).get('#text', '') or ''
-                track  = t.get('name', '') or ''
-                album  = t.get('album', {}).get('#text', '') or ''
-                rows.append((artist, track, album, int(uts)))
-            return rows
-
-        # Store page 1
-        rows1 = parse_page(p1)
-        if rows1:
-            self._insert_scrobbles(lfm, rows1)
-        fetched = len(rows1)
-
-        if total_pages > 1:
-            sem = asyncio.Semaphore(5)
-            batch_size = 5
-            pages = list(range(2, total_pages + 1))
-            batch_num = 0
-
-            for i in range(0, len(pages), batch_size):
-                batch = pages[i:i + batch_size]
-
-                async def fetch_page(pg):
-                    p = dict(params)
-                    p['page'] = pg
-                    async with sem:
-                        try:
-                            return await self._api(session, p)
-                        except Exception:
-                            return {}
-
-                results = await asyncio.gather(*[fetch_page(pg) for pg in batch])
-                for data in results:
-                    rows = parse_page(data)
-                    if rows:
-                        self._insert_scrobbles(lfm, rows)
-                        fetched += len(rows)
-
-                batch_num += 1
-                if status_callback and batch_num % 4 == 0:
-                    pages_done = min(i + batch_size + 1, total_pages)
-                    await status_callback(pages_done, total_pages, fetched)
-
-                if i + batch_size < len(pages):
-                    await asyncio.sleep(1.0)
-
-        # Finalize sync state
-        con = sqlite3.connect(DB_PATH)
-        max_ts_row = con.execute(
-            'SELECT MAX(scrobbled_at) FROM scrobbles WHERE lfm_username = ?', (lfm,)
-        ).fetchone()
-        total_cached = con.execute(
-            'SELECT COUNT(*) FROM scrobbles WHERE lfm_username = ?', (lfm,)
-        ).fetchone()[0]
-        con.close()
+                short, cached, remote = await is_short(f'month:{y}{m:02d}', m_from, m_to)
+                if short:
+                    new_rows = await self._fetch_window(lfm, m_from, m_to)
+                    refetched.append((f'{y}-{m:02d}', cached, remote, new_rows))
 
-        last_synced_ts = max_ts_row[0] if max_ts_row and max_ts_row[0] else int(time.time())
-        self._update_sync_state(lfm, last_synced_ts, total_cached)
-        return (fetched, total_cached)
+        if refetched:
+            await self._finish_sync(lfm, synced_until)
+        return refetched
+
+    # ------------------------------------------------------------------ #
+    #  Background sync                                                     #
+    # ------------------------------------------------------------------ #
+    @tasks.loop(seconds=SYNC_TICK_SECS)
+    async def _sync_scheduler(self):
+        """Round-robin delta syncs across every registered user.
+        The most overdue user goes first; runs pause while interactive
+        requests are queued or the background request budget is spent."""
+        now = time.monotonic()
+        self._sync_budget = min(
+            SYNC_BUDGET_BURST,
+            self._sync_budget + (now - self._sync_budget_stamp) * SYNC_BUDGET_PER_HOUR / 3600
+        )
+        self._sync_budget_stamp = now
+
+        while self._sync_budget > 0 and not self.limiter.pending(PRIORITY_INTERACTIVE):
+            lfm = await self._next_due_sync()
+            if lfm is None:
+                break
+            before = self.limiter.granted_by_priority[PRIORITY_BACKGROUND]
+            ok = True
+            try:
+                fetched, _ = await self._sync_scrobbles(lfm)
+                if fetched:
+                    self._crowns_dirty |= await self._member_guilds(lfm)
+            except Exception as e:
+                print(f'[FM] background sync failed for {lfm}: {e}')
+                ok = False
+            self._sync_budget -= self.limiter.granted_by_priority[PRIORITY_BACKGROUND] - before
+            await self._reschedule_sync(lfm, ok)
+
+        # Crowns follow the rollups: once per tick for every guild with a
+        # member whose sync brought in new plays
+        while self._crowns_dirty:
+            guild = self.bot.get_guild(self._crowns_dirty.pop())
+            if guild is None:
+                continue
+            try:
+                await self._recompute_guild_crowns(guild)
+            except Exception as e:
+                print(f'[FM] crown recompute failed for {guild.name}: {e}')
+
+        # Recommendation neighbour lists likewise, for the artists that got plays
+        if self._recs_dirty and np is not None:
+            self._recs_dirty = False
+            try:
+                await self._update_recommendations()
+            except Exception as e:
+                print(f'[FM] recommendation update failed: {e}')
+
+    @_sync_scheduler.before_loop
+    async def _before_sync_scheduler(self):
+        await self.bot.wait_until_ready()
+        self._crowns_dirty |= {guild.id for guild in self.bot.guilds}
+        self._recs_dirty = True
+
+    async def _next_due_sync(self):
+        """Enrol new users (staggered over one interval), drop departed ones,
+        and return the most overdue username, or None."""
+        def pick(con):
+            now = int(time.time())
+            con.execute(
+                'INSERT OR IGNORE INTO sync_schedule (lfm_username, next_run_at) '
+                'SELECT DISTINCT lastfm_username, ? + ABS(RANDOM()) % ? FROM users',
+                (now, SYNC_INTERVAL_SECS)
+            )
+            con.execute(
+                'DELETE FROM sync_schedule '
+                'WHERE lfm_username NOT IN (SELECT lastfm_username FROM users)'
+            )
+            row = con.execute(
+                'SELECT lfm_username FROM sync_schedule WHERE next_run_at <= ? '
+                'ORDER BY next_run_at LIMIT 1',
+                (now,)
+            ).fetchone()
+            return row[0] if row else None
+
+        return await self.db.write(pick)
+
+    async def _reschedule_sync(self, lfm, ok):
+        def reschedule(con):
+            row = con.execute(
+                'SELECT failures FROM sync_schedule WHERE lfm_username = ?', (lfm,)
+            ).fetchone()
+            failures = 0 if ok else (row[0] if row else 0) + 1
+            delay = min(SYNC_INTERVAL_SECS * 2 ** failures, SYNC_MAX_BACKOFF_SECS)
+            delay *= random.uniform(1 - SYNC_JITTER, 1 + SYNC_JITTER)
+            now = int(time.time())
+            con.execute(
+                'UPDATE sync_schedule SET next_run_at = ?, last_run_at = ?, failures = ? '
+                'WHERE lfm_username = ?',
+                (now + int(delay), now, failures, lfm)
+            )
+
+        await self.db.write(reschedule)
 
     def _no_lfm_msg(self):
         return 'No Last.fm username set. Use `!setfm <username>`.'
@@ -367,7 +3498,13 @@ class FM(commands.Cog):
     @app_commands.describe(username='Your Last.fm username')
     async def setfm(self, ctx, username: str):
         """Set your Last.fm username."""
-        self._set_lfm(ctx.author.id, username)
+        await self._set_lfm(ctx.author.id, username)
+        await self.db.execute(
+            'INSERT OR REPLACE INTO sync_schedule (lfm_username, next_run_at) VALUES (?, ?)',
+            (username, int(time.time()))
+        )
+        if ctx.guild:
+            await self._record_membership(ctx.guild.id, [(ctx.author.id, ctx.author)])
         await ctx.send(f'Last.fm username set to `{username}`.')
 
     @commands.hybrid_command()
@@ -375,13 +3512,12 @@ class FM(commands.Cog):
     async def fm(self, ctx, member: Optional[discord.Member] = None):
         """Show now playing / last played track."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            track = await self._current_track(session, lfm)
+        track = await self._current_track(lfm)
 
         if not track:
             await ctx.send(f'No recent tracks found for `{lfm}`.')
@@ -410,17 +3546,16 @@ class FM(commands.Cog):
     async def recent(self, ctx, member: Optional[discord.Member] = None):
         """Show 5 most recent tracks."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            data = await self._api(session, {
-                'method': 'user.getrecenttracks',
-                'user': lfm,
-                'limit': 5
-            })
+        data = await self._api({
+            'method': 'user.getrecenttracks',
+            'user': lfm,
+            'limit': 5
+        })
 
         tracks = data.get('recenttracks', {}).get('track', [])
         if not tracks:
@@ -443,134 +3578,86 @@ class FM(commands.Cog):
     #  Commands: plays / top lists                                         #
     # ------------------------------------------------------------------ #
     @commands.hybrid_command(aliases=['p'])
-    @app_commands.describe(member='User to look up (default: you)', period='Time period')
-    async def plays(self, ctx, member: Optional[discord.Member] = None, period: Period = 'week'):
-        """Total scrobble count for a period."""
+    @app_commands.describe(member='User to look up (default: you)', period=PERIOD_DESCRIPTION)
+    async def plays(self, ctx, member: Optional[discord.Member] = None, *, period: str = 'week'):
+        """Total scrobble count for a period or date range."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
+        try:
+            period = _parse_period(period)
+        except ValueError as e:
+            await ctx.send(str(e))
+            return
 
-        lfm_period = PERIODS.get(period, '7day')
-        async with aiohttp.ClientSession() as session:
-            data = await self._api(session, {
-                'method': 'user.getrecenttracks',
-                'user': lfm,
-                'period': lfm_period,
-                'limit': 1
-            })
-
-        total = data.get('recenttracks', {}).get('@attr', {}).get('total', '?')
+        total = await self._scrobble_total(lfm, period)
+        if isinstance(period, DateRange):
+            label, when = period.label, f'in {period.label}'
+        else:
+            label, when = period, f'this {period}'
         await ctx.send(
-            f'**{lfm}** has **{int(total):,}** scrobbles this {period}.'
-            if str(total).isdigit() else f'**{lfm}**: {total} scrobbles ({period})'
+            f'**{lfm}** has **{total:,}** scrobbles {when}.'
+            if total is not None else f'**{lfm}**: ? scrobbles ({label})'
         )
 
-    @commands.hybrid_command(aliases=['tt'])
-    @app_commands.describe(member='User to look up (default: you)', period='Time period')
-    async def toptracks(self, ctx, member: Optional[discord.Member] = None, period: Period = 'week'):
-        """Top 10 tracks for a period."""
+    async def _send_top(self, ctx, member, period, kind, title):
+        """Shared body of .toptracks / .topalbums / .topartists."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
-
-        lfm_period = PERIODS.get(period, '7day')
-        async with aiohttp.ClientSession() as session:
-            data = await self._api(session, {
-                'method': 'user.gettoptracks',
-                'user': lfm,
-                'period': lfm_period,
-                'limit': 10
-            })
-
-        tracks = data.get('toptracks', {}).get('track', [])
-        if not tracks:
-            await ctx.send(f'No top tracks found for `{lfm}`.')
+        try:
+            period = _parse_period(period)
+        except ValueError as e:
+            await ctx.send(str(e))
             return
 
-        lines = [
-            f'`{i+1}.` **{t["name"]}** — {t["artist"]["name"]} ({int(t["playcount"]):,} plays)'
-            for i, t in enumerate(tracks)
-        ]
-        embed = discord.Embed(
-            title=f'Top tracks ({period}) — {lfm}',
-            description='\n'.join(lines),
-            color=0xD51007
-        )
-        await ctx.send(embed=embed)
-
-    @commands.hybrid_command(aliases=['tab'])
-    @app_commands.describe(member='User to look up (default: you)', period='Time period')
-    async def topalbums(self, ctx, member: Optional[discord.Member] = None, period: Period = 'week'):
-        """Top 10 albums for a period."""
-        user = member or ctx.author
-        lfm = self._get_lfm(user)
-        if not lfm:
-            await ctx.send(self._no_lfm_msg())
-            return
+        label = period.label if isinstance(period, DateRange) else period
+        # Pin the page source for the pager's lifetime: a sync finishing or
+        # the cache going stale mid-way must not switch cursor types
+        cached = isinstance(period, DateRange) and await self._cache_covers(lfm, period)
+
+        async def fetch(cursor, page):
+            items, next_cursor = await self._top_page(lfm, kind, period, cursor, cached=cached)
+            if not items:
+                return None, None
+            first = (page - 1) * PAGE_SIZE + 1
+            lines = [
+                f'`{i}.` **{name}** — {artist} ({plays:,} plays)' if artist else
+                f'`{i}.` **{name}** — {plays:,} plays'
+                for i, (name, artist, plays) in enumerate(items, first)
+            ]
+            embed = discord.Embed(
+                title=f'{title} ({label}) — {lfm}',
+                description='\n'.join(lines),
+                color=0xD51007
+            )
+            embed.set_footer(text=f'Page {page}')
+            return embed, next_cursor
 
-        lfm_period = PERIODS.get(period, '7day')
-        async with aiohttp.ClientSession() as session:
-            data = await self._api(session, {
-                'method': 'user.gettopalbums',
-                'user': lfm,
-                'period': lfm_period,
-                'limit': 10
-            })
+        if not await FMPager(ctx.author.id, fetch).start(ctx):
+            await ctx.send(f'No top {kind}s found for `{lfm}` ({label}).')
 
-        albums = data.get('topalbums', {}).get('album', [])
-        if not albums:
-            await ctx.send(f'No top albums found for `{lfm}`.')
-            return
+    @commands.hybrid_command(aliases=['tt'])
+    @app_commands.describe(member='User to look up (default: you)', period=PERIOD_DESCRIPTION)
+    async def toptracks(self, ctx, member: Optional[discord.Member] = None, *, period: str = 'week'):
+        """Top 10 tracks for a period or date range."""
+        await self._send_top(ctx, member, period, 'track', 'Top tracks')
 
-        lines = [
-            f'`{i+1}.` **{a["name"]}** — {a["artist"]["name"]} ({int(a["playcount"]):,} plays)'
-            for i, a in enumerate(albums)
-        ]
-        embed = discord.Embed(
-            title=f'Top albums ({period}) — {lfm}',
-            description='\n'.join(lines),
-            color=0xD51007
-        )
-        await ctx.send(embed=embed)
+    @commands.hybrid_command(aliases=['tab'])
+    @app_commands.describe(member='User to look up (default: you)', period=PERIOD_DESCRIPTION)
+    async def topalbums(self, ctx, member: Optional[discord.Member] = None, *, period: str = 'week'):
+        """Top 10 albums for a period or date range."""
+        await self._send_top(ctx, member, period, 'album', 'Top albums')
 
     @commands.hybrid_command(aliases=['ta'])
-    @app_commands.describe(member='User to look up (default: you)', period='Time period')
-    async def topartists(self, ctx, member: Optional[discord.Member] = None, period: Period = 'week'):
-        """Top 10 artists for a period."""
-        user = member or ctx.author
-        lfm = self._get_lfm(user)
-        if not lfm:
-            await ctx.send(self._no_lfm_msg())
-            return
-
-        lfm_period = PERIODS.get(period, '7day')
-        async with aiohttp.ClientSession() as session:
-            data = await self._api(session, {
-                'method': 'user.gettopartists',
-                'user': lfm,
-                'period': lfm_period,
-                'limit': 10
-            })
-
-        artists = data.get('topartists', {}).get('artist', [])
-        if not artists:
-            await ctx.send(f'No top artists found for `{lfm}`.')
-            return
-
-        lines = [
-            f'`{i+1}.` **{a["name"]}** — {int(a["playcount"]):,} plays'
-            for i, a in enumerate(artists)
-        ]
-        embed = discord.Embed(
-            title=f'Top artists ({period}) — {lfm}',
-            description='\n'.join(lines),
-            color=0xD51007
-        )
-        await ctx.send(embed=embed)
+    @app_commands.describe(member='User to look up (default: you)', period=PERIOD_DESCRIPTION)
+    async def topartists(self, ctx, member: Optional[discord.Member] = None, *, period: str = 'week'):
+        """Top 10 artists for a period or date range."""
+        await self._send_top(ctx, member, period, 'artist', 'Top artists')
 
     # ------------------------------------------------------------------ #
     #  Commands: track / album / artist info                               #
@@ -579,35 +3666,34 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Track (leave blank for current track)')
     async def track(self, ctx, *, query: str = None):
         """Info + your play count for current or named track (Artist - Track)."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                artist_name = t['artist']['#text']
-                track_name  = t['name']
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            track_name  = t['name']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name, track_name = parts[0].strip(), parts[1].strip()
             else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name, track_name = parts[0].strip(), parts[1].strip()
-                else:
-                    t = await self._current_track(session, lfm)
-                    artist_name = t['artist']['#text'] if t else query
-                    track_name  = query
-
-            data = await self._api(session, {
-                'method': 'track.getInfo',
-                'artist': artist_name,
-                'track': track_name,
-                'username': lfm,
-                'autocorrect': 1
-            })
+                t = await self._current_track(lfm)
+                artist_name = t['artist']['#text'] if t else query
+                track_name  = query
+
+        data = await self._api({
+            'method': 'track.getInfo',
+            'artist': artist_name,
+            'track': track_name,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ti = data.get('track', {})
         if not ti:
@@ -642,35 +3728,34 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Track (leave blank for current track)')
     async def trackplays(self, ctx, *, query: str = None):
         """Play count for current or named track."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                artist_name = t['artist']['#text']
-                track_name  = t['name']
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            track_name  = t['name']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name, track_name = parts[0].strip(), parts[1].strip()
             else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name, track_name = parts[0].strip(), parts[1].strip()
-                else:
-                    t = await self._current_track(session, lfm)
-                    artist_name = t['artist']['#text'] if t else query
-                    track_name  = query
-
-            data = await self._api(session, {
-                'method': 'track.getInfo',
-                'artist': artist_name,
-                'track': track_name,
-                'username': lfm,
-                'autocorrect': 1
-            })
+                t = await self._current_track(lfm)
+                artist_name = t['artist']['#text'] if t else query
+                track_name  = query
+
+        data = await self._api({
+            'method': 'track.getInfo',
+            'artist': artist_name,
+            'track': track_name,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ti = data.get('track', {})
         user_plays = int(ti.get('userplaycount', 0)) if ti else 0
@@ -682,27 +3767,26 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist name (leave blank for current track\'s artist)')
     async def artist(self, ctx, *, query: str = None):
         """Info + your play count for current or named artist."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                query = t['artist']['#text']
-            else:
-                query = await self._resolve_artist(session, query)
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            query = t['artist']['#text']
+        else:
+            query = await self._resolve_artist(query)
 
-            data = await self._api(session, {
-                'method': 'artist.getInfo',
-                'artist': query,
-                'username': lfm,
-                'autocorrect': 1
-            })
+        data = await self._api({
+            'method': 'artist.getInfo',
+            'artist': query,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ai = data.get('artist', {})
         if not ai:
@@ -715,7 +3799,6 @@ class FM(commands.Cog):
         scrobbles  = int(ai.get('stats', {}).get('playcount', 0))
         user_plays = int(ai.get('stats', {}).get('userplaycount', 0))
         bio        = ai.get('bio', {}).get('summary', '')
-        import re
         bio = re.sub(r'<[^>]+>', '', bio).split('Read more')[0].strip()[:300]
 
         embed = discord.Embed(title=name, url=url, color=0xD51007)
@@ -731,27 +3814,26 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist name (leave blank for current track\'s artist)')
     async def artistplays(self, ctx, *, query: str = None):
         """Play count for current or named artist."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                query = t['artist']['#text']
-            else:
-                query = await self._resolve_artist(session, query)
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            query = t['artist']['#text']
+        else:
+            query = await self._resolve_artist(query)
 
-            data = await self._api(session, {
-                'method': 'artist.getInfo',
-                'artist': query,
-                'username': lfm,
-                'autocorrect': 1
-            })
+        data = await self._api({
+            'method': 'artist.getInfo',
+            'artist': query,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ai = data.get('artist', {})
         user_plays = int(ai.get('stats', {}).get('userplaycount', 0)) if ai else 0
@@ -762,35 +3844,34 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Album (leave blank for current album)')
     async def album(self, ctx, *, query: str = None):
         """Info + your play count for current or named album (Artist - Album)."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                artist_name = t['artist']['#text']
-                album_name  = t['album']['#text']
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            album_name  = t['album']['#text']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name, album_name = parts[0].strip(), parts[1].strip()
             else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name, album_name = parts[0].strip(), parts[1].strip()
-                else:
-                    t = await self._current_track(session, lfm)
-                    artist_name = t['artist']['#text'] if t else query
-                    album_name  = query
-
-            data = await self._api(session, {
-                'method': 'album.getInfo',
-                'artist': artist_name,
-                'album': album_name,
-                'username': lfm,
-                'autocorrect': 1
-            })
+                t = await self._current_track(lfm)
+                artist_name = t['artist']['#text'] if t else query
+                album_name  = query
+
+        data = await self._api({
+            'method': 'album.getInfo',
+            'artist': artist_name,
+            'album': album_name,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ali = data.get('album', {})
         if not ali:
@@ -820,35 +3901,34 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Album (leave blank for current album)')
     async def albumplays(self, ctx, *, query: str = None):
         """Play count for current or named album."""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found.')
-                    return
-                artist_name = t['artist']['#text']
-                album_name  = t['album']['#text']
+        if not query:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            album_name  = t['album']['#text']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name, album_name = parts[0].strip(), parts[1].strip()
             else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name, album_name = parts[0].strip(), parts[1].strip()
-                else:
-                    t = await self._current_track(session, lfm)
-                    artist_name = t['artist']['#text'] if t else query
-                    album_name  = query
-
-            data = await self._api(session, {
-                'method': 'album.getInfo',
-                'artist': artist_name,
-                'album': album_name,
-                'username': lfm,
-                'autocorrect': 1
-            })
+                t = await self._current_track(lfm)
+                artist_name = t['artist']['#text'] if t else query
+                album_name  = query
+
+        data = await self._api({
+            'method': 'album.getInfo',
+            'artist': artist_name,
+            'album': album_name,
+            'username': lfm,
+            'autocorrect': 1
+        })
 
         ali = data.get('album', {})
         user_plays = int(ali.get('userplaycount', 0)) if ali else 0
@@ -863,28 +3943,27 @@ class FM(commands.Cog):
     @app_commands.describe(artist='Artist name (leave blank for current track\'s artist)')
     async def whoknows(self, ctx, *, artist: str = None):
         """Server members ranked by plays for an artist."""
-        async with aiohttp.ClientSession() as session:
-            if not artist:
-                lfm = self._get_lfm(ctx.author)
-                if not lfm:
-                    await ctx.send('Provide an artist name, or set your Last.fm with `.setfm <username>`.')
-                    return
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('Could not get current artist. Provide an artist name.')
-                    return
-                artist = t['artist']['#text']
-            else:
-                artist = await self._resolve_artist(session, artist)
+        if not artist:
+            lfm = await self._get_lfm(ctx.author)
+            if not lfm:
+                await ctx.send('Provide an artist name, or set your Last.fm with `.setfm <username>`.')
+                return
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('Could not get current artist. Provide an artist name.')
+                return
+            artist = t['artist']['#text']
+        else:
+            artist = await self._resolve_artist(artist)
 
         registered = await self._guild_registered(ctx.guild)
         if not registered:
             await ctx.send('No registered Last.fm users in this server.')
             return
 
-        async def fetch_plays(session, member, lfm):
+        async def fetch_plays(member, lfm):
             try:
-                data = await self._api(session, {
+                data = await self._api({
                     'method': 'artist.getInfo',
                     'artist': artist,
                     'username': lfm,
@@ -895,9 +3974,14 @@ class FM(commands.Cog):
             except Exception:
                 return None
 
+        # Members with a fresh scrobble cache are answered from the rollup;
+        # only the rest cost an artist.getInfo each.
+        fresh, stale = await self._split_by_freshness(registered)
+        cached = await self._cached_plays('artist', (_fold(artist),), [l for _, l in fresh])
+
         async with ctx.typing():
-            async with aiohttp.ClientSession() as session:
-                raw = await asyncio.gather(*[fetch_plays(session, m, l) for m, l in registered])
+            raw = await asyncio.gather(*[fetch_plays(m, l) for m, l in stale])
+        raw += [(m, cached.get(l, 0)) for m, l in fresh]
 
         results = sorted(
             [r for r in raw if r and r[1] > 0],
@@ -907,18 +3991,18 @@ class FM(commands.Cog):
         crown_holder_id = None
         if results:
             top_member, top_plays = results[0]
-            if top_plays >= 30:
-                existing = self._get_crown(str(ctx.guild.id), artist.strip().lower())
+            if top_plays >= CROWN_MIN_PLAYS:
+                existing = await self._get_crown(str(ctx.guild.id), artist.strip().lower())
                 if existing is None:
-                    self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
+                    await self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
                     crown_holder_id = top_member.id
                 elif existing[1] == str(top_member.id):
-                    self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
+                    await self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
                     crown_holder_id = top_member.id
                 else:
                     old_member = ctx.guild.get_member(int(existing[1]))
                     old_name = old_member.display_name if old_member else existing[0]
-                    self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
+                    await self._set_crown(str(ctx.guild.id), artist, artist, str(top_member.id), top_plays)
                     await ctx.send(f'👑 **{top_member.display_name}** stole the crown for **{artist}** from {old_name} with {top_plays:,} plays!')
                     crown_holder_id = top_member.id
 
@@ -941,53 +4025,63 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Track (leave blank for current track)')
     async def whoknowstrack(self, ctx, *, query: str = None):
         """Server members ranked by plays for a track."""
-        lfm_author = self._get_lfm(ctx.author)
+        lfm_author = await self._get_lfm(ctx.author)
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
+        if not query:
+            if not lfm_author:
+                await ctx.send('Provide a track, or set your Last.fm with `.setfm <username>`.')
+                return
+            t = await self._current_track(lfm_author)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            track_name  = t['name']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name = await self._resolve_artist(parts[0].strip())
+                track_name  = parts[1].strip()
+            else:
                 if not lfm_author:
-                    await ctx.send('Provide a track, or set your Last.fm with `.setfm <username>`.')
-                    return
-                t = await self._current_track(session, lfm_author)
-                if not t:
-                    await ctx.send('No recent track found.')
+                    await ctx.send('Use format: Artist - Track')
                     return
-                artist_name = t['artist']['#text']
-                track_name  = t['name']
-            else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name = await self._resolve_artist(session, parts[0].strip())
-                    track_name  = parts[1].strip()
-                else:
-                    if not lfm_author:
-                        await ctx.send('Use format: Artist - Track')
-                        return
-                    t = await self._current_track(session, lfm_author)
-                    artist_name = t['artist']['#text'] if t else query
-                    track_name  = query
+                t = await self._current_track(lfm_author)
+                artist_name = t['artist']['#text'] if t else query
+                track_name  = query
 
-            registered = await self._guild_registered(ctx.guild)
-            if not registered:
-                await ctx.send('No registered Last.fm users in this server.')
-                return
+        registered = await self._guild_registered(ctx.guild)
+        if not registered:
+            await ctx.send('No registered Last.fm users in this server.')
+            return
+
+        async def fetch_track_plays(member, lfm):
+            try:
+                data = await self._api({
+                    'method': 'track.getInfo',
+                    'artist': artist_name,
+                    'track': track_name,
+                    'username': lfm,
+                    'autocorrect': 1
+                })
+                plays = int(data.get('track', {}).get('userplaycount', 0))
+                return (member.display_name, plays)
+            except Exception:
+                return None
 
-            async def fetch_track_plays(session, member, lfm):
-                try:
-                    data = await self._api(session, {
-                        'method': 'track.getInfo',
-                        'artist': artist_name,
-                        'track': track_name,
-                        'username': lfm,
-                        'autocorrect': 1
-                    })
-                    plays = int(data.get('track', {}).get('userplaycount', 0))
-                    return (member.display_name, plays)
-                except Exception:
-                    return None
+        fresh, stale = await self._split_by_freshness(registered)
+        cached = {}
+        if fresh:
+            canon_artist, canon_track = await self._canonical_names(
+                'track', artist_name, track_name
+            )
+            cached = await self._cached_plays(
+                'track', (_fold(canon_artist), _fold(canon_track)), [l for _, l in fresh]
+            )
 
-            async with ctx.typing():
-                raw = await asyncio.gather(*[fetch_track_plays(session, m, l) for m, l in registered])
+        async with ctx.typing():
+            raw = await asyncio.gather(*[fetch_track_plays(m, l) for m, l in stale])
+        raw += [(m.display_name, cached.get(l, 0)) for m, l in fresh]
 
         results = sorted(
             [r for r in raw if r and r[1] > 0],
@@ -1010,53 +4104,63 @@ class FM(commands.Cog):
     @app_commands.describe(query='Artist - Album (leave blank for current album)')
     async def whoknowsalbum(self, ctx, *, query: str = None):
         """Server members ranked by plays for an album."""
-        lfm_author = self._get_lfm(ctx.author)
+        lfm_author = await self._get_lfm(ctx.author)
 
-        async with aiohttp.ClientSession() as session:
-            if not query:
+        if not query:
+            if not lfm_author:
+                await ctx.send('Provide an album, or set your Last.fm with `.setfm <username>`.')
+                return
+            t = await self._current_track(lfm_author)
+            if not t:
+                await ctx.send('No recent track found.')
+                return
+            artist_name = t['artist']['#text']
+            album_name  = t['album']['#text']
+        else:
+            parts = query.split(' - ', 1)
+            if len(parts) == 2:
+                artist_name = await self._resolve_artist(parts[0].strip())
+                album_name  = parts[1].strip()
+            else:
                 if not lfm_author:
-                    await ctx.send('Provide an album, or set your Last.fm with `.setfm <username>`.')
-                    return
-                t = await self._current_track(session, lfm_author)
-                if not t:
-                    await ctx.send('No recent track found.')
+                    await ctx.send('Use format: Artist - Album')
                     return
-                artist_name = t['artist']['#text']
-                album_name  = t['album']['#text']
-            else:
-                parts = query.split(' - ', 1)
-                if len(parts) == 2:
-                    artist_name = await self._resolve_artist(session, parts[0].strip())
-                    album_name  = parts[1].strip()
-                else:
-                    if not lfm_author:
-                        await ctx.send('Use format: Artist - Album')
-                        return
-                    t = await self._current_track(session, lfm_author)
-                    artist_name = t['artist']['#text'] if t else query
-                    album_name  = query
+                t = await self._current_track(lfm_author)
+                artist_name = t['artist']['#text'] if t else query
+                album_name  = query
 
-            registered = await self._guild_registered(ctx.guild)
-            if not registered:
-                await ctx.send('No registered Last.fm users in this server.')
-                return
+        registered = await self._guild_registered(ctx.guild)
+        if not registered:
+            await ctx.send('No registered Last.fm users in this server.')
+            return
 
-            async def fetch_album_plays(session, member, lfm):
-                try:
-                    data = await self._api(session, {
-                        'method': 'album.getInfo',
-                        'artist': artist_name,
-                        'album': album_name,
-                        'username': lfm,
-                        'autocorrect': 1
-                    })
-                    plays = int(data.get('album', {}).get('userplaycount', 0))
-                    return (member.display_name, plays)
-                except Exception:
-                    return None
+        async def fetch_album_plays(member, lfm):
+            try:
+                data = await self._api({
+                    'method': 'album.getInfo',
+                    'artist': artist_name,
+                    'album': album_name,
+                    'username': lfm,
+                    'autocorrect': 1
+                })
+                plays = int(data.get('album', {}).get('userplaycount', 0))
+                return (member.display_name, plays)
+            except Exception:
+                return None
 
-            async with ctx.typing():
-                raw = await asyncio.gather(*[fetch_album_plays(session, m, l) for m, l in registered])
+        fresh, stale = await self._split_by_freshness(registered)
+        cached = {}
+        if fresh:
+            canon_artist, canon_album = await self._canonical_names(
+                'album', artist_name, album_name
+            )
+            cached = await self._cached_plays(
+                'album', (_fold(canon_artist), _fold(canon_album)), [l for _, l in fresh]
+            )
+
+        async with ctx.typing():
+            raw = await asyncio.gather(*[fetch_album_plays(m, l) for m, l in stale])
+        raw += [(m.display_name, cached.get(l, 0)) for m, l in fresh]
 
         results = sorted(
             [r for r in raw if r and r[1] > 0],
@@ -1082,8 +4186,8 @@ class FM(commands.Cog):
     @app_commands.describe(other='The other user to compare with', period='Time period')
     async def taste(self, ctx, other: discord.Member, period: Period = 'all'):
         """Compare top artist overlap between you and another user."""
-        lfm1 = self._get_lfm(ctx.author)
-        lfm2 = self._get_lfm(other)
+        lfm1 = await self._get_lfm(ctx.author)
+        lfm2 = await self._get_lfm(other)
         if not lfm1:
             await ctx.send('Set your Last.fm with `.setfm <username>`.')
             return
@@ -1091,232 +4195,442 @@ class FM(commands.Cog):
             await ctx.send(f'{other.display_name} has no Last.fm set.')
             return
 
-        lfm_period = PERIODS.get(period, 'overall')
-
-        async def fetch_top_artists(session, lfm):
-            data = await self._api(session, {
+        async def fetch_top_artists(lfm):
+            data = await self._api({
                 'method': 'user.gettopartists',
                 'user': lfm,
-                'period': lfm_period,
+                'period': PERIODS.get(period, 'overall'),
                 'limit': 1000
             })
             artists = data.get('topartists', {}).get('artist', [])
             return {a['name'].lower(): (a['name'], int(a['playcount'])) for a in artists}
 
+        similarity = ''
         async with ctx.typing():
-            async with aiohttp.ClientSession() as session:
+            cached = np is not None and period == 'all' and all(await asyncio.gather(
+                self._get_sync_state(lfm1), self._get_sync_state(lfm2)
+            ))
+            if cached:
+                # All-time plays are in the cache: compare the taste vectors
+                v1, v2 = await asyncio.gather(self._taste_vector(lfm1), self._taste_vector(lfm2))
+                ids, i1, i2 = np.intersect1d(v1.ids, v2.ids, assume_unique=True, return_indices=True)
+                sizes = len(v1.ids), len(v2.ids)
+                shared = [(self.music.labels[item], int(p1), int(p2))
+                          for item, p1, p2 in zip(ids, v1.plays[i1], v2.plays[i2])]
+                if len(ids):
+                    cosine, jaccard = await asyncio.to_thread(_taste_similarity, [v1, v2])
+                    similarity = f' · {cosine[0, 1]:.0%} similar ({jaccard[0, 1]:.0%} weighted overlap)'
+            else:
                 map1, map2 = await asyncio.gather(
-                    fetch_top_artists(session, lfm1),
-                    fetch_top_artists(session, lfm2)
+                    fetch_top_artists(lfm1),
+                    fetch_top_artists(lfm2)
                 )
+                sizes = len(map1), len(map2)
+                shared = [(map1[k][0], map1[k][1], map2[k][1]) for k in set(map1) & set(map2)]
 
-        shared_keys = set(map1) & set(map2)
-        if not shared_keys:
+        if not shared:
             await ctx.send(f'No shared artists found between **{lfm1}** and **{lfm2}**.')
             return
 
-        overlap_pct = round(len(shared_keys) / max(len(map1), len(map2)) * 100)
-        shared = sorted(
-            [(map1[k][0], map1[k][1], map2[k][1]) for k in shared_keys],
-            key=lambda x: x[1] + x[2], reverse=True
-        )[:10]
+        overlap_pct = round(len(shared) / max(sizes) * 100)
+        top = heapq.nlargest(10, shared, key=lambda x: x[1] + x[2])
 
-        lines = [f'**{name}** — {p1:,} / {p2:,}' for name, p1, p2 in shared]
+        lines = [f'**{name}** — {p1:,} / {p2:,}' for name, p1, p2 in top]
         embed = discord.Embed(
             title=f'Taste comparison — {lfm1} vs {lfm2}',
-            description=f'**{overlap_pct}% overlap** ({len(shared_keys)} shared artists)\n\n' + '\n'.join(lines),
+            description=f'**{overlap_pct}% overlap** ({len(shared)} shared artists){similarity}\n\n'
+                        + '\n'.join(lines),
             color=0xD51007
         )
         embed.set_footer(text=f'{lfm1} plays / {lfm2} plays')
         await ctx.send(embed=embed)
 
-    @commands.hybrid_command(aliases=['o'])
-    @app_commands.describe(member='User to look up (default: you)', period='Time period')
-    async def overview(self, ctx, member: Optional[discord.Member] = None, period: Period = 'week'):
-        """Top track + album + artist summary for a period."""
+    @commands.hybrid_command(aliases=['compat'])
+    async def compatibility(self, ctx):
+        """The most compatible pairs of listeners in this server."""
+        if np is None:
+            await ctx.send('Taste matching needs numpy installed on the bot host.')
+            return
+        async with ctx.typing():
+            registered = await self._guild_registered(ctx.guild)
+            matrix = await self._taste_matrix(ctx.guild)
+        n = len(matrix.lfms)
+        if n < 2:
+            await ctx.send('Not enough cached listening history in this server yet — try again after a sync.')
+            return
+
+        names = {}
+        for member, lfm in registered:
+            names.setdefault(lfm, member.display_name)
+        upper = np.triu_indices(n, 1)
+        scores = matrix.cosine[upper]
+        best = np.argsort(scores)[::-1][:10]
+        lines = []
+        for rank, k in enumerate(best, 1):
+            a, b = upper[0][k], upper[1][k]
+            lines.append(
+                f'`{rank}.` **{names[matrix.lfms[a]]}** & **{names[matrix.lfms[b]]}** — '
+                f'{matrix.cosine[a, b]:.0%} ({matrix.jaccard[a, b]:.0%} weighted overlap)'
+            )
+        embed = discord.Embed(
+            title=f'Most compatible listeners — {ctx.guild.name}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
+        embed.set_footer(text=f'Cosine similarity of artist plays · {n} listeners compared')
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(aliases=['neighbors', 'nb'])
+    @app_commands.describe(member='User to find taste neighbours for (default: you)')
+    async def neighbours(self, ctx, member: Optional[discord.Member] = None):
+        """The listeners in this server whose taste is closest to yours."""
+        if np is None:
+            await ctx.send('Taste matching needs numpy installed on the bot host.')
+            return
+        user = member or ctx.author
+        lfm = await self._get_lfm(user)
+        if not lfm:
+            await ctx.send(self._no_lfm_msg())
+            return
+        async with ctx.typing():
+            registered = await self._guild_registered(ctx.guild)
+            matrix = await self._taste_matrix(ctx.guild)
+        if lfm not in matrix.lfms:
+            await ctx.send(
+                f'Not enough cached listening history for `{lfm}` yet — '
+                f'it syncs in the background, try again in a bit.'
+            )
+            return
+        if len(matrix.lfms) < 2:
+            await ctx.send('Nobody else in this server has enough cached listening history yet.')
+            return
+
+        names = {}
+        for m, other in registered:
+            names.setdefault(other, m.display_name)
+        row = matrix.lfms.index(lfm)
+        scores = matrix.cosine[row].copy()
+        scores[row] = -1
+        lines = [
+            f'`{rank}.` **{names[matrix.lfms[k]]}** — {matrix.cosine[row, k]:.0%} '
+            f'({matrix.jaccard[row, k]:.0%} weighted overlap)'
+            for rank, k in enumerate(np.argsort(scores)[::-1][:min(10, len(scores) - 1)], 1)
+        ]
+        embed = discord.Embed(
+            title=f'Taste neighbours — {user.display_name}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
+        embed.set_footer(text=f'Cosine similarity of artist plays · {len(matrix.lfms)} listeners compared')
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(aliases=['rec', 'recs'])
+    @app_commands.describe(member='User to recommend artists to (default: you)')
+    async def recommend(self, ctx, member: Optional[discord.Member] = None):
+        """Artists you don't listen to yet, from what listeners of your favourites also play."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        lfm_period = PERIODS.get(period, '7day')
+        def query(con):
+            plays = con.execute(SQL_TASTE_VECTOR, (lfm,)).fetchall()
+            seeds = heapq.nlargest(REC_SEEDS, plays, key=lambda row: row[2])
+            return {ak for ak, _, _ in plays}, [
+                (ak, n, con.execute(SQL_ARTIST_NEIGHBOURS, (ak,)).fetchall()) for ak, _, n in seeds
+            ]
+
+        known, seeds = await self.db.read(query)
+        if not known:
+            await ctx.send(
+                f'No cached listening history for `{lfm}` yet — it syncs in the background, try again in a bit.'
+            )
+            return
+
+        # Each unheard neighbour scores its similarity to a seed, weighted
+        # by how much the user plays that seed; the biggest share explains it
+        scores, because = Counter(), {}
+        for ak, n, neighbours in seeds:
+            for nk, score in neighbours:
+                if nk in known:
+                    continue
+                share = math.log1p(n) * score
+                scores[nk] += share
+                if share > because.get(nk, (0, None))[0]:
+                    because[nk] = (share, ak)
+        if not scores:
+            await ctx.send(f'No recommendations for `{lfm}` yet — they fill in as listening history syncs.')
+            return
+
+        def label(ak):
+            item = self.music.item_id('artist', ak)
+            return self.music.labels[item] if item is not None else ak
 
-        async def fetch_top(session, method, key, subkey):
-            data = await self._api(session, {
-                'method': method,
-                'user': lfm,
-                'period': lfm_period,
-                'limit': 1
-            })
-            items = data.get(key, {}).get(subkey, [])
+        lines = [
+            f'`{i}.` **{label(nk)}** — similar to {label(because[nk][1])}'
+            for i, (nk, _) in enumerate(scores.most_common(10), 1)
+        ]
+        embed = discord.Embed(
+            title=f'Recommended artists — {user.display_name}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
+        embed.set_footer(text=f'{lfm} · from the plays of everyone with cached history')
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(aliases=['o'])
+    @app_commands.describe(member='User to look up (default: you)', period=PERIOD_DESCRIPTION)
+    async def overview(self, ctx, member: Optional[discord.Member] = None, *, period: str = 'week'):
+        """Top track + album + artist summary for a period or date range."""
+        user = member or ctx.author
+        lfm = await self._get_lfm(user)
+        if not lfm:
+            await ctx.send(self._no_lfm_msg())
+            return
+        try:
+            period = _parse_period(period)
+        except ValueError as e:
+            await ctx.send(str(e))
+            return
+
+        async def fetch_top(kind):
+            items = await self._top_items(lfm, kind, period, 1)
             return items[0] if items else None
 
         async with ctx.typing():
-            async with aiohttp.ClientSession() as session:
-                top_artist, top_album, top_track = await asyncio.gather(
-                    fetch_top(session, 'user.gettopartists', 'topartists', 'artist'),
-                    fetch_top(session, 'user.gettopalbums',  'topalbums',  'album'),
-                    fetch_top(session, 'user.gettoptracks',  'toptracks',  'track'),
-                )
+            top_artist, top_album, top_track = await asyncio.gather(
+                fetch_top('artist'), fetch_top('album'), fetch_top('track')
+            )
 
-        embed = discord.Embed(title=f'Overview ({period}) — {lfm}', color=0xD51007)
+        label = period.label if isinstance(period, DateRange) else period
+        embed = discord.Embed(title=f'Overview ({label}) — {lfm}', color=0xD51007)
         if top_artist:
-            embed.add_field(
-                name='Top artist',
-                value=f'**{top_artist["name"]}** — {int(top_artist["playcount"]):,} plays',
-                inline=False
-            )
+            name, _, plays = top_artist
+            embed.add_field(name='Top artist', value=f'**{name}** — {plays:,} plays', inline=False)
         if top_album:
-            embed.add_field(
-                name='Top album',
-                value=f'**{top_album["name"]}** — {top_album["artist"]["name"]} ({int(top_album["playcount"]):,} plays)',
-                inline=False
-            )
+            name, artist, plays = top_album
+            embed.add_field(name='Top album', value=f'**{name}** — {artist} ({plays:,} plays)', inline=False)
         if top_track:
-            embed.add_field(
-                name='Top track',
-                value=f'**{top_track["name"]}** — {top_track["artist"]["name"]} ({int(top_track["playcount"]):,} plays)',
-                inline=False
-            )
+            name, artist, plays = top_track
+            embed.add_field(name='Top track', value=f'**{name}** — {artist} ({plays:,} plays)', inline=False)
         await ctx.send(embed=embed)
 
     @commands.hybrid_command(aliases=['str'])
     @app_commands.describe(member='User to look up (default: you)')
     async def streak(self, ctx, member: Optional[discord.Member] = None):
-        """Current listening streak (artist / album / track)."""
+        """Current listening streak (artist / album / track), over your whole history."""
         user = member or ctx.author
-        lfm = self._get_lfm(user)
+        lfm = await self._get_lfm(user)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with ctx.typing():
-            async with aiohttp.ClientSession() as session:
-                data = await self._api(session, {
-                    'method': 'user.getrecenttracks',
-                    'user': lfm,
-                    'limit': 200
-                })
+        async def render():
+            await self._refresh_streaks(lfm)
+            rows = await self.db.fetchall(SQL_STREAK, (lfm,))
+            state = {kind: rest for kind, *rest in rows}
+            if 'artist' not in state:
+                return {'content': f'No scrobbles cached for `{lfm}` yet.', 'embed': None}
 
-        tracks = data.get('recenttracks', {}).get('track', [])
-        if not tracks:
-            await ctx.send(f'No recent tracks found for `{lfm}`.')
-            return
+            embed = discord.Embed(title=f'Listening streak — {lfm}', color=0xD51007)
+            for kind in STREAK_KINDS:
+                if kind not in state or not state[kind][1]:
+                    continue
+                artist, name, length, started_at = state[kind]
+                label = f'**{name}**' if kind == 'artist' else f'**{name}** by {artist}'
+                embed.add_field(
+                    name=kind.title(),
+                    value=f'{label} × {length:,}\nsince <t:{started_at}:R>',
+                    inline=True
+                )
+            sync_state = await self._get_sync_state(lfm)
+            embed.set_footer(text=_cache_age(sync_state[2] if sync_state else 0))
+            return {'content': None, 'embed': embed}
 
-        if tracks and tracks[0].get('@attr', {}).get('nowplaying') == 'true':
-            tracks = tracks[1:]
+        await self._send_cached(ctx, lfm, render)
 
-        if not tracks:
-            await ctx.send('Not enough history to calculate a streak.')
+    @commands.hybrid_command(aliases=['lstr'])
+    @app_commands.describe(member='User to look up (default: you)', kind='Artist, album or track streaks')
+    async def longeststreaks(self, ctx, member: Optional[discord.Member] = None, kind: StreakKind = 'artist'):
+        """All-time longest artist / album / track streaks for a user."""
+        user = member or ctx.author
+        lfm = await self._get_lfm(user)
+        if not lfm:
+            await ctx.send(self._no_lfm_msg())
             return
 
-        def calc_streak(tracks, key_fn):
-            if not tracks:
-                return 0, ''
-            ref = key_fn(tracks[0])
-            count = 0
-            for t in tracks:
-                if key_fn(t).lower() == ref.lower():
-                    count += 1
-                else:
-                    break
-            return count, ref
+        await self._refresh_streaks(lfm)
+        rows = await self.db.fetchall(SQL_USER_STREAKS, (lfm, kind))
+        if not rows:
+            await ctx.send(f'No {kind} streaks of {STREAK_MIN_RUN}+ plays cached for `{lfm}` yet.')
+            return
 
-        artist_streak, artist_name = calc_streak(tracks, lambda t: t['artist']['#text'])
-        album_streak,  album_name  = calc_streak(tracks, lambda t: t['album']['#text'])
-        track_streak,  track_name  = calc_streak(tracks, lambda t: t['name'])
+        lines = []
+        for i, (artist, name, length, started_at) in enumerate(rows):
+            label = f'**{name}**' if kind == 'artist' else f'**{name}** by {artist}'
+            lines.append(f'`{i+1}.` {label} — × {length:,} (<t:{started_at}:d>)')
+        embed = discord.Embed(
+            title=f'Longest {kind} streaks — {lfm}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
+        await ctx.send(embed=embed)
 
-        embed = discord.Embed(title=f'Listening streak — {lfm}', color=0xD51007)
-        embed.add_field(name='Artist', value=f'**{artist_name}** × {artist_streak}', inline=True)
-        if album_name:
-            embed.add_field(name='Album', value=f'**{album_name}** × {album_streak}', inline=True)
-        embed.add_field(name='Track', value=f'**{track_name}** × {track_streak}', inline=True)
+    @commands.hybrid_command(aliases=['sstr'])
+    @app_commands.describe(kind='Artist, album or track streaks')
+    async def serverstreaks(self, ctx, kind: StreakKind = 'artist'):
+        """All-time longest artist / album / track streaks in this server."""
+        registered = await self._guild_registered(ctx.guild)
+        if not registered:
+            await ctx.send('No registered Last.fm users in this server.')
+            return
+
+        members = {}
+        for member, lfm in registered:
+            members.setdefault(lfm, member)
+        rows = await self.db.fetchall(_server_streaks_sql(len(members)), list(members) + [kind])
+        if not rows:
+            await ctx.send(f'No {kind} streaks of {STREAK_MIN_RUN}+ plays cached in this server yet.')
+            return
+
+        lines = []
+        for i, (lfm, artist, name, length, started_at) in enumerate(rows):
+            label = f'**{name}**' if kind == 'artist' else f'**{name}** by {artist}'
+            lines.append(
+                f'`{i+1}.` {label} — × {length:,} · {members[lfm].display_name} (<t:{started_at}:d>)'
+            )
+        embed = discord.Embed(
+            title=f'Longest {kind} streaks — {ctx.guild.name}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
         await ctx.send(embed=embed)
 
     @commands.hybrid_command(aliases=['dd', 'firstlisten'])
     @app_commands.describe(artist='Artist name (leave blank for current track\'s artist)')
     async def discoverydate(self, ctx, *, artist: str = None):
         """When did you first listen to an artist? (uses local scrobble cache)"""
-        lfm = self._get_lfm(ctx.author)
+        lfm = await self._get_lfm(ctx.author)
         if not lfm:
             await ctx.send(self._no_lfm_msg())
             return
 
-        async with aiohttp.ClientSession() as session:
-            # Resolve artist name
-            if not artist:
-                t = await self._current_track(session, lfm)
-                if not t:
-                    await ctx.send('No recent track found. Provide an artist name.')
-                    return
-                artist = t['artist']['#text']
-            else:
-                artist = await self._resolve_artist(session, artist)
-
-            # Decide whether to sync
-            sync_state = self._get_sync_state(lfm)
-            now_ts = int(time.time())
-            need_sync = (
-                sync_state is None or
-                (now_ts - sync_state[2]) > 3600
+        # Resolve artist name
+        if not artist:
+            t = await self._current_track(lfm)
+            if not t:
+                await ctx.send('No recent track found. Provide an artist name.')
+                return
+            artist = t['artist']['#text']
+        else:
+            artist = await self._resolve_artist(artist)
+
+        async def render():
+            result = await self._query_first_scrobble(lfm, artist)
+            if not result:
+                return {'content': f'No scrobbles found for **{artist}** in cache for `{lfm}`.', 'embed': None}
+
+            r_artist, r_track, r_album, r_ts = result
+            artist_plays = await self._count_scrobbles_for_artist(lfm, artist)
+            sync_state = await self._get_sync_state(lfm)
+            total_cached = sync_state[1] if sync_state else await self._count_cached_scrobbles(lfm)
+            synced_at = sync_state[2] if sync_state else 0
+
+            dt = datetime.datetime.utcfromtimestamp(r_ts)
+            date_fmt = dt.strftime('%-d %B %Y, %H:%M UTC')
+            disc_ts = f'<t:{r_ts}:D>'
+
+            embed = discord.Embed(
+                title=f'Discovery date — {r_artist}',
+                color=0xD51007
             )
+            embed.set_author(name=lfm)
+            embed.add_field(name='First listened', value=f'{disc_ts}\n{date_fmt}', inline=False)
+            first_track_val = f'**{r_track}**'
+            if r_album:
+                first_track_val += f' on *{r_album}*'
+            embed.add_field(name='First track', value=first_track_val, inline=False)
+            embed.add_field(name='Total plays in cache', value=f'{artist_plays:,}', inline=True)
+            embed.set_footer(text=f'{_cache_age(synced_at)} · {total_cached:,} scrobbles cached')
+            return {'content': None, 'embed': embed}
+
+        await self._send_cached(ctx, lfm, render)
+
+    @commands.hybrid_command(aliases=['ss'])
+    @app_commands.describe(member='User to look up (default: you)')
+    async def syncstatus(self, ctx, member: Optional[discord.Member] = None):
+        """Scrobble cache status, including a running import's progress."""
+        user = member or ctx.author
+        lfm = await self._get_lfm(user)
+        if not lfm:
+            await ctx.send(self._no_lfm_msg())
+            return
 
-            if need_sync:
-                sync_type = 'full' if sync_state is None else 'delta'
-                status_msg = await ctx.send(
-                    f'Syncing scrobble history for **{lfm}** ({sync_type})… this may take a while.'
-                )
-                last_edit = [0.0]
-
-                async def progress_callback(pages_done, total_pages, fetched):
-                    if time.time() - last_edit[0] >= 3.0:
-                        last_edit[0] = time.time()
-                        pct = int(pages_done / total_pages * 100)
-                        try:
-                            await status_msg.edit(
-                                content=f'Syncing **{lfm}**… {pct}% ({pages_done}/{total_pages} pages, {fetched:,} tracks)'
-                            )
-                        except Exception:
-                            pass
-
-                fetched, total_cached = await self._sync_scrobbles(session, lfm, progress_callback)
-                try:
-                    await status_msg.edit(
-                        content=f'Sync complete — {fetched:,} new scrobbles fetched ({total_cached:,} total cached).'
-                    )
-                except Exception:
-                    pass
+        progress = await self._get_sync_progress(lfm)
+        sync_state = await self._get_sync_state(lfm)
+        schedule = await self.db.fetchone(
+            'SELECT next_run_at FROM sync_schedule WHERE lfm_username = ?', (lfm,)
+        )
+        holes = (await self.db.fetchone(
+            'SELECT COUNT(*) FROM sync_holes WHERE lfm_username = ?', (lfm,)
+        ))[0]
+
+        embed = discord.Embed(title=f'Scrobble cache — {lfm}', color=0xD51007)
+        if progress:
+            _, _, total_parts, next_part, fetched, started_at, updated_at, mode = progress
+            if mode == 'windows' and not total_parts:
+                done_str = 'planning time windows'
+            else:
+                parts_done = min(next_part - 1, total_parts)
+                pct = int(parts_done / total_parts * 100) if total_parts else 100
+                done_str = f'{pct}% ({parts_done:,}/{total_parts:,} {"windows" if mode == "windows" else "pages"}'
+                done_str += f', {fetched:,} scrobbles)'
+            embed.add_field(
+                name='Import in progress',
+                value=f'{done_str}\n'
+                      f'Started <t:{started_at}:R> · last checkpoint <t:{updated_at}:R>',
+                inline=False
+            )
+        if sync_state:
+            _, total_cached, synced_at = sync_state
+            embed.add_field(name='Cached scrobbles', value=f'{total_cached:,}', inline=True)
+            embed.add_field(name='Last synced', value=f'<t:{synced_at}:R>', inline=True)
+        elif not progress:
+            embed.description = 'Not synced yet.'
+        if schedule:
+            embed.add_field(name='Next background sync', value=f'<t:{schedule[0]}:R>', inline=True)
+        if holes:
+            embed.add_field(name='Pages awaiting repair', value=f'{holes:,}', inline=True)
+        await ctx.send(embed=embed)
 
-        # Query cache
-        result = self._query_first_scrobble(lfm, artist.lower())
-        if not result:
-            await ctx.send(f'No scrobbles found for **{artist}** in cache for `{lfm}`.')
+    @commands.hybrid_command(aliases=['sv'])
+    async def syncverify(self, ctx):
+        """Check your scrobble cache against Last.fm and refetch any gaps."""
+        lfm = await self._get_lfm(ctx.author)
+        if not lfm:
+            await ctx.send(self._no_lfm_msg())
+            return
+        if await self._get_sync_state(lfm) is None:
+            await ctx.send(f'No completed sync for `{lfm}` yet — see `.syncstatus`.')
             return
 
-        r_artist, r_track, r_album, r_ts = result
-        artist_plays = self._count_scrobbles_for_artist(lfm, artist.lower())
-        sync_state = self._get_sync_state(lfm)
-        total_cached = sync_state[1] if sync_state else self._count_cached_scrobbles(lfm)
-        synced_at = sync_state[2] if sync_state else 0
-
-        dt = datetime.datetime.utcfromtimestamp(r_ts)
-        date_fmt = dt.strftime('%-d %B %Y, %H:%M UTC')
-        disc_ts = f'<t:{r_ts}:D>'
+        async with ctx.typing():
+            repaired, repaired_rows = await self._repair_holes(lfm)
+            refetched = await self._verify_sync(lfm)
 
+        if not repaired and not refetched:
+            await ctx.send(f'Cache for **{lfm}** matches Last.fm — nothing to repair.')
+            return
+        lines = [f'`{label}` — cached {cached:,} / Last.fm {remote:,} → +{new_rows:,}'
+                 for label, cached, remote, new_rows in refetched[:15]]
+        if repaired:
+            lines.insert(0, f'Repaired {repaired:,} failed page{"s" if repaired != 1 else ""} (+{repaired_rows:,} scrobbles)')
         embed = discord.Embed(
-            title=f'Discovery date — {r_artist}',
+            title=f'Cache repair — {lfm}',
+            description='\n'.join(lines),
             color=0xD51007
         )
-        embed.set_author(name=lfm)
-        embed.add_field(name='First listened', value=f'{disc_ts}\n{date_fmt}', inline=False)
-        first_track_val = f'**{r_track}**'
-        if r_album:
-            first_track_val += f' on *{r_album}*'
-        embed.add_field(name='First track', value=first_track_val, inline=False)
-        embed.add_field(name='Total plays in cache', value=f'{artist_plays:,}', inline=True)
-        synced_str = datetime.datetime.utcfromtimestamp(synced_at).strftime('%-d %b %Y %H:%M UTC') if synced_at else 'never'
-        embed.set_footer(text=f'Cache last updated {synced_str} · {total_cached:,} scrobbles cached')
         await ctx.send(embed=embed)
 
     @commands.hybrid_command()
@@ -1326,73 +4640,30 @@ class FM(commands.Cog):
         if year is None:
             year = datetime.datetime.now(datetime.timezone.utc).year - 1
 
-        tz = datetime.timezone.utc
-        start_ts = int(datetime.datetime(year, 1, 1, tzinfo=tz).timestamp())
-        end_ts   = int(datetime.datetime(year + 1, 1, 1, tzinfo=tz).timestamp()) - 1
-
         registered = await self._guild_registered(ctx.guild)
         if not registered:
             await ctx.send('No registered Last.fm users in this server.')
             return
 
-        lfm_names = [lfm for _, lfm in registered]
-        ph = ','.join('?' * len(lfm_names))
-
-        async with ctx.typing():
-            con = sqlite3.connect(DB_PATH)
-
-            total = con.execute(
-                f'SELECT COUNT(*) FROM scrobbles WHERE lfm_username IN ({ph}) '
-                f'AND scrobbled_at BETWEEN ? AND ?',
-                lfm_names + [start_ts, end_ts]
-            ).fetchone()[0]
-
-            if total == 0:
-                con.close()
-                await ctx.send(f'No scrobbles cached for {year}. Try `.sync` first.')
-                return
-
-            top_artists = con.execute(
-                f'SELECT artist, COUNT(*) as plays FROM scrobbles '
-                f'WHERE lfm_username IN ({ph}) AND scrobbled_at BETWEEN ? AND ? '
-                f'GROUP BY LOWER(artist) ORDER BY plays DESC LIMIT 5',
-                lfm_names + [start_ts, end_ts]
-            ).fetchall()
-
-            top_albums = con.execute(
-                f'SELECT album, artist, COUNT(*) as plays FROM scrobbles '
-                f'WHERE lfm_username IN ({ph}) AND scrobbled_at BETWEEN ? AND ? '
-                f'AND album != "" '
-                f'GROUP BY LOWER(album), LOWER(artist) ORDER BY plays DESC LIMIT 5',
-                lfm_names + [start_ts, end_ts]
-            ).fetchall()
-
-            top_tracks = con.execute(
-                f'SELECT track, artist, COUNT(*) as plays FROM scrobbles '
-                f'WHERE lfm_username IN ({ph}) AND scrobbled_at BETWEEN ? AND ? '
-                f'GROUP BY LOWER(track), LOWER(artist) ORDER BY plays DESC LIMIT 5',
-                lfm_names + [start_ts, end_ts]
-            ).fetchall()
-
-            top_listener = con.execute(
-                f'SELECT lfm_username, COUNT(*) as plays FROM scrobbles '
-                f'WHERE lfm_username IN ({ph}) AND scrobbled_at BETWEEN ? AND ? '
-                f'GROUP BY lfm_username ORDER BY plays DESC LIMIT 1',
-                lfm_names + [start_ts, end_ts]
-            ).fetchone()
-
-            user_top = []
-            for member, lfm in registered:
-                row = con.execute(
-                    'SELECT artist, COUNT(*) as plays FROM scrobbles '
-                    'WHERE lfm_username = ? AND scrobbled_at BETWEEN ? AND ? '
-                    'GROUP BY LOWER(artist) ORDER BY plays DESC LIMIT 1',
-                    (lfm, start_ts, end_ts)
-                ).fetchone()
-                if row:
-                    user_top.append((member.display_name, row[0], row[1]))
-
-            con.close()
+        lfm_names = frozenset(lfm for _, lfm in registered)
+        cached = self._year_reports.get((ctx.guild.id, year))
+        if cached and cached[0] == lfm_names:
+            report = cached[1]
+        else:
+            async with ctx.typing():
+                report = await self.db.read(_year_report, sorted(lfm_names), year)
+            if report is not None:
+                self._year_reports[ctx.guild.id, year] = (lfm_names, report)
+
+        if report is None:
+            await ctx.send(
+                f'No scrobbles cached for {year} yet — listening history syncs in the background, '
+                f'try again in a bit.'
+            )
+            return
+        total, top_artists, top_albums, top_tracks, top_listener, per_user = report
+        user_top = [(member.display_name,) + per_user[lfm]
+                    for member, lfm in registered if lfm in per_user]
 
         embed = discord.Embed(
             title=f'\U0001f3b5 {ctx.guild.name} \u2014 {year} in Review',
@@ -1437,9 +4708,9 @@ class FM(commands.Cog):
             await ctx.send('No registered Last.fm users in this server.')
             return
 
-        async def fetch_top(session, lfm):
+        async def fetch_top(lfm):
             try:
-                data = await self._api(session, {
+                data = await self._api({
                     'method': method,
                     'user': lfm,
                     'period': 'overall',
@@ -1450,8 +4721,7 @@ class FM(commands.Cog):
                 return []
 
         async with ctx.typing():
-            async with aiohttp.ClientSession() as session:
-                all_lists = await asyncio.gather(*[fetch_top(session, lfm) for _, lfm in registered])
+            all_lists = await asyncio.gather(*[fetch_top(lfm) for _, lfm in registered])
 
         aggregate = {}
         for items in all_lists:
@@ -1497,80 +4767,290 @@ class FM(commands.Cog):
     # ------------------------------------------------------------------ #
     #  Commands: crowns                                                    #
     # ------------------------------------------------------------------ #
+    def _member_name(self, guild, discord_id):
+        member = guild.get_member(int(discord_id))
+        return member.display_name if member else f'<@{discord_id}>'
+
     @commands.hybrid_command()
     @app_commands.describe(artist='Artist name')
     async def crown(self, ctx, *, artist: str):
         """Show who holds the crown for an artist in this server."""
-        existing = self._get_crown(str(ctx.guild.id), artist.strip().lower())
+        existing = await self._get_crown(str(ctx.guild.id), artist.strip().lower())
         if existing is None:
             await ctx.send(f'No crown holder for **{artist}** in this server yet.')
             return
-        artist_display, discord_id, play_count = existing
-        member = ctx.guild.get_member(int(discord_id))
-        name = member.display_name if member else f'<@{discord_id}>'
-        await ctx.send(f'👑 **{name}** holds the crown for **{artist_display}** with {play_count:,} plays.')
+        artist_display, discord_id, play_count, held_since = existing
+        name = self._member_name(ctx.guild, discord_id)
+        await ctx.send(
+            f'👑 **{name}** holds the crown for **{artist_display}** with {play_count:,} plays '
+            f'(since <t:{held_since}:D>).'
+        )
 
     @commands.hybrid_command()
     @app_commands.describe(member='User to look up (default: you)')
     async def crowns(self, ctx, member: Optional[discord.Member] = None):
         """List a user's crowns in this server."""
         user = member or ctx.author
-        all_crowns = self._guild_crowns(str(ctx.guild.id))
-        user_crowns = [(ad, pc) for ad, did, pc in all_crowns if did == str(user.id)]
-        if not user_crowns:
+        guild_id, discord_id = str(ctx.guild.id), str(user.id)
+        row = await self.db.fetchone(SQL_MEMBER_CROWN_COUNT, (guild_id, discord_id))
+        total = row[0] if row else 0
+
+        async def fetch(cursor, page):
+            rows = await self.db.fetchall(
+                _crowns_page_sql(True, bool(cursor)),
+                (guild_id, discord_id) + (cursor or ()) + (PAGE_SIZE + 1,)
+            )
+            if not rows:
+                return None, None
+            first = (page - 1) * PAGE_SIZE + 1
+            lines = [f'`{i}.` **{ad}** — {pc:,} plays' for i, (ad, pc, _) in enumerate(rows[:PAGE_SIZE], first)]
+            embed = discord.Embed(
+                title=f'👑 {user.display_name}\'s crowns ({total} total)',
+                description='\n'.join(lines),
+                color=0xD51007
+            )
+            embed.set_footer(text=f'Page {page} of {max(1, -(-total // PAGE_SIZE))}')
+            return embed, rows[PAGE_SIZE - 1][1:] if len(rows) > PAGE_SIZE else None
+
+        if not await FMPager(ctx.author.id, fetch).start(ctx):
             await ctx.send(f'**{user.display_name}** holds no crowns in this server.')
+
+    @commands.hybrid_command()
+    async def servercrowns(self, ctx):
+        """All crown holders in this server, sorted by play count."""
+        guild_id = str(ctx.guild.id)
+        row = await self.db.fetchone(SQL_SERVER_CROWN_TOTAL, (guild_id,))
+        total = row[0] or 0
+
+        async def fetch(cursor, page):
+            rows = await self.db.fetchall(
+                _crowns_page_sql(False, bool(cursor)), (guild_id,) + (cursor or ()) + (PAGE_SIZE + 1,)
+            )
+            if not rows:
+                return None, None
+            lines = []
+            for i, (artist_display, discord_id, play_count, _) in enumerate(rows[:PAGE_SIZE], (page - 1) * PAGE_SIZE + 1):
+                name = self._member_name(ctx.guild, discord_id)
+                lines.append(f'`{i}.` **{artist_display}** — {name} ({play_count:,} plays)')
+            embed = discord.Embed(
+                title=f'Server crowns — {ctx.guild.name} ({total:,} total)',
+                description='\n'.join(lines),
+                color=0xD51007
+            )
+            embed.set_footer(text=f'Page {page} of {max(1, -(-total // PAGE_SIZE))}')
+            return embed, rows[PAGE_SIZE - 1][2:] if len(rows) > PAGE_SIZE else None
+
+        if not await FMPager(ctx.author.id, fetch).start(ctx):
+            await ctx.send('No crowns have been awarded in this server yet.')
+
+    @commands.hybrid_command()
+    async def topcrowns(self, ctx):
+        """Server members ranked by number of crowns held."""
+        ranked = await self.db.fetchall(SQL_CROWN_COUNTS, (str(ctx.guild.id),))
+        if not ranked:
+            await ctx.send('No crowns have been awarded in this server yet.')
             return
-        total = len(user_crowns)
-        lines = [f'`{i+1}.` **{ad}** — {pc:,} plays' for i, (ad, pc) in enumerate(user_crowns[:20])]
+        lines = []
+        for i, (discord_id, count) in enumerate(ranked):
+            name = self._member_name(ctx.guild, discord_id)
+            lines.append(f'`{i+1}.` **{name}** — {count} crown{"s" if count != 1 else ""}')
         embed = discord.Embed(
-            title=f'👑 {user.display_name}\'s crowns ({total} total)',
+            title=f'Top crown holders — {ctx.guild.name}',
             description='\n'.join(lines),
             color=0xD51007
         )
         await ctx.send(embed=embed)
 
-    @commands.hybrid_command()
-    async def servercrowns(self, ctx):
-        """All crown holders in this server, sorted by play count."""
-        all_crowns = self._guild_crowns(str(ctx.guild.id))
-        if not all_crowns:
+    @commands.hybrid_command(aliases=['lcr'])
+    async def longestcrowns(self, ctx):
+        """Longest reigns in this server, past and ongoing."""
+        guild_id = str(ctx.guild.id)
+        now = int(time.time())
+        current = await self.db.fetchall(SQL_CURRENT_REIGNS, (guild_id,))
+        past = await self.db.fetchall(SQL_PAST_REIGNS, (guild_id,))
+        reigns = heapq.nlargest(
+            10,
+            [(now - since, artist, did, None) for artist, did, since in current]
+            + [(held_for, artist, did, at) for artist, did, held_for, at in past]
+        )
+        if not reigns:
             await ctx.send('No crowns have been awarded in this server yet.')
             return
         lines = []
-        for i, (artist_display, discord_id, play_count) in enumerate(all_crowns[:15]):
-            member = ctx.guild.get_member(int(discord_id))
-            name = member.display_name if member else f'<@{discord_id}>'
-            lines.append(f'`{i+1}.` **{artist_display}** — {name} ({play_count:,} plays)')
+        for i, (held_for, artist, discord_id, ended_at) in enumerate(reigns):
+            until = f'lost <t:{ended_at}:d>' if ended_at else 'still held'
+            lines.append(
+                f'`{i+1}.` **{artist}** — {self._member_name(ctx.guild, discord_id)}, '
+                f'{_duration(held_for)} ({until})'
+            )
         embed = discord.Embed(
-            title=f'Server crowns — {ctx.guild.name}',
+            title=f'Longest-held crowns — {ctx.guild.name}',
             description='\n'.join(lines),
             color=0xD51007
         )
         await ctx.send(embed=embed)
 
-    @commands.hybrid_command()
-    async def topcrowns(self, ctx):
-        """Server members ranked by number of crowns held."""
-        all_crowns = self._guild_crowns(str(ctx.guild.id))
-        if not all_crowns:
-            await ctx.send('No crowns have been awarded in this server yet.')
+    @commands.hybrid_command(aliases=['mst'])
+    async def moststolen(self, ctx):
+        """Artists whose crown has changed hands most often in this server."""
+        rows = await self.db.fetchall(SQL_MOST_STOLEN, (str(ctx.guild.id),))
+        if not rows:
+            await ctx.send('No crowns have been stolen in this server yet.')
+            return
+        lines = [
+            f'`{i+1}.` **{artist}** — stolen {steals:,} time{"s" if steals != 1 else ""}, '
+            f'now held by {self._member_name(ctx.guild, discord_id)}'
+            for i, (artist, discord_id, steals) in enumerate(rows)
+        ]
+        embed = discord.Embed(
+            title=f'Most stolen crowns — {ctx.guild.name}',
+            description='\n'.join(lines),
+            color=0xD51007
+        )
+        await ctx.send(embed=embed)
+
+    @commands.hybrid_command(aliases=['ch'])
+    @app_commands.describe(artist='Artist name')
+    async def crownhistory(self, ctx, *, artist: str):
+        """Every award and steal of an artist's crown in this server."""
+        events = await self.db.fetchall(SQL_CROWN_HISTORY, (str(ctx.guild.id), _fold(artist)))
+        if not events:
+            await ctx.send(f'No crown history for **{artist}** in this server yet.')
             return
-        counts = {}
-        for _, discord_id, _ in all_crowns:
-            counts[discord_id] = counts.get(discord_id, 0) + 1
-        ranked = sorted(counts.items(), key=lambda x: x[1], reverse=True)
         lines = []
-        for i, (discord_id, count) in enumerate(ranked[:15]):
-            member = ctx.guild.get_member(int(discord_id))
-            name = member.display_name if member else f'<@{discord_id}>'
-            lines.append(f'`{i+1}.` **{name}** — {count} crown{"s" if count != 1 else ""}')
+        for artist_display, kind, discord_id, prev_id, play_count, at in events:
+            name = self._member_name(ctx.guild, discord_id)
+            if kind == 'steal':
+                lines.append(f'<t:{at}:d> **{name}** stole it from {self._member_name(ctx.guild, prev_id)} '
+                             f'with {play_count:,} plays')
+            else:
+                lines.append(f'<t:{at}:d> **{name}** was crowned with {play_count:,} plays')
         embed = discord.Embed(
-            title=f'Top crown holders — {ctx.guild.name}',
+            title=f'Crown history — {events[0][0]}',
             description='\n'.join(lines),
             color=0xD51007
         )
         await ctx.send(embed=embed)
 
+    @commands.hybrid_command()
+    @commands.has_permissions(manage_guild=True)
+    async def refreshcrowns(self, ctx):
+        """Recompute every crown in this server from the local scrobble cache."""
+        async with ctx.typing():
+            started = time.perf_counter()
+            diff = await self._recompute_guild_crowns(ctx.guild)
+            took = time.perf_counter() - started
+
+        def name(discord_id):
+            member = ctx.guild.get_member(int(discord_id))
+            return member.display_name if member else f'<@{discord_id}>'
+
+        lines = [
+            f'👑 **{artist}** — {name(to_id)} ({to_plays:,}) from {name(from_id)} ({from_plays:,})'
+            for artist, from_id, to_id, from_plays, to_plays in diff.stolen[:15]
+        ]
+        if len(diff.stolen) > 15:
+            lines.append(f'…and {len(diff.stolen) - 15:,} more')
+        embed = discord.Embed(
+            title=f'Crowns recomputed — {ctx.guild.name}',
+            description=f'**{len(diff.awarded):,}** awarded · **{len(diff.stolen):,}** stolen · '
+                        f'**{diff.updated:,}** play counts updated' + ''.join(f'\n{line}' for line in lines),
+            color=0xD51007
+        )
+        embed.set_footer(text=f'Took {took:.2f}s')
+        await ctx.send(embed=embed)
+
+    # ------------------------------------------------------------------ #
+    #  Commands: diagnostics                                               #
+    # ------------------------------------------------------------------ #
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def fmstats(self, ctx):
+        """Last.fm cache / rate limiter counters (owner only)."""
+        hits, misses = sum(self.cache.hits.values()), sum(self.cache.misses.values())
+        ratio = f'{hits / (hits + misses):.0%}' if hits + misses else 'n/a'
+        methods = sorted(set(self.cache.hits) | set(self.cache.misses))
+        lines = [f'`{m}` — {self.cache.hits[m]:,} hit / {self.cache.misses[m]:,} miss' for m in methods]
+        embed = discord.Embed(title='fm diagnostics', color=0xD51007)
+        embed.add_field(
+            name='Response cache',
+            value=f'{len(self.cache):,} entries · {self.cache.bytes / 1048576:.1f} MB · {ratio} hit rate\n'
+                  + ('\n'.join(lines) or 'no lookups yet'),
+            inline=False
+        )
+        embed.add_field(
+            name='Rate limiter',
+            value=f'{self.limiter.rate:.2f} req/s · {self.limiter.granted:,} granted · '
+                  f'{self.limiter.throttles:,} throttled · {self.limiter.pending()} queued',
+            inline=False
+        )
+        embed.add_field(
+            name='Artist resolver',
+            value=f'{len(self.artists):,} names · {len(self.artists.aliases):,} aliases · '
+                  + (' · '.join(f'{how} {n:,}' for how, n in self.artists.hits.items()) or 'no lookups yet'),
+            inline=False
+        )
+        embed.add_field(
+            name='Coalesced work',
+            value=' · '.join(f'{kind}: {self.flights.joined[kind]:,} shared / {n:,} run'
+                             for kind, n in self.flights.started.items()) or 'nothing yet',
+            inline=False
+        )
+        due = await self.db.fetchone(
+            'SELECT COUNT(*) FROM sync_schedule WHERE next_run_at <= ?',
+            (int(time.time()),)
+        )
+        embed.add_field(
+            name='Background sync',
+            value=f'{due[0]:,} users due · budget {self._sync_budget:,.0f}/{SYNC_BUDGET_BURST:,} requests · '
+                  f'{self.revalidations["run"]:,} stale answers refreshed, {self.revalidations["edited"]:,} edited, '
+                  f'{self.revalidations["failed"]:,} failed',
+            inline=False
+        )
+        embed.add_field(
+            name='Query plans',
+            value='\n'.join(f'`{name}` — {detail}' for name, detail in self.plan_offenders)
+                  or f'all {len(FM_QUERY_PLANS)} FM queries use an index',
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
+    # ------------------------------------------------------------------ #
+    #  Autocomplete                                                        #
+    # ------------------------------------------------------------------ #
+    @artist.autocomplete('query')
+    @whoknows.autocomplete('artist')
+    @discoverydate.autocomplete('artist')
+    async def _artist_autocomplete(self, interaction, current: str):
+        return await self._autocomplete(interaction, current, 'artist')
+
+    @album.autocomplete('query')
+    @whoknowsalbum.autocomplete('query')
+    async def _album_autocomplete(self, interaction, current: str):
+        return await self._autocomplete(interaction, current, 'album')
+
+    @track.autocomplete('query')
+    @whoknowstrack.autocomplete('query')
+    async def _track_autocomplete(self, interaction, current: str):
+        return await self._autocomplete(interaction, current, 'track')
+
+    @plays.autocomplete('period')
+    @toptracks.autocomplete('period')
+    @topalbums.autocomplete('period')
+    @topartists.autocomplete('period')
+    @overview.autocomplete('period')
+    async def _period_autocomplete(self, interaction, current: str):
+        """The fixed periods, plus whatever range has been typed once it parses."""
+        choices = [app_commands.Choice(name=p, value=p) for p in PERIODS if p.startswith(current.casefold())]
+        if current and current.casefold() not in PERIODS:
+            try:
+                rng = _parse_period(current)
+            except ValueError:
+                return choices
+            choices.insert(0, app_commands.Choice(name=f'{rng.label} ({rng.first} – {rng.last})'[:100],
+                                                  value=current[:100]))
+        return choices
+
 
 async def setup(bot):
     await bot.add_cog(FM(bot))
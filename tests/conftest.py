@@ -0,0 +1,15 @@
+import sqlite3
+
+import pytest
+
+from cogs import fm
+
+
+@pytest.fixture
+def con(tmp_path, monkeypatch):
+    monkeypatch.setattr(fm, 'USERS_FILE', str(tmp_path / 'fm_users.json'))
+    con = sqlite3.connect(':memory:')
+    con.create_function('fold', 1, fm._fold, deterministic=True)
+    fm._init_db(con)
+    yield con
+    con.close()
@@ -0,0 +1,94 @@
+from cogs import fm
+
+GUILD = '5'
+MEMBERS = [('1', 'alice'), ('2', 'bob'), ('3', 'carol')]
+
+
+def listen(con, lfm, artist, plays, synced=True):
+    """Set lfm's all-time plays of `artist` in the rollups."""
+    memo = {}
+    user_id = fm._intern(con, memo, 'lfm_users', lfm)
+    fm._intern(con, memo, 'artists', artist)
+    con.execute(
+        'INSERT INTO user_artist_plays (user_id, artist_id, plays) VALUES (?, ?, ?) '
+        'ON CONFLICT (user_id, artist_id) DO UPDATE SET plays = excluded.plays',
+        (user_id, fm._key_id(con, memo, 'artist', fm._fold(artist)), plays)
+    )
+    if synced:
+        con.execute('INSERT OR IGNORE INTO scrobble_sync (lfm_username, last_synced_ts) VALUES (?, 1)', (lfm,))
+
+
+def crowns(con):
+    return con.execute(
+        'SELECT artist_name, artist_display, discord_id, play_count, steals FROM crowns WHERE guild_id = ? '
+        'ORDER BY artist_name', (GUILD,)
+    ).fetchall()
+
+
+def counts(con):
+    return dict(con.execute('SELECT discord_id, crowns FROM crown_counts WHERE guild_id = ? AND crowns', (GUILD,)))
+
+
+def events(con):
+    return con.execute(
+        'SELECT artist_name, kind, discord_id, prev_discord_id, play_count FROM crown_events ORDER BY id'
+    ).fetchall()
+
+
+def test_recompute_crowns_awards_and_steals(con):
+    con.executemany('INSERT INTO users (discord_id, lastfm_username) VALUES (?, ?)', MEMBERS)
+    listen(con, 'alice', 'Björk', 40)
+    listen(con, 'bob', 'BJÖRK', 35)
+    listen(con, 'carol', 'Low', 10)  # under CROWN_MIN_PLAYS
+
+    diff = fm._recompute_crowns(con, GUILD, MEMBERS)
+    assert diff == fm.CrownDiff([('Björk', '1', 40)], [], 0)
+    assert crowns(con) == [('björk', 'Björk', '1', 40, 0)]
+
+    # Nothing changed: nothing written
+    assert fm._recompute_crowns(con, GUILD, MEMBERS) == fm.CrownDiff([], [], 0)
+
+    listen(con, 'alice', 'Björk', 45)
+    assert fm._recompute_crowns(con, GUILD, MEMBERS) == fm.CrownDiff([], [], 1)
+
+    listen(con, 'bob', 'BJÖRK', 46)
+    diff = fm._recompute_crowns(con, GUILD, MEMBERS)
+    assert diff.stolen == [('Björk', '1', '2', 45, 46)]
+    assert crowns(con) == [('björk', 'Björk', '2', 46, 1)]
+    assert counts(con) == {'2': 1}
+    assert events(con) == [('björk', 'award', '1', None, 40), ('björk', 'steal', '2', '1', 46)]
+
+
+def test_recompute_crowns_keeps_the_recorded_count_of_an_unsynced_holder(con):
+    con.executemany('INSERT INTO users (discord_id, lastfm_username) VALUES (?, ?)', MEMBERS)
+    fm._record_crowns(con, GUILD, [('low', 'Low', '1', 100)])
+    listen(con, 'alice', 'Low', 20, synced=False)
+    listen(con, 'bob', 'Low', 60)
+    assert fm._recompute_crowns(con, GUILD, MEMBERS) == fm.CrownDiff([], [], 0)
+    assert crowns(con) == [('low', 'Low', '1', 100, 0)]
+
+    listen(con, 'bob', 'Low', 101)
+    assert fm._recompute_crowns(con, GUILD, MEMBERS).stolen == [('Low', '1', '2', 100, 101)]
+
+
+def test_refold_crowns_merges_keys_that_fold_together(con):
+    con.executemany(
+        'INSERT INTO crowns (guild_id, artist_name, artist_display, discord_id, play_count) VALUES (?, ?, ?, ?, ?)',
+        [(GUILD, 'Björk', 'Björk', '1', 40), (GUILD, 'BJÖRK', 'BJÖRK', '2', 55),
+         (GUILD, 'björk', 'björk', '3', 50), (GUILD, 'Low', 'Low', '1', 30), ('6', 'Low', 'Low', '3', 35)]
+    )
+    con.execute(
+        "INSERT INTO crown_events (guild_id, artist_name, artist_display, kind, discord_id, play_count, at) "
+        "VALUES (?, 'Björk', 'Björk', 'award', '1', 40, 0)", (GUILD,)
+    )
+    con.execute('DELETE FROM crown_counts')
+    con.execute(
+        'INSERT INTO crown_counts (guild_id, discord_id, crowns) '
+        'SELECT guild_id, discord_id, COUNT(*) FROM crowns GROUP BY guild_id, discord_id'
+    )
+
+    fm._refold_crowns(con)
+    assert crowns(con) == [('björk', 'BJÖRK', '2', 55, 0), ('low', 'Low', '1', 30, 0)]
+    assert con.execute("SELECT artist_name, discord_id FROM crowns WHERE guild_id = '6'").fetchall() == [('low', '3')]
+    assert counts(con) == {'1': 1, '2': 1}
+    assert [e[0] for e in events(con)] == ['björk']
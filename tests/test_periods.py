@@ -0,0 +1,67 @@
+import datetime
+import random
+
+import pytest
+
+from cogs import fm
+
+TODAY = datetime.date(2024, 5, 15)
+D = datetime.date
+
+
+@pytest.mark.parametrize('text, first, last, label', [
+    ('2019', D(2019, 1, 1), D(2019, 12, 31), '2019'),
+    ('2019-03', D(2019, 3, 1), D(2019, 3, 31), 'March 2019'),
+    ('2019-03-07', D(2019, 3, 7), D(2019, 3, 7), '7 March 2019'),
+    ('2019-03-01..2019-06-30', D(2019, 3, 1), D(2019, 6, 30), '2019-03-01 – 2019-06-30'),
+    ('2019-03..', D(2019, 3, 1), TODAY, '2019-03-01 – 2024-05-15'),
+    ('march 2019', D(2019, 3, 1), D(2019, 3, 31), 'March 2019'),
+    ('march', D(2024, 3, 1), D(2024, 3, 31), 'March 2024'),
+    ('december', D(2023, 12, 1), D(2023, 12, 31), 'December 2023'),
+    ('winter 2019', D(2019, 12, 1), D(2020, 2, 29), 'winter 2019'),
+    ('last summer', D(2023, 6, 1), D(2023, 8, 31), 'summer 2023'),
+    ('this month', D(2024, 5, 1), TODAY, 'May 2024'),
+    ('last month', D(2024, 4, 1), D(2024, 4, 30), 'April 2024'),
+    ('last 30 days', D(2024, 4, 16), TODAY, 'the last 30 days'),
+    ('yesterday', D(2024, 5, 14), D(2024, 5, 14), '14 May 2024'),
+])
+def test_parse_period_ranges(text, first, last, label):
+    assert fm._parse_period(text, TODAY) == fm.DateRange(first, last, label)
+
+
+def test_parse_period_keeps_fixed_periods():
+    assert fm._parse_period(' 3Month ', TODAY) == '3month'
+
+
+@pytest.mark.parametrize('text', ['nonsense', '2030', 'last 0 days', 'this summer 2019'])
+def test_parse_period_rejects(text):
+    with pytest.raises(ValueError):
+        fm._parse_period(text, TODAY)
+
+
+def test_range_slices_use_the_coarsest_buckets():
+    assert fm._range_slices(D(2019, 3, 15), D(2021, 2, 10)) == [
+        ('day', 20190315, 20190331),
+        ('month', 201904, 201912),
+        ('year', 2020, 2020),
+        ('month', 202101, 202101),
+        ('day', 20210201, 20210210),
+    ]
+
+
+def _covering(slices, day):
+    """How many of `slices` hold the rollup bucket `day` falls in."""
+    buckets = {'year': day.year, 'month': int(day.strftime('%Y%m')), 'day': int(day.strftime('%Y%m%d'))}
+    return sum(lo <= buckets[grain] <= hi for grain, lo, hi in slices)
+
+
+def test_range_slices_cover_each_day_exactly_once():
+    rng = random.Random(12)
+    window = [D(2018, 11, 1) + datetime.timedelta(days=i) for i in range(3 * 366)]
+    edges = [D(2019, 1, 1), D(2019, 1, 2), D(2019, 3, 15), D(2019, 12, 30), D(2019, 12, 31),
+             D(2020, 2, 1), D(2020, 2, 2), D(2020, 2, 28), D(2020, 2, 29), D(2020, 12, 31), D(2021, 1, 1)]
+    pairs = [(a, b) for a in edges for b in edges if a <= b]
+    pairs += [sorted(rng.sample(window[30:-30], 2)) for _ in range(200)]
+    for first, last in pairs:
+        slices = fm._range_slices(first, last)
+        assert [_covering(slices, day) for day in window] == [int(first <= day <= last) for day in window]
@@ -0,0 +1,10 @@
+from cogs import fm
+
+
+def test_every_fm_query_is_index_driven(con):
+    assert fm._check_query_plans(con) == []
+
+
+def test_plan_check_catches_a_full_scan(con, monkeypatch):
+    monkeypatch.setitem(fm.FM_QUERY_PLANS, 'unindexed', ('SELECT * FROM crowns WHERE play_count = ?', (1,)))
+    assert [name for name, _ in fm._check_query_plans(con)] == ['unindexed']
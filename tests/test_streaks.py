@@ -0,0 +1,57 @@
+from cogs import fm
+
+
+def scrobble(con, lfm, plays):
+    """Cache (artist, track, album, ts) plays for lfm and queue its streaks,
+    as _insert_scrobbles does."""
+    memo = {}
+    con.executemany(
+        'INSERT INTO scrobbles (user_id, scrobbled_at, track_id, artist_id, album_id) VALUES (?, ?, ?, ?, ?)',
+        [(ids[0], ts) + ids[1:] for *names, ts in plays for ids in [fm._scrobble_ids(con, memo, lfm, *names)]]
+    )
+    con.execute(
+        'INSERT INTO streak_dirty (lfm_username, from_ts) VALUES (?, ?) '
+        'ON CONFLICT (lfm_username) DO UPDATE SET from_ts = MIN(from_ts, excluded.from_ts)',
+        (lfm, min(ts for *_, ts in plays))
+    )
+
+
+def streaks(con, lfm):
+    return (
+        con.execute('SELECT * FROM streak_state WHERE lfm_username = ? ORDER BY kind', (lfm,)).fetchall(),
+        con.execute('SELECT * FROM streak_runs WHERE lfm_username = ? ORDER BY kind, started_at', (lfm,)).fetchall(),
+    )
+
+
+def test_update_streaks_extends_the_current_run(con):
+    scrobble(con, 'alice', [('Low', f'Track {i}', 'Things We Lost', 1000 + i) for i in range(4)])
+    assert fm._update_streaks(con, 'alice')
+    assert fm._update_streaks(con, 'alice') is False  # nothing queued
+    state, runs = streaks(con, 'alice')
+    assert ('alice', 'artist', 'low', '', 'Low', 'Low', 4, 1000, 1003) in state
+    assert runs == []  # shorter than STREAK_MIN_RUN
+
+    scrobble(con, 'alice', [('Low', f'Track {i}', 'Things We Lost', 1004 + i) for i in range(3)]
+             + [('Yo La Tengo', 'Sugarcube', 'I Can Hear', 1010)])
+    assert fm._update_streaks(con, 'alice')
+    incremental = streaks(con, 'alice')
+    state, runs = incremental
+    assert ('alice', 'artist', 'yo la tengo', '', 'Yo La Tengo', 'Yo La Tengo', 1, 1010, 1010) in state
+    assert ('alice', 'artist', 1000, 'low', '', 'Low', 'Low', 7, 1006) in runs
+    assert ('alice', 'album', 1000, 'low', 'things we lost', 'Low', 'Things We Lost', 7, 1006) in runs
+
+    # Replaying everything from scratch gives the same state and runs
+    con.execute('INSERT INTO streak_dirty (lfm_username, from_ts) VALUES (?, 0)', ('alice',))
+    assert fm._update_streaks(con, 'alice')
+    assert streaks(con, 'alice') == incremental
+
+
+def test_update_streaks_replays_when_older_plays_arrive(con):
+    scrobble(con, 'bob', [('Low', 'Words', 'I Could Live in Hope', 2000 + 2 * i) for i in range(6)])
+    fm._update_streaks(con, 'bob')
+    # A repaired hole in the middle of the run splits it
+    scrobble(con, 'bob', [('Slint', 'Breadcrumb Trail', 'Spiderland', 2005)])
+    fm._update_streaks(con, 'bob')
+    state, runs = streaks(con, 'bob')
+    assert [r[7] for r in runs if r[1] == 'artist'] == []  # neither half reaches STREAK_MIN_RUN
+    assert ('bob', 'artist', 'low', '', 'Low', 'Low', 3, 2006, 2010) in state
@@ -0,0 +1,104 @@
+import math
+import random
+from collections import defaultdict
+
+import pytest
+
+from cogs import fm
+
+np = pytest.importorskip('numpy')
+
+
+def vectors(n_users, n_artists, seed):
+    """TasteVectors over a few overlapping taste clusters, with a handful of
+    artists everybody plays so both the pairwise and the dense paths run."""
+    rng = random.Random(seed)
+    out = []
+    for u in range(n_users):
+        cluster = range((u % 4) * n_artists // 4, (u % 4 + 1) * n_artists // 4)
+        ids = set(rng.sample(cluster, rng.randint(5, len(cluster) // 2))) | {0, 1, 2}
+        ids |= set(rng.sample(range(n_artists), 3))
+        plays = {a: int(rng.paretovariate(1.1) * 3) for a in ids}
+        out.append(plays)
+    return out
+
+
+def taste_vector(plays):
+    ids = sorted(plays)
+    return fm.TasteVector(np.array(ids, np.int32), np.array([plays[a] for a in ids], np.int32))
+
+
+def test_taste_similarity_matches_brute_force(monkeypatch):
+    monkeypatch.setattr(fm, 'TASTE_DENSE_MIN', 8)
+    monkeypatch.setattr(fm, 'TASTE_CHUNK', 3)
+    users = vectors(30, 80, seed=24)
+    cosine, jaccard = fm._taste_similarity([taste_vector(p) for p in users])
+
+    def level(n):
+        return min(fm.TASTE_LEVELS, int(math.log2(n)) + 1)
+
+    for i, a in enumerate(users):
+        for j, b in enumerate(users):
+            if i == j:
+                assert cosine[i, j] == jaccard[i, j] == 0
+                continue
+            dot = sum(math.log1p(a[k]) * math.log1p(b[k]) for k in a.keys() & b.keys())
+            norm = math.sqrt(sum(math.log1p(n) ** 2 for n in a.values()) * sum(math.log1p(n) ** 2 for n in b.values()))
+            both = a.keys() | b.keys()
+            mins = sum(min(level(a.get(k, 1)) * (k in a), level(b.get(k, 1)) * (k in b)) for k in both)
+            maxes = sum(max(level(a.get(k, 1)) * (k in a), level(b.get(k, 1)) * (k in b)) for k in both)
+            assert cosine[i, j] == pytest.approx(dot / norm, rel=1e-5)
+            assert jaccard[i, j] == pytest.approx(mins / maxes, rel=1e-6)
+
+
+def stored(con):
+    lists = defaultdict(dict)
+    for ak, nk, score in con.execute('SELECT artist_key, neighbour_key, score FROM artist_neighbours'):
+        lists[ak][nk] = score
+    return lists
+
+
+def update(con, users, targets=None):
+    """Rebuild `targets` (None for everything) the way _update_recommendations
+    does, from and into artist_neighbours."""
+    listed = targets and {t: [int(a) for a, in con.execute(fm.SQL_NEIGHBOUR_OF, (str(t),))] for t in targets}
+    floors = targets and {
+        int(ak): score for ak, score in con.execute(
+            'SELECT artist_key, MIN(score) FROM artist_neighbours GROUP BY artist_key HAVING COUNT(*) >= ?',
+            (fm.REC_NEIGHBOURS,)
+        )
+    }
+    lists, rescored = fm._item_neighbours([taste_vector(p) for p in users], targets, listed, floors)
+    fm._store_neighbours(
+        con,
+        {str(a): [(str(n), score) for n, score in neighbours] for a, neighbours in lists.items()},
+        [(str(a), str(b), score) for a, b, score in rescored],
+        []
+    )
+
+
+def test_incremental_item_neighbours_equal_a_full_rebuild(con, monkeypatch):
+    monkeypatch.setattr(fm, 'REC_NEIGHBOURS', 6)
+    monkeypatch.setattr(fm, 'REC_CHUNK', 4)
+    monkeypatch.setattr(fm, 'REC_CHUNK_ENTRIES', 400)
+    users = vectors(40, 120, seed=25)
+    update(con, users)
+    assert len(stored(con)) > 100
+
+    # A few users' plays change, including an artist nobody had played
+    rng = random.Random(7)
+    changed = set()
+    for u in (0, 5, 17):
+        for a in rng.sample(range(121), 8) + [120]:
+            users[u][a] = users[u].get(a, 0) + rng.randint(1, 40)
+            changed.add(a)
+    update(con, users, sorted(changed))
+    incremental = stored(con)
+
+    con.execute('DELETE FROM artist_neighbours')
+    update(con, users)
+    full = stored(con)
+    assert incremental.keys() == full.keys()
+    for ak, neighbours in full.items():
+        assert incremental[ak].keys() == neighbours.keys(), ak
+        assert list(incremental[ak].values()) == pytest.approx(list(neighbours.values()), abs=1e-6)